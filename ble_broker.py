@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Run the BLE event broker, or talk to a running one.
+
+serve owns the dongle and publishes its events on a unix socket; listen
+prints events from a running broker, call runs one API call through it.
+
+Examples:
+    ./ble_broker.py serve /dev/ttyACM0 --socket /tmp/ble_broker.sock
+    ./ble_broker.py listen --event adv_report --addr C0:11:22:33:44:55
+    ./ble_broker.py call scan_start interval_ms=100 window_ms=50
+    ./ble_broker.py call gattc_read conn_handle=0 handle=3
+"""
+import argparse
+import json
+import sys
+import time
+sys.path.append('/data/usr/lib/python3/site-packages')
+
+from pc_ble_driver_py.broker import EVENTS, BrokerClient, BrokerError
+
+DEFAULT_SOCKET = '/tmp/ble_broker.sock'
+
+
+def cmd_serve(args):
+    from pc_ble_driver_py.adapter_pool import default_setup
+    from pc_ble_driver_py.ble_driver import BLEDriver
+    from pc_ble_driver_py.broker import BrokerServer
+
+    ble_driver = BLEDriver(serial_port=args.serial_port, baud_rate=args.baud)
+    server = BrokerServer(ble_driver, args.socket, args.max_buffer)
+    ble_driver.observer_register(server)
+    ble_driver.open()
+    default_setup(ble_driver, args.connections)
+    server.start()
+    print(f"Broker for {args.serial_port} on {args.socket} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(args.interval)
+            stats = server.stats()
+            print(f"published {stats['published']}, calls {stats['calls']}, clients "
+                  + (', '.join(f"{c['fd']}: sent {c['sent']} dropped {c['dropped']}" for c in stats['clients'])
+                     or 'none'))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        ble_driver.close()
+
+
+def cmd_listen(args):
+    try:
+        client = BrokerClient(args.socket, args.event or None, args.addr or None)
+    except OSError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    try:
+        while True:
+            name, event = client.recv()
+            print(f"{time.strftime('%H:%M:%S')} {name:<13} {event}")
+    except (KeyboardInterrupt, BrokerError) as e:
+        if isinstance(e, BrokerError):
+            print(f"Error: {e}")
+    finally:
+        client.close()
+
+
+def parse_value(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def cmd_call(args):
+    kwargs = {}
+    for item in args.args:
+        key, _, value = item.partition('=')
+        kwargs[key] = parse_value(value)
+    try:
+        client = BrokerClient(args.socket, events=[])
+        print(client.call(args.method, timeout=args.timeout, **kwargs))
+    except (OSError, BrokerError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Share one BLE dongle between processes')
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--socket', default=DEFAULT_SOCKET, help=f'Broker socket (default: {DEFAULT_SOCKET})')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    serve = sub.add_parser('serve', parents=[common], help='Own the dongle and publish its events')
+    serve.add_argument('serial_port', help='Connectivity dongle, e.g. /dev/ttyACM0')
+    serve.add_argument('-b', '--baud', type=int, default=1000000, help='Baud rate (default: 1000000)')
+    serve.add_argument('-c', '--connections', type=int, default=4, help='Central links to enable (default: 4)')
+    serve.add_argument('--max-buffer', type=int, default=1 << 20,
+                       help='Bytes buffered per client before events are dropped (default: 1048576)')
+    serve.add_argument('-i', '--interval', type=float, default=10.0, help='Seconds between stats lines (default: 10)')
+    serve.set_defaults(func=cmd_serve)
+
+    listen = sub.add_parser('listen', parents=[common], help='Print events from a running broker')
+    listen.add_argument('--event', action='append', choices=sorted(EVENTS), help='Event to receive (repeatable)')
+    listen.add_argument('--addr', action='append', help='Peer address to receive events for (repeatable)')
+    listen.set_defaults(func=cmd_listen)
+
+    call = sub.add_parser('call', parents=[common], help='Run an API call through a running broker')
+    call.add_argument('method', help='e.g. scan_start, scan_stop, connect, gattc_read')
+    call.add_argument('args', nargs='*', help='key=value arguments, values parsed as JSON where possible')
+    call.add_argument('-t', '--timeout', type=float, default=10.0, help='Seconds to wait for the result (default: 10)')
+    call.set_defaults(func=cmd_call)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
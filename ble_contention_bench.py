@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Measure BLEDriver API latency while several threads use one dongle.
+
+Every --peer gets its own thread issuing GATT reads back to back (each read
+waits for its read response), while a control thread repeatedly calls
+ble_version_get() and, with --scan, another thread toggles scanning.  With
+one lock around every API call the control thread stalls behind each read;
+with per-connection ordering and a transport-only lock it should only wait
+for the round-trip that is actually on the wire.
+
+Examples:
+    ./ble_contention_bench.py /dev/ttyACM0 -d 20
+    ./ble_contention_bench.py /dev/ttyACM0 --peer C0:11:22:33:44:55 --peer D4:11:22:33:44:66 --handle 3 --scan
+"""
+import argparse
+import collections
+import statistics
+import sys
+import threading
+import time
+sys.path.append('/data/usr/lib/python3/site-packages')
+
+from pc_ble_driver_py.adapter_pool import default_setup
+from pc_ble_driver_py.ble_driver import BLEDriver, BLEGapAddr, BLEGapScanParams
+from pc_ble_driver_py.observers import BLEDriverObserver
+
+
+class BenchObserver(BLEDriverObserver):
+    def __init__(self):
+        super(BenchObserver, self).__init__()
+        self.connected = {}
+        self.read_done = collections.defaultdict(threading.Event)
+        self.conn_event = threading.Condition()
+
+    def on_gap_evt_connected(self, ble_driver, conn_handle, peer_addr, role, conn_params):
+        with self.conn_event:
+            self.connected[tuple(peer_addr.addr)] = conn_handle
+            self.conn_event.notify_all()
+
+    def on_gattc_evt_read_rsp(self, ble_driver, conn_handle, status, error_handle, attr_handle, offset, data):
+        self.read_done[conn_handle].set()
+
+
+def parse_addr(text):
+    return BLEGapAddr(BLEGapAddr.Types.random_static, [int(b, 16) for b in text.split(':')])
+
+
+def timed_loop(name, call, stop, results):
+    samples = results[name]
+    errors = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            call()
+        except Exception:
+            errors += 1
+            continue
+        samples.append(time.perf_counter() - start)
+    results[name + ' errors'] = errors
+
+
+def report(results, duration):
+    print(f"\n{'caller':<24} {'calls':>7} {'calls/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'errors':>6}")
+    for name, samples in results.items():
+        if name.endswith(' errors'):
+            continue
+        errors = results.get(name + ' errors', 0)
+        if not samples:
+            print(f"{name:<24} {0:>7} {'-':>8} {'-':>8} {'-':>8} {'-':>8} {errors:>6}")
+            continue
+        ordered = sorted(samples)
+        p95 = ordered[int(0.95 * (len(ordered) - 1))]
+        print(f"{name:<24} {len(samples):>7} {len(samples) / duration:>8.1f} "
+              f"{statistics.median(ordered) * 1000:>8.2f} {p95 * 1000:>8.2f} "
+              f"{ordered[-1] * 1000:>8.2f} {errors:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='BLEDriver API contention benchmark')
+    parser.add_argument('serial_port', help='Connectivity dongle, e.g. /dev/ttyACM0')
+    parser.add_argument('-b', '--baud', type=int, default=1000000, help='Baud rate (default: 1000000)')
+    parser.add_argument('-d', '--duration', type=float, default=10.0, help='Seconds to run (default: 10)')
+    parser.add_argument('--peer', action='append', default=[],
+                        help='Peer address to connect to and read from (repeatable)')
+    parser.add_argument('--handle', type=int, default=3, help='Attribute handle to read (default: 3)')
+    parser.add_argument('--scan', action='store_true', help='Also toggle scanning from a separate thread')
+    parser.add_argument('--control-threads', type=int, default=1,
+                        help='Threads calling ble_version_get (default: 1)')
+
+    args = parser.parse_args()
+
+    ble_driver = BLEDriver(serial_port=args.serial_port, baud_rate=args.baud)
+    observer = BenchObserver()
+    ble_driver.observer_register(observer)
+    ble_driver.open()
+    default_setup(ble_driver, max(1, len(args.peer)))
+
+    try:
+        handles = []
+        for peer in args.peer:
+            addr = parse_addr(peer)
+            ble_driver.ble_gap_connect(addr, tag=1)
+            with observer.conn_event:
+                if not observer.conn_event.wait_for(lambda: tuple(addr.addr) in observer.connected, timeout=10):
+                    print(f"Error: timed out connecting to {peer}")
+                    sys.exit(1)
+            handles.append(observer.connected[tuple(addr.addr)])
+            print(f"Connected to {peer} (conn_handle {handles[-1]})")
+
+        def gatt_read(conn_handle):
+            done = observer.read_done[conn_handle]
+            done.clear()
+            ble_driver.ble_gattc_read(conn_handle, args.handle, 0)
+            if not done.wait(2.0):
+                raise TimeoutError()
+
+        def scan_toggle():
+            ble_driver.ble_gap_scan_start(BLEGapScanParams(interval_ms=100, window_ms=50, timeout_s=0))
+            ble_driver.ble_gap_scan_stop()
+
+        stop = threading.Event()
+        results = collections.OrderedDict()
+        callers = []
+        for conn_handle in handles:
+            callers.append((f'gattc_read conn {conn_handle}', lambda c=conn_handle: gatt_read(c)))
+        for i in range(args.control_threads):
+            callers.append((f'version_get #{i}', ble_driver.ble_version_get))
+        if args.scan:
+            callers.append(('scan start/stop', scan_toggle))
+
+        threads = []
+        for name, call in callers:
+            results[name] = []
+            t = threading.Thread(target=timed_loop, args=(name, call, stop, results), name=name)
+            t.daemon = True
+            threads.append(t)
+
+        print(f"Running {len(threads)} threads for {args.duration:.0f} s...")
+        start = time.monotonic()
+        for t in threads:
+            t.start()
+        time.sleep(args.duration)
+        stop.set()
+        for t in threads:
+            t.join(5)
+        report(results, time.monotonic() - start)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ble_driver.close()
+
+
+if __name__ == "__main__":
+    main()
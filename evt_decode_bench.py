@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Compare decoding BLE events through the SWIG proxies with the raw-buffer
+decoder (pc_ble_driver_py.evt_decoder).
+
+Builds adv report and HVX events in a SWIG ble_evt_t, then times what the
+dispatcher does per event: the proxy path reads every field through the
+attribute chain like ble_event_handler_sync, the raw path copies the event
+into a slab slot and unpacks it with struct like ble_event_handler_raw.
+No dongle is needed, only the driver library.
+
+Examples:
+    ./evt_decode_bench.py
+    ./evt_decode_bench.py -n 50000 --adv-len 31
+"""
+import argparse
+import sys
+import time
+sys.path.append('/data/usr/lib/python3/site-packages')
+
+import pc_ble_driver_py.ble_driver_types as util
+from pc_ble_driver_py.ble_driver import (BLEAdvData, BLEGapAddr, BLEGapAdvType, BLEGattHVXType,
+                                         driver, nrf_sd_ble_api_ver)
+from pc_ble_driver_py.evt_decoder import RawEventDecoder
+
+ADDR = [0xC0, 0x11, 0x22, 0x33, 0x44, 0x55]
+
+
+def adv_payload(length):
+    name = b'NUC980-bench'[:max(0, length - 5)]
+    data = bytes([2, 0x01, 0x06, len(name) + 1, 0x09]) + name
+    return list((data + bytes(length))[:length])
+
+
+def make_adv_report(decoder, adv_len):
+    evt = driver.ble_evt_t()
+    evt.header.evt_id = driver.BLE_GAP_EVT_ADV_REPORT
+    evt.header.evt_len = decoder.decoders[driver.BLE_GAP_EVT_ADV_REPORT][0]
+    evt.evt.gap_evt.conn_handle = 0xFFFF
+    report = evt.evt.gap_evt.params.adv_report
+    report.peer_addr.addr_type = 1
+    addr = util.list_to_uint8_array(ADDR[::-1])
+    report.peer_addr.addr = addr.cast()
+    report.rssi = -60
+    report.scan_rsp = 0
+    report.type = 0
+    data = util.list_to_uint8_array(adv_payload(adv_len))
+    report.dlen = adv_len
+    report.data = data.cast()
+    # Keep the arrays alive as long as the event
+    return evt, (addr, data)
+
+
+def make_hvx(decoder, length):
+    evt = driver.ble_evt_t()
+    evt.header.evt_id = driver.BLE_GATTC_EVT_HVX
+    evt.header.evt_len = decoder.decoders[driver.BLE_GATTC_EVT_HVX][0] + length
+    evt.evt.gattc_evt.conn_handle = 0
+    evt.evt.gattc_evt.gatt_status = 0
+    hvx = evt.evt.gattc_evt.params.hvx
+    hvx.handle = 0x0010
+    hvx.type = driver.BLE_GATT_HVX_NOTIFICATION
+    hvx.len = length
+    # data[1] is a flexible array: write past it into the event buffer
+    data = driver.uint8_array.frompointer(hvx.data)
+    for i in range(length):
+        data[i] = i & 0xFF
+    return evt, None
+
+
+def proxy_adv_report(ble_event):
+    report = ble_event.evt.gap_evt.params.adv_report
+    adv_type = None
+    if not report.scan_rsp:
+        adv_type = BLEGapAdvType(report.type)
+    return (ble_event.evt.gap_evt.conn_handle, BLEGapAddr.from_c(report.peer_addr),
+            report.rssi, adv_type, BLEAdvData.from_c(report))
+
+
+def proxy_hvx(ble_event):
+    gattc_evt = ble_event.evt.gattc_evt
+    hvx = gattc_evt.params.hvx
+    return (gattc_evt.conn_handle, gattc_evt.gatt_status, gattc_evt.error_handle, hvx.handle,
+            BLEGattHVXType(hvx.type), util.uint8_array_to_list(hvx.data, hvx.len))
+
+
+def raw_adv_report(decoder, ble_event):
+    raw_event = decoder.capture(ble_event)
+    try:
+        evt = decoder.decode(raw_event)
+        adv_type = None if evt.scan_rsp else BLEGapAdvType(evt.adv_type)
+        return (evt.conn_handle, BLEGapAddr.from_bytes(evt.addr_type, evt.addr),
+                evt.rssi, adv_type, BLEAdvData.from_bytes(evt.data))
+    finally:
+        decoder.release(raw_event)
+
+
+def raw_hvx(decoder, ble_event):
+    raw_event = decoder.capture(ble_event)
+    try:
+        evt = decoder.decode(raw_event)
+        return (evt.conn_handle, evt.gatt_status, evt.error_handle, evt.handle,
+                BLEGattHVXType(evt.hvx_type), list(evt.data))
+    finally:
+        decoder.release(raw_event)
+
+
+def comparable(values):
+    return [vars(v) if hasattr(v, '__dict__') else v for v in values]
+
+
+def timed(fn, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SWIG proxy vs raw-buffer event decoding')
+    parser.add_argument('-n', '--count', type=int, default=20000, help='Events per case (default: 20000)')
+    parser.add_argument('--adv-len', type=int, default=31, help='Advertising data bytes (default: 31)')
+    parser.add_argument('--hvx-len', type=int, default=20, help='Notification payload bytes (default: 20)')
+
+    args = parser.parse_args()
+
+    decoder = RawEventDecoder(driver, nrf_sd_ble_api_ver)
+    adv_evt, adv_keep = make_adv_report(decoder, args.adv_len)
+    hvx_evt, _ = make_hvx(decoder, args.hvx_len)
+
+    cases = [
+        ('adv_report', adv_evt, proxy_adv_report, raw_adv_report),
+        ('hvx', hvx_evt, proxy_hvx, raw_hvx),
+    ]
+    print(f"SD API v{nrf_sd_ble_api_ver}, {args.count} events per case\n")
+    print(f"{'event':<12} {'proxy us':>9} {'raw us':>9} {'speedup':>8}  check")
+    for name, evt, proxy, raw in cases:
+        # Both paths must agree before timing means anything
+        expected = proxy(evt)
+        got = raw(decoder, evt)
+        same = comparable(expected) == comparable(got)
+        proxy_us = timed(lambda: proxy(evt), args.count)
+        raw_us = timed(lambda: raw(decoder, evt), args.count)
+        print(f"{name:<12} {proxy_us:>9.2f} {raw_us:>9.2f} {proxy_us / raw_us:>7.1f}x  "
+              f"{'ok' if same else 'MISMATCH'}")
+        if not same:
+            print(f"  proxy: {expected!r}\n  raw:   {got!r}")
+    print(f"\nDecoder: {decoder.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Build a precompiled zipapp for one of our entry points (e.g. ble_scanner.py).
+
+The bundle contains sourceless, optimised bytecode for the entry script and
+every pure-Python module it pulls in from the site-packages directories we
+deploy to /data.  Extension modules (the SWIG _nrf_ble_driver_*.so files)
+cannot be imported from a zip, so they stay on disk; the bundle extends the
+owning package's __path__ to point at them at startup.
+
+Usage:
+    ./make_bundle.py ble_scanner.py -o /data/ble_scanner.pyz
+    python3 /data/ble_scanner.pyz /dev/ttyACM0
+
+The bytecode is only valid for the interpreter version that built it, so
+build with the same Python as the target (3.11 on the NUC980).
+"""
+import argparse
+import importlib.util
+import json
+import marshal
+import modulefinder
+import os
+import sys
+import time
+import zipfile
+
+DEFAULT_SITE_DIR = '/data/usr/lib/python3/site-packages'
+LOCAL_SITE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'usr', 'lib', 'python3', 'site-packages')
+
+EXTENSION_SUFFIXES = ('.so', '.pyd')
+
+# Runs inside the bundle before the entry point.  Kept free of anything but
+# builtins/sys so it adds nothing to startup.
+BOOT_SOURCE = '''\
+import sys
+
+def boot():
+    import json
+    import pkgutil
+    manifest = json.loads(pkgutil.get_data(__name__, "bundle.json"))
+    site_dir = manifest["site_dir"]
+    if site_dir not in sys.path:
+        sys.path.append(site_dir)
+    for package, rel_dir in manifest["ext_packages"].items():
+        module = __import__(package, fromlist=["__path__"])
+        ext_dir = site_dir + "/" + rel_dir
+        if ext_dir not in module.__path__:
+            module.__path__.append(ext_dir)
+    return manifest
+'''
+
+MAIN_SOURCE = '''\
+import runpy
+import sys
+
+import _bundle_boot
+
+manifest = _bundle_boot.boot()
+sys.argv[0] = manifest["entry_name"]
+runpy.run_module("_bundle_entry", run_name="__main__")
+'''
+
+
+def compile_source(source, filename, optimize):
+    code = compile(source, filename, 'exec', dont_inherit=True, optimize=optimize)
+    # Sourceless pyc: magic, flags (0 = timestamp based), mtime, size, code.
+    # zipimport never validates the timestamp of a pyc without a source file.
+    header = importlib.util.MAGIC_NUMBER
+    header += (0).to_bytes(4, 'little')
+    header += int(time.time()).to_bytes(4, 'little')
+    header += (len(source) & 0xFFFFFFFF).to_bytes(4, 'little')
+    return header + marshal.dumps(code)
+
+
+def find_modules(entry, search_dirs, includes):
+    """Return {module_name: file} for every module under search_dirs."""
+    finder = modulefinder.ModuleFinder(path=search_dirs + sys.path)
+    finder.run_script(entry)
+    for name in includes:
+        finder.import_hook(name)
+
+    roots = [os.path.abspath(d) + os.sep for d in search_dirs]
+    found = {}
+    for name, module in finder.modules.items():
+        path = module.__file__
+        if not path or name == '__main__':
+            continue
+        path = os.path.abspath(path)
+        if any(path.startswith(root) for root in roots):
+            found[name] = path
+    missing = sorted({name.partition('.')[0] for name in finder.badmodules} -
+                     set(sys.stdlib_module_names))
+    return found, missing
+
+
+def extension_packages(modules, search_dirs):
+    """Packages that own an extension module and must see the on-disk dir."""
+    packages = {}
+    for name, path in modules.items():
+        if not path.endswith(EXTENSION_SUFFIXES):
+            continue
+        package = name.rpartition('.')[0]
+        if not package:
+            continue
+        for root in search_dirs:
+            rel_dir = os.path.relpath(os.path.dirname(path), root)
+            if not rel_dir.startswith(os.pardir):
+                packages[package] = rel_dir.replace(os.sep, '/')
+                break
+    return packages
+
+
+def build_bundle(entry, output, search_dirs, site_dir, includes=(), optimize=2):
+    modules, missing = find_modules(entry, search_dirs, list(includes))
+    ext_packages = extension_packages(modules, search_dirs)
+    manifest = {
+        'entry_name': os.path.basename(entry),
+        'site_dir': site_dir,
+        'ext_packages': ext_packages,
+        'python': '{}.{}'.format(*sys.version_info[:2]),
+        'optimize': optimize,
+    }
+
+    total = 0
+    with zipfile.ZipFile(output + '.tmp', 'w', zipfile.ZIP_STORED) as bundle:
+        def add(arcname, data):
+            nonlocal total
+            total += len(data)
+            bundle.writestr(arcname, data)
+
+        with open(entry, 'r') as f:
+            entry_source = f.read()
+        add('_bundle_entry.pyc', compile_source(entry_source, entry, optimize))
+        add('_bundle_boot.pyc', compile_source(BOOT_SOURCE, '_bundle_boot.py', optimize))
+        add('__main__.pyc', compile_source(MAIN_SOURCE, '__main__.py', optimize))
+        add('bundle.json', json.dumps(manifest, indent=1).encode())
+
+        for name, path in sorted(modules.items()):
+            if path.endswith(EXTENSION_SUFFIXES):
+                continue
+            arcname = name.replace('.', '/')
+            if os.path.basename(path).startswith('__init__.'):
+                arcname += '/__init__'
+            arcname += '.pyc'
+            if path.endswith('.pyc'):
+                # Already sourceless (as on the device); copy it as-is.
+                with open(path, 'rb') as f:
+                    add(arcname, f.read())
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                source = f.read()
+            add(arcname, compile_source(source, path, optimize))
+            print(f"  {arcname}")
+
+    os.replace(output + '.tmp', output)
+    os.chmod(output, 0o755)
+    return modules, ext_packages, missing, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a precompiled zipapp for an entry script')
+    parser.add_argument('entry', help='Entry script, e.g. ble_scanner.py')
+    parser.add_argument('-o', '--output', help='Output .pyz (default: <entry>.pyz)')
+    parser.add_argument('-s', '--search', action='append', default=[],
+                        help=f'Site-packages directory to bundle from (default: {LOCAL_SITE_DIR})')
+    parser.add_argument('--site-dir', default=DEFAULT_SITE_DIR,
+                        help=f'Where extension modules live on the target (default: {DEFAULT_SITE_DIR})')
+    parser.add_argument('-i', '--include', action='append', default=[],
+                        help='Extra module to bundle (for imports modulefinder cannot see)')
+    parser.add_argument('-O', '--optimize', type=int, default=2, choices=(0, 1, 2),
+                        help='Bytecode optimisation level (default: 2, strips docstrings)')
+
+    args = parser.parse_args()
+
+    output = args.output or os.path.splitext(args.entry)[0] + '.pyz'
+    search_dirs = args.search or [LOCAL_SITE_DIR]
+
+    print(f"Bundling {args.entry} -> {output} (Python {sys.version_info[0]}.{sys.version_info[1]}, -O{args.optimize})")
+    modules, ext_packages, missing, total = build_bundle(
+        args.entry, output, search_dirs, args.site_dir, args.include, args.optimize)
+
+    print(f"Modules bundled:   {sum(1 for p in modules.values() if not p.endswith(EXTENSION_SUFFIXES))}")
+    print(f"Bytecode size:     {total} bytes")
+    for package, rel_dir in ext_packages.items():
+        print(f"Extensions:        {package} -> {args.site_dir}/{rel_dir}")
+    if missing:
+        print(f"Not found (left to the target's sys.path): {', '.join(missing)}")
+
+
+if __name__ == "__main__":
+    main()
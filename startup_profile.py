@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Measure cold-start import cost, broken down per module.
+
+Runs the imports in a fresh interpreter under `-X importtime` and prints the
+slowest modules (self time), the per-package roll-up and the total wall
+time over a bare `python -c pass` baseline.
+
+Examples:
+    # Plain site-packages deployment
+    ./startup_profile.py pc_ble_driver_py.ble_driver -p /data/usr/lib/python3/site-packages
+
+    # Same imports from a bundle built with make_bundle.py
+    ./startup_profile.py pc_ble_driver_py.ble_driver --pyz /data/ble_scanner.pyz
+
+    # Force recompilation every run (what a read-only or fresh /data sees)
+    ./startup_profile.py pc_ble_driver_py.ble_driver -p ... --cold
+"""
+import argparse
+import collections
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ImportRecord = collections.namedtuple('ImportRecord', 'name self_us cumulative_us depth')
+
+
+def parse_importtime(stderr):
+    """Parse `-X importtime` output into ImportRecords (in import order)."""
+    records = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3:
+            continue
+        try:
+            self_us = int(fields[0])
+            cumulative_us = int(fields[1])
+        except ValueError:
+            continue  # header line
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        records.append(ImportRecord(name.strip(), self_us, cumulative_us, depth))
+    return records
+
+
+def build_code(modules, paths, pyz):
+    code = 'import sys\n'
+    if paths:
+        code += f'sys.path[:0] = {paths!r}\n'
+    if pyz:
+        code += f'sys.path.insert(0, {pyz!r})\nimport _bundle_boot\n_bundle_boot.boot()\n'
+    code += ''.join(f'import {m}\n' for m in modules)
+    return code
+
+
+def run_once(python, code, cold):
+    env = dict(os.environ)
+    cache_dir = None
+    if cold:
+        # An empty, private pycache forces every source module to compile.
+        cache_dir = tempfile.mkdtemp(prefix='startup_profile_')
+        env['PYTHONPYCACHEPREFIX'] = cache_dir
+    try:
+        start = time.monotonic()
+        proc = subprocess.run([python, '-X', 'importtime', '-c', code],
+                              capture_output=True, text=True, env=env)
+        wall = time.monotonic() - start
+    finally:
+        if cache_dir:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import failed:\n{proc.stderr.strip().splitlines()[-1]}")
+    return wall, parse_importtime(proc.stderr)
+
+
+def baseline(python, repeat):
+    walls = []
+    for _ in range(repeat):
+        start = time.monotonic()
+        subprocess.run([python, '-c', 'pass'], check=True)
+        walls.append(time.monotonic() - start)
+    return statistics.median(walls)
+
+
+def report(records, walls, base, top):
+    # Median self/cumulative time per module across runs
+    per_module = collections.defaultdict(list)
+    for run in records:
+        for rec in run:
+            per_module[rec.name].append(rec)
+
+    rows = []
+    for name, recs in per_module.items():
+        rows.append(ImportRecord(
+            name,
+            statistics.median(r.self_us for r in recs),
+            statistics.median(r.cumulative_us for r in recs),
+            recs[0].depth,
+        ))
+
+    wall = statistics.median(walls)
+    print(f"Wall time:        {wall * 1000:8.1f} ms  (baseline interpreter {base * 1000:.1f} ms)")
+    print(f"Import overhead:  {(wall - base) * 1000:8.1f} ms")
+    print(f"Modules imported: {len(rows)}")
+
+    print(f"\n=== Top {top} modules by self time ===")
+    print(f"{'self ms':>9} | {'cumul ms':>9} | module")
+    print("----------+-----------+--------------------------------")
+    for rec in sorted(rows, key=lambda r: r.self_us, reverse=True)[:top]:
+        print(f"{rec.self_us / 1000:9.2f} | {rec.cumulative_us / 1000:9.2f} | {rec.name}")
+
+    print("\n=== Self time by top-level package ===")
+    packages = collections.Counter()
+    for rec in rows:
+        packages[rec.name.partition('.')[0]] += rec.self_us
+    total = sum(packages.values()) or 1
+    for package, us in packages.most_common(top):
+        print(f"{us / 1000:9.2f} ms  {100.0 * us / total:5.1f}%  {package}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Break down Python start-up import cost per module')
+    parser.add_argument('modules', nargs='+', help='Modules to import, e.g. pc_ble_driver_py.ble_driver')
+    parser.add_argument('-p', '--path', action='append', default=[],
+                        help='Directory to prepend to sys.path (repeatable)')
+    parser.add_argument('--pyz', help='Import from a bundle built by make_bundle.py')
+    parser.add_argument('--cold', action='store_true',
+                        help='Ignore existing __pycache__ so source modules are compiled')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Number of runs; medians are reported (default: 5)')
+    parser.add_argument('-n', '--top', type=int, default=15,
+                        help='Rows to show per table (default: 15)')
+    parser.add_argument('--python', default=sys.executable,
+                        help='Interpreter to profile (default: this one)')
+
+    args = parser.parse_args()
+
+    code = build_code(args.modules, args.path, args.pyz)
+    walls = []
+    records = []
+    try:
+        for _ in range(args.repeat):
+            wall, recs = run_once(args.python, code, args.cold)
+            walls.append(wall)
+            records.append(recs)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    report(records, walls, baseline(args.python, args.repeat), args.top)
+
+
+if __name__ == "__main__":
+    main()
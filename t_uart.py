@@ -4,38 +4,40 @@ import threading
 import time
 import sys
 import argparse
+import queue
+
+from uart_rx import BulkReceiver, format_chunk
 
 # Shared variables
 received_data = bytearray()
 stop_thread = False
 
 def read_thread_func(ser, timeout_seconds):
-    """Thread function to read from serial port character by character"""
+    """Thread function to read from serial port until a newline arrives"""
     global received_data, stop_thread
     
+    receiver = BulkReceiver(ser, chunk_size=64)
+    receiver.start()
+    
     start_time = time.time()
-    char_count = 0
+    offset = 0
     
     while not stop_thread and (time.time() - start_time) < timeout_seconds:
-        # Read one byte at a time
-        if ser.in_waiting > 0:
-            byte = ser.read(1)
-            if byte:
-                char_count += 1
-                # Print character information
-                char_value = byte[0]
-                char_display = chr(char_value) if 32 <= char_value <= 126 else '.'
-                print(f"READ[{char_count}]: '{char_display}' (0x{char_value:02x})")
-                
-                # Store the byte
-                received_data.extend(byte)
-                
-                # Optional: stop after receiving newline
-                if byte == b'\n':
-                    break
-        else:
-            # Small delay to prevent CPU thrashing
-            time.sleep(0.01)
+        try:
+            chunk = receiver.queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+        print(format_chunk(chunk, offset))
+        offset += len(chunk)
+        
+        # Store the data
+        received_data.extend(chunk)
+        
+        # Optional: stop after receiving newline
+        if b'\n' in chunk:
+            break
+    
+    receiver.stop()
 
 def test_uart_loopback(port, baud_rate=115200, timeout_seconds=3):
     """Test UART loopback functionality"""
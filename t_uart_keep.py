@@ -6,42 +6,99 @@ import sys
 import argparse
 import queue
 
+from uart_capture import CaptureWriter
+from uart_framing import CODECS, FrameDecoder
+from uart_rx import BulkReceiver, format_chunk
+from uart_sender import FlowSender
+
 # Shared variables
 stop_threads = False
 rx_queue = queue.Queue()  # Queue for received data
 
-def receiver_thread_func(ser, port_name):
+def receiver_thread_func(ser, port_name, chunk_size=64, quiet=False, capture=None, codec=None):
     """Thread function to continuously read from serial port"""
     global stop_threads
     
-    char_count = 0
+    if codec:
+        framed_receiver(ser, port_name, chunk_size, quiet, codec)
+        return
+    
+    if capture:
+        # Raw bytes go straight into the capture ring from the receiver thread
+        receiver = BulkReceiver(ser, chunk_size=chunk_size, on_chunk=capture.append)
+        print(f"Receiver thread started for {port_name}, capturing to {capture.path}")
+        receiver.start()
+        while not stop_threads:
+            time.sleep(0.2)
+        receiver.stop()
+        print(f"Receiver thread for {port_name} stopped: {capture.write_total} bytes captured")
+        return
+    
+    receiver = BulkReceiver(ser, chunk_size=chunk_size, queue_size=1024)
+    offset = 0
     
     print(f"Receiver thread started for {port_name}")
+    receiver.start()
     
     while not stop_threads:
-        # Read one byte at a time
-        if ser.in_waiting > 0:
-            byte = ser.read(1)
-            if byte:
-                char_count += 1
-                # Print character information
-                char_value = byte[0]
-                char_display = chr(char_value) if 32 <= char_value <= 126 else '.'
-                print(f"READ[{char_count}]: '{char_display}' (0x{char_value:02x})")
-                
-                # Add to queue for processing if needed
-                rx_queue.put(byte)
-        else:
-            # Small delay to prevent CPU thrashing
-            time.sleep(0.01)
-    
-    print(f"Receiver thread for {port_name} stopped")
+        # Blocks until a chunk arrives instead of polling in_waiting
+        try:
+            chunk = receiver.queue.get(timeout=0.2)
+        except queue.Empty:
+            continue
+        if not quiet:
+            print(format_chunk(chunk, offset))
+        offset += len(chunk)
+        
+        # Add to queue for processing if needed
+        rx_queue.put(chunk)
+    
+    receiver.stop()
+    stats = receiver.stats()
+    print(f"Receiver thread for {port_name} stopped: {stats['bytes']} bytes in "
+          f"{stats['reads']} reads, {stats['chunks']} chunks, "
+          f"{stats['dropped_chunks']} chunks dropped")
 
-def sender_thread_func(ser, port_name, interval=1.0):
+def framed_receiver(ser, port_name, chunk_size, quiet, codec):
+    """Decode whole frames in the receiver thread instead of printing raw chunks"""
+    lock = threading.Lock()
+    
+    def on_frame(frame):
+        rx_queue.put(bytes(frame))
+        if not quiet:
+            print(f"FRAME[{decoder.stats['frames']}]: {bytes(frame).decode(errors='replace')}")
+    
+    def on_chunk(chunk):
+        with lock:
+            decoder.feed(chunk)
+    
+    decoder = FrameDecoder(codec, on_frame=on_frame)
+    receiver = BulkReceiver(ser, chunk_size=chunk_size, on_chunk=on_chunk)
+    print(f"Receiver thread started for {port_name}, {codec.name} framing")
+    receiver.start()
+    
+    last_bytes = 0
+    while not stop_threads:
+        time.sleep(0.2)
+        with lock:
+            # Line idle with a partial frame pending: assume it is junk
+            if decoder.pending() and decoder.stats['bytes'] == last_bytes:
+                decoder.resync()
+            last_bytes = decoder.stats['bytes']
+    
+    receiver.stop()
+    stats = decoder.stats
+    print(f"Receiver thread for {port_name} stopped: {stats['bytes']} bytes, {stats['frames']} frames, "
+          f"{stats['crc_errors']} CRC errors, {stats['skipped']} bytes skipped")
+
+def sender_thread_func(ser, port_name, interval=1.0, codec=None):
     """Thread function to periodically send test messages"""
     global stop_threads
     
     msg_count = 0
+    # Queued writes with output-queue backpressure instead of blind ser.write
+    flow = FlowSender(ser, ser.baudrate)
+    flow.start()
     
     print(f"Sender thread started for {port_name}")
     
@@ -52,14 +109,19 @@ def sender_thread_func(ser, port_name, interval=1.0):
         
         # Send the message
         print(f"SENDING[{msg_count}]: {test_msg.decode().strip()}")
-        ser.write(test_msg)
+        flow.send(codec.encode(test_msg.rstrip()) if codec else test_msg)
         
         # Wait for next interval
         time.sleep(interval)
     
-    print(f"Sender thread for {port_name} stopped")
+    flow.flush(timeout=1.0)
+    flow.stop()
+    stats = flow.stats()
+    print(f"Sender thread for {port_name} stopped: {stats['bytes']} bytes in {stats['writes']} writes, "
+          f"max output queue {stats['max_outq']} bytes, {stats['flow_stalls']} flow-control stalls")
 
-def test_uart_continuous(port, baud_rate=115200, send_interval=2.0, run_duration=30):
+def test_uart_continuous(port, baud_rate=115200, send_interval=2.0, run_duration=30, chunk_size=64, quiet=False,
+                         capture_file=None, capture_size=16, framing=None, rtscts=False):
     """Test UART with continuous sending and receiving"""
     global stop_threads
     
@@ -76,7 +138,7 @@ def test_uart_continuous(port, baud_rate=115200, send_interval=2.0, run_duration
             stopbits=serial.STOPBITS_ONE,
             timeout=0.5,  # Non-blocking reads
             xonxoff=False,
-            rtscts=False,
+            rtscts=rtscts,
             dsrdtr=False
         )
         
@@ -87,12 +149,17 @@ def test_uart_continuous(port, baud_rate=115200, send_interval=2.0, run_duration
         # Clear stop flag
         stop_threads = False
         
+        codec = CODECS[framing] if framing else None
+        capture = None
+        if capture_file:
+            capture = CaptureWriter(capture_file, capture_size * 1024 * 1024)
+        
         # Start receiver thread
-        receiver = threading.Thread(target=receiver_thread_func, args=(ser, port))
+        receiver = threading.Thread(target=receiver_thread_func, args=(ser, port, chunk_size, quiet, capture, codec))
         receiver.start()
         
         # Start sender thread
-        sender = threading.Thread(target=sender_thread_func, args=(ser, port, send_interval))
+        sender = threading.Thread(target=sender_thread_func, args=(ser, port, send_interval, codec))
         sender.start()
         
         # Run for specified duration or until Ctrl+C
@@ -116,6 +183,8 @@ def test_uart_continuous(port, baud_rate=115200, send_interval=2.0, run_duration
         if 'ser' in locals() and ser.is_open:
             ser.close()
             print(f"Closed {port}")
+        if 'capture' in locals() and capture:
+            capture.close()
 
 if __name__ == "__main__":
     # Set up argument parsing
@@ -128,8 +197,21 @@ if __name__ == "__main__":
                         help='Send interval in seconds (default: 2.0)')
     parser.add_argument('-d', '--duration', type=int, default=30,
                         help='Test duration in seconds (default: 30)')
+    parser.add_argument('-c', '--chunk', type=int, default=64,
+                        help='Receive chunk size in bytes (default: 64)')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='Do not print received chunks')
+    parser.add_argument('--capture', metavar='FILE',
+                        help='Record received bytes into a uart_capture.py ring file instead of printing them')
+    parser.add_argument('--capture-size', type=int, default=16,
+                        help='Capture ring size in MiB (default: 16)')
+    parser.add_argument('--framing', choices=sorted(CODECS),
+                        help='Send test messages as uart_framing.py frames and decode whole frames')
+    parser.add_argument('--rtscts', action='store_true',
+                        help='Enable RTS/CTS hardware flow control')
     
     args = parser.parse_args()
     
     # Run the test
-    test_uart_continuous(args.port, args.baud, args.interval, args.duration)
+    test_uart_continuous(args.port, args.baud, args.interval, args.duration, args.chunk, args.quiet,
+                         args.capture, args.capture_size, args.framing, args.rtscts)
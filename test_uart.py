@@ -28,14 +28,15 @@ def test_single_port_loopback(uart_dev: str, baud: int = 115200, timeout: float
         msg = b"Loopback Test\n"
         print(f"Sending: {msg.strip().decode()}")
 
-        # Send and allow time to loop back
+        # readline() returns as soon as the newline is back, no fixed sleep
+        start = time.perf_counter()
         ser.write(msg)
-        time.sleep(0.1)
 
         # Read back
         response = ser.readline()
+        elapsed = time.perf_counter() - start
         if response:
-            print(f"Received: {response.strip().decode()}")
+            print(f"Received: {response.strip().decode()} ({elapsed * 1000:.1f} ms round trip)")
             print("Loopback test: SUCCESS")
         else:
             print("Loopback test: FAILED (no data received)")
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+asyncio UART engine: many ports, one thread.
+
+Each port's fd is opened non-blocking and registered with the event loop
+(add_reader/add_writer), so a single thread services every UART without the
+per-port sender/receiver threads and global stop flags of the older tools.
+Writes go through a per-port queue with high/low water marks: await
+port.write(data) returns immediately while the queue is below the high
+mark and suspends the caller until the queue drains below the low mark
+otherwise.
+
+    engine = UartEngine()
+    s4 = engine.open('/dev/ttyS4', 115200, on_data=print)
+    await s4.write(b'hello\\n')
+
+Run as a script it streams the counting pattern out of every port and
+checks what comes back, e.g. with ttyS4 and ttyS5 cross-wired:
+
+    ./uart_async.py /dev/ttyS4 /dev/ttyS5 -b 921600 -d 30
+"""
+import argparse
+import asyncio
+import collections
+import os
+import sys
+import time
+
+from uart_rx import PATTERN, PatternChecker
+from uart_termios import configure
+
+
+def configure_raw(fd, baud):
+    """8N1 raw mode, no flow control, at baud."""
+    configure(fd, baud)
+
+
+class UartPort(object):
+    def __init__(self, loop, path, baud, on_data=None, read_size=4096,
+                 high_water=64 * 1024, low_water=16 * 1024, configure=True):
+        self.loop = loop
+        self.path = path
+        self.baud = baud
+        self.on_data = on_data
+        self.high_water = high_water
+        self.low_water = low_water
+
+        self.fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        if configure:
+            configure_raw(self.fd, baud)
+
+        self._rx_buf = bytearray(read_size)
+        self._rx_view = memoryview(self._rx_buf)
+        self._tx_queue = collections.deque()
+        self._tx_buffered = 0
+        self._writing = False
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self.closed = False
+
+        self.rx_bytes = 0
+        self.tx_bytes = 0
+        self.rx_reads = 0
+        self.write_stalls = 0
+
+        loop.add_reader(self.fd, self._on_readable)
+
+    def _on_readable(self):
+        try:
+            n = os.readv(self.fd, [self._rx_view])
+        except BlockingIOError:
+            return
+        except OSError as e:
+            print(f"{self.path}: read error: {e}")
+            self.close()
+            return
+        if n <= 0:
+            return
+        self.rx_reads += 1
+        self.rx_bytes += n
+        if self.on_data:
+            # The view is only valid for the duration of the callback
+            self.on_data(self, self._rx_view[:n])
+
+    @property
+    def tx_buffered(self):
+        return self._tx_buffered
+
+    async def write(self, data):
+        """Queue data; waits while the queue is above the high water mark."""
+        if self.closed:
+            raise ConnectionError(f"{self.path} is closed")
+        if self._tx_buffered >= self.high_water:
+            self.write_stalls += 1
+            await self._drained.wait()
+            if self.closed:
+                raise ConnectionError(f"{self.path} is closed")
+        self._tx_queue.append(memoryview(data))
+        self._tx_buffered += len(data)
+        if self._tx_buffered >= self.high_water:
+            self._drained.clear()
+        if not self._writing:
+            self._flush()
+
+    async def drain(self):
+        while self._tx_buffered:
+            if self.closed:
+                raise ConnectionError(f"{self.path} closed with {self._tx_buffered} bytes unsent")
+            self._drained.clear()
+            await self._drained.wait()
+
+    def _flush(self):
+        while self._tx_queue:
+            view = self._tx_queue[0]
+            try:
+                n = os.write(self.fd, view)
+            except BlockingIOError:
+                n = 0
+            except OSError as e:
+                print(f"{self.path}: write error: {e}")
+                self.close()
+                return
+            self.tx_bytes += n
+            self._tx_buffered -= n
+            if n < len(view):
+                self._tx_queue[0] = view[n:]
+                break
+            self._tx_queue.popleft()
+
+        if self._tx_queue and not self._writing:
+            self.loop.add_writer(self.fd, self._flush)
+            self._writing = True
+        elif not self._tx_queue and self._writing:
+            self.loop.remove_writer(self.fd)
+            self._writing = False
+
+        if self._tx_buffered <= self.low_water:
+            self._drained.set()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.loop.remove_reader(self.fd)
+        if self._writing:
+            self.loop.remove_writer(self.fd)
+        self._drained.set()
+        os.close(self.fd)
+
+
+class UartEngine(object):
+    def __init__(self, loop=None):
+        self.loop = loop or asyncio.get_running_loop()
+        self.ports = collections.OrderedDict()
+
+    def open(self, path, baud=115200, on_data=None, **kwargs):
+        port = UartPort(self.loop, path, baud, on_data=on_data, **kwargs)
+        self.ports[path] = port
+        return port
+
+    def close(self):
+        for port in self.ports.values():
+            port.close()
+        self.ports.clear()
+
+
+async def stream_pattern(port, duration, block_size):
+    block = PATTERN * max(1, block_size // 256)
+    end = time.monotonic() + duration
+    while time.monotonic() < end and not port.closed:
+        await port.write(block)
+    await port.drain()
+
+
+async def run_pattern_test(paths, baud, duration, block_size):
+    engine = UartEngine(asyncio.get_running_loop())
+    checkers = {}
+
+    def on_data(port, data):
+        checkers[port.path](data)
+
+    for path in paths:
+        checkers[path] = PatternChecker(4096)
+        engine.open(path, baud, on_data=on_data)
+
+    start = time.monotonic()
+    try:
+        await asyncio.gather(*(stream_pattern(p, duration, block_size) for p in engine.ports.values()))
+        # Let the tail arrive
+        await asyncio.sleep(0.5 + 2 * block_size * 10.0 / baud)
+    finally:
+        elapsed = time.monotonic() - start
+        ports = list(engine.ports.values())
+        engine.close()
+
+    line_rate = baud / 10.0
+    ok = True
+    print(f"\n{'port':<14} {'tx kB/s':>9} {'rx kB/s':>9} {'% line':>7} {'reads':>8} {'stalls':>7} {'gaps':>5}")
+    for port in ports:
+        checker = checkers[port.path]
+        rx_time = (checker.last - checker.first) if checker.first else 0
+        rx_rate = checker.bytes / rx_time if rx_time else 0
+        print(f"{port.path:<14} {port.tx_bytes / elapsed / 1000:>9.1f} {rx_rate / 1000:>9.1f} "
+              f"{100.0 * rx_rate / line_rate:>6.1f}% {port.rx_reads:>8} {port.write_stalls:>7} {checker.gaps:>5}")
+        ok = ok and checker.gaps == 0 and checker.bytes > 0
+    total_tx = sum(p.tx_bytes for p in ports)
+    total_rx = sum(c.bytes for c in checkers.values())
+    print(f"Total: sent {total_tx} bytes, received {total_rx} bytes")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Drive several UARTs from one asyncio loop')
+    parser.add_argument('ports', nargs='+', help='Serial ports, e.g. /dev/ttyS4 /dev/ttyS5')
+    parser.add_argument('-b', '--baud', type=int, default=115200, help='Baud rate (default: 115200)')
+    parser.add_argument('-d', '--duration', type=float, default=10.0, help='Seconds to transmit (default: 10)')
+    parser.add_argument('-w', '--write-size', type=int, default=4096, help='Bytes per write (default: 4096)')
+
+    args = parser.parse_args()
+
+    try:
+        ok = asyncio.run(run_pattern_test(args.ports, args.baud, args.duration, args.write_size))
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        print("\nInterrupted")
+        sys.exit(1)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Hardware-free UART benchmark suite.
+
+Starts uart_sim.py's virtual ports for each case and runs the unmodified
+UART tools against them as subprocesses, then prints one summary table.
+Cases with injected loss or corruption are expected to make the checker
+fail; the point is that it notices.
+
+    ./uart_bench.py                 # whole suite
+    ./uart_bench.py -k ber -d 3     # cases whose name contains "ber"
+    ./uart_bench.py --list
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from uart_sim import Impairments, UartSimulator
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# name, tool argv (A/B are replaced by the port paths), links, impairments,
+# expected exit status
+CASES = [
+    ('throughput-115200', ['uart_throughput.py', 'A', '--rx', 'B', '-b', '115200'], 2,
+     dict(baud=115200), 0),
+    ('throughput-921600', ['uart_throughput.py', 'A', '--rx', 'B', '-b', '921600'], 2,
+     dict(baud=921600), 0),
+    ('throughput-loopback', ['uart_throughput.py', 'A', '-b', '115200'], 1,
+     dict(baud=115200), 0),
+    ('ber-prbs-clean', ['uart_ber.py', 'A', '--rx', 'B', '-b', '460800'], 2,
+     dict(baud=460800), 0),
+    ('ber-prbs-corrupt', ['uart_ber.py', 'A', '--rx', 'B', '-b', '460800'], 2,
+     dict(baud=460800, corrupt=1e-4), 1),
+    ('ber-prbs-loss', ['uart_ber.py', 'A', '--rx', 'B', '-b', '460800'], 2,
+     dict(baud=460800, loss=1e-4), 1),
+    ('ber-frame-latency', ['uart_ber.py', 'A', '--rx', 'B', '-b', '115200', '-m', 'frame'], 2,
+     dict(baud=115200, latency=0.005), 0),
+    ('async-pair', ['uart_async.py', 'A', 'B', '-b', '921600'], 2,
+     dict(baud=921600), 0),
+]
+
+
+def run_case(case, duration, seed, python):
+    name, argv, links, imp_args, expected = case
+    tmp = tempfile.mkdtemp(prefix='uart_bench_')
+    paths = [os.path.join(tmp, 'ttyA'), os.path.join(tmp, 'ttyB')][:links]
+    sim = UartSimulator(paths, Impairments(seed=seed, **imp_args))
+    sim.start()
+
+    cmd = [python, os.path.join(HERE, argv[0])]
+    cmd += [{'A': paths[0], 'B': paths[-1]}.get(a, a) for a in argv[1:]]
+    cmd += ['-d', str(duration)]
+    start = time.monotonic()
+    try:
+        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=duration * 4 + 30)
+        status, output = proc.returncode, proc.stdout + proc.stderr
+    except subprocess.TimeoutExpired as e:
+        status, output = None, (e.stdout or b'').decode(errors='replace')
+    elapsed = time.monotonic() - start
+    sim.stop()
+    os.rmdir(tmp)
+
+    injected = sum(s[3] + s[4] for s in sim.stats())
+    return {
+        'name': name,
+        'status': status,
+        'expected': expected,
+        'elapsed': elapsed,
+        'injected': injected,
+        'output': output,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the UART tools against simulated ports')
+    parser.add_argument('-d', '--duration', type=int, default=5, help='Seconds per case (default: 5)')
+    parser.add_argument('-k', '--keyword', help='Only run cases whose name contains this')
+    parser.add_argument('--seed', type=int, default=1, help='Error injection seed (default: 1)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Show full tool output')
+    parser.add_argument('--list', action='store_true', help='List cases and exit')
+    parser.add_argument('--python', default=sys.executable, help='Interpreter for the tools')
+
+    args = parser.parse_args()
+
+    cases = [c for c in CASES if not args.keyword or args.keyword in c[0]]
+    if args.list:
+        for name, argv, links, imp_args, expected in cases:
+            print(f"{name:<22} {' '.join(argv):<50} {imp_args}")
+        return
+
+    results = []
+    for case in cases:
+        print(f"Running {case[0]}...", flush=True)
+        result = run_case(case, args.duration, args.seed, args.python)
+        results.append(result)
+        lines = result['output'].strip().splitlines()
+        for line in (lines if args.verbose else lines[-6:]):
+            print(f"    {line}")
+
+    print(f"\n{'case':<22} {'exit':>5} {'expect':>7} {'injected':>9} {'time s':>7}  result")
+    failed = 0
+    for r in results:
+        ok = r['status'] == r['expected']
+        failed += not ok
+        print(f"{r['name']:<22} {str(r['status']):>5} {r['expected']:>7} {r['injected']:>9} "
+              f"{r['elapsed']:>7.1f}  {'ok' if ok else 'FAILED'}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
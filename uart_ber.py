@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""
+UART loopback link-quality tester: bit error rate, loss and throughput.
+
+Two pattern modes:
+
+  prbs   a PRBS-15 byte stream.  The checker locks onto the sequence, counts
+         bit errors against the expected bytes, and on a slip re-locks and
+         reports how many bytes were lost or duplicated.
+  frame  sequence-numbered frames (sync, seq, send time, payload, CRC-16).
+         Reports lost/duplicated/corrupt frames and loopback latency.
+         Frames are paced to --load of the line rate (default 50%) so the
+         latency is the link's, not time spent queued in kernel buffers;
+         --load 1 sends flat out.
+
+Throughput and errors are printed every second.  --sweep runs every baud
+rate from 19200 to 1M with and without RTS/CTS and prints a summary table.
+
+    ./uart_ber.py /dev/ttyS4 -b 115200 -d 10
+    ./uart_ber.py /dev/ttyS4 --rx /dev/ttyS5 --mode frame -b 921600
+    ./uart_ber.py /dev/ttyS4 --sweep -d 5
+"""
+import argparse
+import binascii
+import statistics
+import struct
+import sys
+import threading
+import time
+
+import serial
+
+from uart_rx import BulkReceiver
+
+SWEEP_BAUDS = [19200, 38400, 57600, 115200, 230400, 460800, 921600, 1000000]
+SWEEP_FLOW = ['none', 'rtscts']
+
+BLOCK = 64
+SYNC_LEN = 4
+SYNC_CHECK = 16
+
+
+def prbs15_bytes():
+    """One period of PRBS-15 (x^15 + x^14 + 1) packed MSB first.  The bit
+    period is 32767, coprime with 8, so the byte stream repeats every
+    32767 bytes."""
+    state = 0x7FFF
+    out = bytearray(32767)
+    for i in range(32767):
+        byte = 0
+        for _ in range(8):
+            bit = ((state >> 14) ^ (state >> 13)) & 1
+            state = ((state << 1) | bit) & 0x7FFF
+            byte = (byte << 1) | bit
+        out[i] = byte
+    return bytes(out)
+
+
+PRBS = prbs15_bytes()
+# Two periods, so any frame payload is one slice
+PRBS_WRAPPED = PRBS + PRBS
+
+
+class PrbsChecker(object):
+    def __init__(self, sequence=PRBS):
+        self.period = len(sequence)
+        self.ref = sequence + sequence[:BLOCK + SYNC_CHECK]
+        self.lookup = {}
+        for i in range(self.period):
+            self.lookup.setdefault(self.ref[i:i + SYNC_LEN], i)
+        self.lock = threading.Lock()
+
+        self.pos = None          # expected sequence index of the next byte
+        self.slip_pos = None     # where we expected to be when sync was lost
+        self.pending = bytearray()
+
+        self.bytes_received = 0
+        self.bytes_checked = 0
+        self.bit_errors = 0
+        self.corrupt_bytes = 0
+        self.lost_bytes = 0
+        self.duplicated_bytes = 0
+        self.slips = 0
+
+    def __call__(self, chunk):
+        with self.lock:
+            self.bytes_received += len(chunk)
+            self.pending += chunk
+            while True:
+                if self.pos is None and not self._sync():
+                    return
+                if len(self.pending) < BLOCK:
+                    return
+                self._check_block()
+
+    def _sync(self):
+        data = self.pending
+        # Require SYNC_CHECK matching bytes before trusting a lock
+        last = len(data) - SYNC_CHECK
+        for i in range(last + 1):
+            pos = self.lookup.get(bytes(data[i:i + SYNC_LEN]))
+            if pos is None or data[i:i + SYNC_CHECK] != self.ref[pos:pos + SYNC_CHECK]:
+                continue
+            if self.slip_pos is not None:
+                delta = (pos - self.slip_pos - i) % self.period
+                if delta < self.period // 2:
+                    self.lost_bytes += delta
+                else:
+                    self.duplicated_bytes += self.period - delta
+            self.corrupt_bytes += i
+            del data[:i]
+            self.pos = pos
+            self.slip_pos = None
+            return True
+        # Nothing to lock onto yet; keep the tail for the next chunk
+        if last > 0:
+            if self.slip_pos is not None:
+                self.corrupt_bytes += last
+            del data[:last]
+        return False
+
+    def _check_block(self):
+        got = bytes(self.pending[:BLOCK])
+        expected = self.ref[self.pos:self.pos + BLOCK]
+        if got != expected:
+            bad = [j for j in range(BLOCK) if got[j] != expected[j]]
+            good = bad[0]
+            tail = BLOCK - good
+            if len(bad) * 4 >= tail * 3:
+                # Nearly everything from the first bad byte on differs: that
+                # is a slip (bytes dropped or repeated), not bit errors.
+                self.bytes_checked += good
+                self.pos = (self.pos + good) % self.period
+                del self.pending[:good]
+                if tail >= 8:
+                    self.slips += 1
+                    self.slip_pos = self.pos
+                    self.pos = None
+                # else: too few bytes to tell; look again with a full block
+                return
+            self.bit_errors += (int.from_bytes(got, 'big') ^ int.from_bytes(expected, 'big')).bit_count()
+            self.corrupt_bytes += len(bad)
+        self.bytes_checked += BLOCK
+        self.pos = (self.pos + BLOCK) % self.period
+        del self.pending[:BLOCK]
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'rx': self.bytes_received,
+                'checked': self.bytes_checked,
+                'bit_errors': self.bit_errors,
+                'corrupt': self.corrupt_bytes,
+                'lost': self.lost_bytes,
+                'dup': self.duplicated_bytes,
+                'slips': self.slips,
+                'latency': [],
+            }
+
+
+FRAME_SYNC = b'\xa5\x5a'
+# sync, seq, send time (ns), payload length
+FRAME_HEADER = struct.Struct('<2sIQH')
+MAX_PAYLOAD = 1024
+
+
+def build_frame(seq, payload_len):
+    start = (seq * 31) % len(PRBS)
+    payload = PRBS_WRAPPED[start:start + payload_len]
+    body = FRAME_HEADER.pack(FRAME_SYNC, seq, time.monotonic_ns(), payload_len) + payload
+    return body + struct.pack('<H', binascii.crc_hqx(body, 0xFFFF))
+
+
+class FrameChecker(object):
+    def __init__(self):
+        self.buf = bytearray()
+        self.lock = threading.Lock()
+        self.last_seq = None
+        self.bytes_received = 0
+        self.frames = 0
+        self.lost_frames = 0
+        self.dup_frames = 0
+        self.corrupt_frames = 0
+        self.skipped_bytes = 0
+        self.latency = []
+
+    def __call__(self, chunk):
+        now = time.monotonic_ns()
+        with self.lock:
+            self.bytes_received += len(chunk)
+            self.buf += chunk
+            self._parse(now)
+
+    def _parse(self, now):
+        buf = self.buf
+        while True:
+            i = buf.find(FRAME_SYNC)
+            if i < 0:
+                keep = 1 if buf.endswith(FRAME_SYNC[:1]) else 0
+                self.skipped_bytes += len(buf) - keep
+                del buf[:len(buf) - keep]
+                return
+            if i:
+                self.skipped_bytes += i
+                del buf[:i]
+            if len(buf) < FRAME_HEADER.size:
+                return
+            _, seq, sent_ns, plen = FRAME_HEADER.unpack_from(buf)
+            if plen > MAX_PAYLOAD:
+                self.corrupt_frames += 1
+                del buf[:1]
+                continue
+            total = FRAME_HEADER.size + plen + 2
+            if len(buf) < total:
+                return
+            (crc,) = struct.unpack_from('<H', buf, total - 2)
+            if binascii.crc_hqx(bytes(buf[:total - 2]), 0xFFFF) != crc:
+                self.corrupt_frames += 1
+                del buf[:1]
+                continue
+
+            self.frames += 1
+            self.latency.append((now - sent_ns) / 1e6)
+            if self.last_seq is not None:
+                if seq > self.last_seq + 1:
+                    self.lost_frames += seq - self.last_seq - 1
+                elif seq <= self.last_seq:
+                    self.dup_frames += 1
+            if self.last_seq is None or seq > self.last_seq:
+                self.last_seq = seq
+            del buf[:total]
+
+    def snapshot(self):
+        with self.lock:
+            latency, self.latency = self.latency, []
+            return {
+                'rx': self.bytes_received,
+                'frames': self.frames,
+                'lost': self.lost_frames,
+                'dup': self.dup_frames,
+                'corrupt': self.corrupt_frames,
+                'skipped': self.skipped_bytes,
+                'latency': latency,
+            }
+
+
+def sender(ser, mode, payload_len, stop, counters, pace_rate=None):
+    """pace_rate: bytes/s to send frames at; None sends as fast as the port takes them."""
+    seq = 0
+    pos = 0
+    block = 1024
+    ring = PRBS_WRAPPED[:len(PRBS) + block]
+    start = time.monotonic()
+    sent = 0
+    while not stop.is_set():
+        if mode == 'prbs':
+            data = ring[pos:pos + block]
+            pos = (pos + block) % len(PRBS)
+        else:
+            if pace_rate:
+                delay = start + sent / pace_rate - time.monotonic()
+                if delay > 0 and stop.wait(delay):
+                    break
+            data = build_frame(seq, payload_len)
+            seq += 1
+        try:
+            written = ser.write(data)
+            counters['tx'] += written
+            sent += written
+        except serial.SerialTimeoutException:
+            counters['tx_timeouts'] += 1
+
+
+def run_test(args, baud, flow, quiet=False):
+    rtscts = flow == 'rtscts'
+    try:
+        tx = serial.Serial(port=args.port, baudrate=baud, rtscts=rtscts, timeout=0.5, write_timeout=1.0)
+        rx = serial.Serial(port=args.rx, baudrate=baud, rtscts=rtscts, timeout=0.5) if args.rx else tx
+    except (serial.SerialException, ValueError) as e:
+        print(f"Serial error at {baud} baud: {e}")
+        return None
+    tx.reset_output_buffer()
+    rx.reset_input_buffer()
+
+    checker = PrbsChecker() if args.mode == 'prbs' else FrameChecker()
+    receiver = BulkReceiver(rx, chunk_size=args.chunk, on_chunk=checker, flush_timeout=0.01)
+    receiver.start()
+
+    stop = threading.Event()
+    counters = {'tx': 0, 'tx_timeouts': 0}
+    pace_rate = baud / 10.0 * args.load if args.mode == 'frame' and args.load < 1.0 else None
+    send_thread = threading.Thread(target=sender, args=(tx, args.mode, args.payload, stop, counters, pace_rate))
+    send_thread.daemon = True
+    send_thread.start()
+
+    line_rate = baud / 10.0
+    latencies = []
+    prev = checker.snapshot()
+    start = time.monotonic()
+    if not quiet:
+        print(f"\n{baud} baud, flow control {flow}, mode {args.mode}")
+        print(f"{'t':>4} {'rx kB/s':>8} {'%line':>6} {'BER':>9} {'corrupt':>8} {'lost':>6} {'dup':>5} {'lat ms':>7}")
+    try:
+        for second in range(1, int(args.duration) + 1):
+            time.sleep(max(0.0, start + second - time.monotonic()))
+            snap = checker.snapshot()
+            latencies.extend(snap['latency'])
+            rate = snap['rx'] - prev['rx']
+            if not quiet:
+                if args.mode == 'prbs':
+                    bits = (snap['checked'] - prev['checked']) * 8
+                    ber = (snap['bit_errors'] - prev['bit_errors']) / bits if bits else 0.0
+                    ber_text = f"{ber:9.2e}"
+                    lat_text = '-'
+                else:
+                    ber_text = '-'
+                    lat_text = f"{statistics.median(snap['latency']):.1f}" if snap['latency'] else '-'
+                print(f"{second:>4} {rate / 1000:>8.1f} {100.0 * rate / line_rate:>5.1f}% {ber_text:>9} "
+                      f"{snap['corrupt'] - prev['corrupt']:>8} {snap['lost'] - prev['lost']:>6} "
+                      f"{snap['dup'] - prev['dup']:>5} {lat_text:>7}")
+            prev = snap
+    except KeyboardInterrupt:
+        stop.set()
+        raise
+    finally:
+        stop.set()
+        send_thread.join(2.0)
+        time.sleep(0.2)
+        receiver.stop()
+        tx.close()
+        if rx is not tx:
+            rx.close()
+
+    elapsed = time.monotonic() - start
+    final = checker.snapshot()
+    latencies.extend(final['latency'])
+    result = {
+        'baud': baud,
+        'flow': flow,
+        'tx': counters['tx'],
+        'rx': final['rx'],
+        'rate': final['rx'] / elapsed,
+        'efficiency': final['rx'] / elapsed / line_rate,
+        'corrupt': final['corrupt'],
+        'lost': final['lost'],
+        'dup': final['dup'],
+        'latency_p50': statistics.median(latencies) if latencies else None,
+        'latency_max': max(latencies) if latencies else None,
+    }
+    if args.mode == 'prbs':
+        bits = final['checked'] * 8
+        result['ber'] = final['bit_errors'] / bits if bits else None
+        result['slips'] = final['slips']
+    else:
+        result['frames'] = final['frames']
+    return result
+
+
+def print_summary(results, mode):
+    print(f"\n{'baud':>8} {'flow':>6} {'kB/s':>8} {'%line':>6} {'BER':>9} {'corrupt':>8} {'lost':>7} "
+          f"{'dup':>5} {'p50 ms':>7} {'max ms':>7}")
+    for r in results:
+        ber = f"{r['ber']:9.2e}" if r.get('ber') is not None else '-'
+        p50 = f"{r['latency_p50']:.1f}" if r['latency_p50'] is not None else '-'
+        lmax = f"{r['latency_max']:.1f}" if r['latency_max'] is not None else '-'
+        print(f"{r['baud']:>8} {r['flow']:>6} {r['rate'] / 1000:>8.1f} {100.0 * r['efficiency']:>5.1f}% {ber:>9} "
+              f"{r['corrupt']:>8} {r['lost']:>7} {r['dup']:>5} {p50:>7} {lmax:>7}")
+    unit = 'bytes' if mode == 'prbs' else 'frames'
+    print(f"(corrupt/lost/dup in {unit})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='UART loopback BER / loss / throughput tester')
+    parser.add_argument('port', help='Transmit port (also receive port unless --rx is given)')
+    parser.add_argument('--rx', help='Separate receive port')
+    parser.add_argument('-b', '--baud', type=int, default=115200, help='Baud rate (default: 115200)')
+    parser.add_argument('-f', '--flow', choices=SWEEP_FLOW, default='none', help='Flow control (default: none)')
+    parser.add_argument('-m', '--mode', choices=['prbs', 'frame'], default='prbs', help='Pattern (default: prbs)')
+    parser.add_argument('-p', '--payload', type=int, default=64,
+                        help=f'Frame payload bytes in frame mode (default: 64, max {MAX_PAYLOAD})')
+    parser.add_argument('-l', '--load', type=float, default=0.5,
+                        help='Frame mode: fraction of the line rate to send at (default: 0.5, 1 = unpaced)')
+    parser.add_argument('-d', '--duration', type=float, default=10.0, help='Seconds per test (default: 10)')
+    parser.add_argument('-c', '--chunk', type=int, default=256, help='Receive chunk size (default: 256)')
+    parser.add_argument('--sweep', action='store_true',
+                        help='Run every baud rate from 19200 to 1M with and without RTS/CTS')
+
+    args = parser.parse_args()
+    args.payload = min(args.payload, MAX_PAYLOAD)
+
+    combos = [(b, f) for f in SWEEP_FLOW for b in SWEEP_BAUDS] if args.sweep else [(args.baud, args.flow)]
+    results = []
+    try:
+        for baud, flow in combos:
+            result = run_test(args, baud, flow, quiet=args.sweep)
+            if result:
+                results.append(result)
+                if args.sweep:
+                    print(f"{baud:>8} baud {flow:>6}: {result['rate'] / 1000:.1f} kB/s, "
+                          f"corrupt {result['corrupt']}, lost {result['lost']}")
+    except KeyboardInterrupt:
+        print("\nInterrupted")
+
+    if results:
+        print_summary(results, args.mode)
+    ok = results and all(r['corrupt'] == 0 and r['lost'] == 0 and r['dup'] == 0 for r in results)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
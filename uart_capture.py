@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Memory-mapped ring capture file for long UART recordings.
+
+The file is preallocated once and written through mmap, so a soak test costs
+one memcpy per received chunk instead of a print/write per byte, and the
+kernel writes dirty pages back in large batches.  Layout:
+
+    0       header (64 bytes, see HEADER)
+    64      index: index_slots x (time float64, stream offset uint64), a ring
+    data    data_size bytes of raw received data, a ring
+
+Stream offsets count every byte ever written; byte N lives at data offset
+N % data_size and is still present while N >= write_total - data_size.  An
+index entry is added at most every index_interval seconds, so timestamps are
+coarse (they mark when the chunk containing that offset arrived).
+
+    ./uart_capture.py record /dev/ttyS4 /data/s4.cap -b 115200 --size 64
+    ./uart_capture.py info /data/s4.cap
+    ./uart_capture.py dump /data/s4.cap --from 120 --to 180 --hex
+"""
+import argparse
+import bisect
+import mmap
+import os
+import struct
+import sys
+import time
+
+MAGIC = b'UCAP'
+VERSION = 1
+# magic, version, reserved, index_slots, data_size, write_total, index_count, created
+HEADER = struct.Struct('<4sHHIQQQd')
+INDEX_ENTRY = struct.Struct('<dQ')
+INDEX_OFFSET = 64
+PAGE = mmap.PAGESIZE
+
+
+def data_offset(index_slots):
+    end = INDEX_OFFSET + index_slots * INDEX_ENTRY.size
+    return (end + PAGE - 1) // PAGE * PAGE
+
+
+class CaptureWriter(object):
+    def __init__(self, path, data_size=16 * 1024 * 1024, index_slots=16384, index_interval=0.1):
+        self.path = path
+        self.data_size = data_size
+        self.index_slots = index_slots
+        self.index_interval = index_interval
+        self.data_start = data_offset(index_slots)
+
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        total = self.data_start + data_size
+        try:
+            # Reserve the blocks now rather than on first touch
+            os.posix_fallocate(self.fd, 0, total)
+        except (AttributeError, OSError):
+            os.ftruncate(self.fd, total)
+        self.map = mmap.mmap(self.fd, total)
+
+        self.write_total = 0
+        self.index_count = 0
+        self._last_index = None
+        self.created = time.time()
+        self._write_header()
+
+    def _write_header(self):
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, 0, self.index_slots, self.data_size,
+                         self.write_total, self.index_count, self.created)
+
+    def append(self, data, timestamp=None):
+        n = len(data)
+        if not n:
+            return
+        now = time.time() if timestamp is None else timestamp
+        if self._last_index is None or now - self._last_index >= self.index_interval:
+            slot = self.index_count % self.index_slots
+            INDEX_ENTRY.pack_into(self.map, INDEX_OFFSET + slot * INDEX_ENTRY.size, now, self.write_total)
+            self.index_count += 1
+            self._last_index = now
+
+        view = memoryview(data)
+        if n > self.data_size:
+            # Only the tail survives anyway
+            self.write_total += n - self.data_size
+            view = view[n - self.data_size:]
+            n = self.data_size
+        pos = self.write_total % self.data_size
+        first = min(n, self.data_size - pos)
+        start = self.data_start + pos
+        self.map[start:start + first] = view[:first]
+        if first < n:
+            self.map[self.data_start:self.data_start + n - first] = view[first:]
+        self.write_total += n
+
+        # Header last, so a reader never sees a total covering unwritten data
+        self._write_header()
+
+    def flush(self):
+        self.map.flush()
+
+    def close(self):
+        if self.map is None:
+            return
+        self._write_header()
+        self.map.flush()
+        self.map.close()
+        os.close(self.fd)
+        self.map = None
+
+
+class CaptureReader(object):
+    def __init__(self, path):
+        self.fd = os.open(path, os.O_RDONLY)
+        self.map = mmap.mmap(self.fd, 0, access=mmap.ACCESS_READ)
+        (magic, version, _, self.index_slots, self.data_size,
+         self.write_total, self.index_count, self.created) = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a capture file")
+        self.data_start = data_offset(self.index_slots)
+        self.oldest = max(0, self.write_total - self.data_size)
+
+        # Index entries still describing data in the ring, oldest first
+        self.times = []
+        self.offsets = []
+        for i in range(max(0, self.index_count - self.index_slots), self.index_count):
+            t, offset = INDEX_ENTRY.unpack_from(self.map, INDEX_OFFSET + (i % self.index_slots) * INDEX_ENTRY.size)
+            if offset >= self.oldest:
+                self.times.append(t)
+                self.offsets.append(offset)
+
+    def close(self):
+        self.map.close()
+        os.close(self.fd)
+
+    def offset_at(self, t):
+        """Stream offset of the first indexed chunk at or after time t."""
+        i = bisect.bisect_left(self.times, t)
+        if i >= len(self.offsets):
+            return self.write_total
+        return self.offsets[i]
+
+    def time_at(self, offset):
+        """Arrival time of the indexed chunk containing offset (approximate)."""
+        i = bisect.bisect_right(self.offsets, offset) - 1
+        return self.times[i] if i >= 0 else None
+
+    def read(self, start, end, block=65536):
+        """Yield the stream bytes [start, end) in blocks, clipped to the ring."""
+        start = max(start, self.oldest)
+        end = min(end, self.write_total)
+        while start < end:
+            pos = start % self.data_size
+            n = min(end - start, self.data_size - pos, block)
+            base = self.data_start + pos
+            yield self.map[base:base + n]
+            start += n
+
+    def slice(self, t0=None, t1=None):
+        start = self.oldest if t0 is None else self.offset_at(t0)
+        end = self.write_total if t1 is None else self.offset_at(t1)
+        return start, end
+
+
+def parse_time(value, reader):
+    """Seconds since capture start, or an absolute epoch time."""
+    if value is None:
+        return None
+    value = float(value)
+    return value if value > 1e9 else reader.created + value
+
+
+def cmd_record(args):
+    import serial
+    from uart_rx import BulkReceiver
+
+    writer = CaptureWriter(args.file, args.size * 1024 * 1024, index_interval=args.interval)
+    ser = serial.Serial(port=args.port, baudrate=args.baud, timeout=0.5)
+    ser.reset_input_buffer()
+    receiver = BulkReceiver(ser, chunk_size=args.chunk, on_chunk=writer.append)
+    print(f"Capturing {args.port} at {args.baud} baud into {args.file} "
+          f"({args.size} MiB ring, Ctrl+C to stop)...")
+    receiver.start()
+    start = time.monotonic()
+    try:
+        while args.duration == 0 or time.monotonic() - start < args.duration:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    receiver.stop()
+    ser.close()
+    writer.close()
+    print(f"Captured {writer.write_total} bytes, {writer.index_count} index entries")
+
+
+def cmd_info(args):
+    reader = CaptureReader(args.file)
+    kept = reader.write_total - reader.oldest
+    print(f"File:          {args.file}")
+    print(f"Created:       {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(reader.created))}")
+    print(f"Ring size:     {reader.data_size} bytes")
+    print(f"Written:       {reader.write_total} bytes ({kept} retained, {reader.oldest} overwritten)")
+    print(f"Index entries: {len(reader.times)} valid of {reader.index_count}")
+    if reader.times:
+        print(f"Time span:     {reader.times[0] - reader.created:.3f} s .. "
+              f"{reader.times[-1] - reader.created:.3f} s after start")
+    reader.close()
+
+
+def cmd_dump(args):
+    reader = CaptureReader(args.file)
+    start, end = reader.slice(parse_time(args.start, reader), parse_time(args.end, reader))
+    out = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    offset = start
+    try:
+        for block in reader.read(start, end):
+            if args.hex:
+                for i in range(0, len(block), 16):
+                    line = block[i:i + 16]
+                    out.write(f"{offset + i:010d}  {line.hex(' '):<47}  "
+                              f"{''.join(chr(b) if 32 <= b <= 126 else '.' for b in line)}\n".encode())
+            else:
+                out.write(block)
+            offset += len(block)
+    finally:
+        if args.output:
+            out.close()
+        reader.close()
+    print(f"Dumped stream bytes {start}..{end} ({end - start} bytes)", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory-mapped UART capture ring')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    rec = sub.add_parser('record', help='Capture a serial port into a ring file')
+    rec.add_argument('port', help='Serial port, e.g. /dev/ttyS4')
+    rec.add_argument('file', help='Capture file')
+    rec.add_argument('-b', '--baud', type=int, default=115200, help='Baud rate (default: 115200)')
+    rec.add_argument('-s', '--size', type=int, default=16, help='Ring size in MiB (default: 16)')
+    rec.add_argument('-i', '--interval', type=float, default=0.1,
+                     help='Minimum seconds between index entries (default: 0.1)')
+    rec.add_argument('-c', '--chunk', type=int, default=1024, help='Receive chunk size (default: 1024)')
+    rec.add_argument('-d', '--duration', type=float, default=0, help='Seconds to record, 0 = until Ctrl+C')
+    rec.set_defaults(func=cmd_record)
+
+    info = sub.add_parser('info', help='Show capture file summary')
+    info.add_argument('file')
+    info.set_defaults(func=cmd_info)
+
+    dump = sub.add_parser('dump', help='Extract a time slice')
+    dump.add_argument('file')
+    dump.add_argument('--from', dest='start', help='Start: seconds since capture start, or epoch time')
+    dump.add_argument('--to', dest='end', help='End: seconds since capture start, or epoch time')
+    dump.add_argument('--hex', action='store_true', help='Hex dump instead of raw bytes')
+    dump.add_argument('-o', '--output', help='Write to file instead of stdout')
+    dump.set_defaults(func=cmd_dump)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Message framing for UART links.
+
+Three interchangeable codecs, each protecting the payload with a CRC-16
+(CCITT, as in uart_ber.py):
+
+  length  a5 5a | len u16 | payload | crc   crc over len + payload
+  cobs    COBS(payload | crc) 00            zero byte delimits frames
+  slip    c0 SLIP(payload | crc) c0         RFC 1055 escaping
+
+FrameDecoder is incremental: feed() it chunks as they arrive and it returns
+the complete frames found so far.  Delimiters are located with C-level
+searches (re over the buffer) and the CRC with binascii, so the Python
+work is per frame, not per byte.  For the length codec the returned
+payloads are memoryviews into the received data (no copy); COBS and SLIP
+need one decoded copy per frame.  Either way a returned frame is only valid
+until the next feed(); take bytes(frame) to keep it.
+
+    decoder = FrameDecoder(CODECS['cobs'])
+    rx = BulkReceiver(ser, on_chunk=lambda chunk: handle(decoder.feed(chunk)))
+    ser.write(CODECS['cobs'].encode_batch([b'one', b'two']))
+
+Run as a script to measure encode/decode speed on this machine:
+
+    ./uart_framing.py -n 20000 -s 64
+"""
+import argparse
+import binascii
+import os
+import re
+import struct
+import time
+
+CRC = struct.Struct('<H')
+
+
+def crc16(data):
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+class LengthCodec(object):
+    name = 'length'
+    SYNC = b'\xa5\x5a'
+    HEADER = struct.Struct('<2sH')
+
+    def __init__(self, max_payload=4096):
+        self.max_payload = max_payload
+        self._sync = re.compile(re.escape(self.SYNC))
+
+    def encode(self, payload):
+        body = struct.pack('<H', len(payload)) + payload
+        return self.SYNC + body + CRC.pack(crc16(body))
+
+    def encode_batch(self, payloads):
+        return b''.join([self.encode(p) for p in payloads])
+
+    def parse(self, view, pos, frames, stats):
+        """Collect frames from view[pos:]; return where an incomplete frame starts."""
+        end = len(view)
+        while True:
+            match = self._sync.search(view, pos)
+            if match is None:
+                # A trailing first sync byte may be the start of the next frame
+                keep = 1 if end > pos and view[end - 1] == self.SYNC[0] else 0
+                stats['skipped'] += end - keep - pos
+                return end - keep
+            i = match.start()
+            stats['skipped'] += i - pos
+            if end - i < self.HEADER.size:
+                return i
+            _, length = self.HEADER.unpack_from(view, i)
+            if length > self.max_payload:
+                stats['oversize'] += 1
+                pos = i + 1
+                continue
+            stop = i + self.HEADER.size + length
+            if end - stop < CRC.size:
+                return i
+            if crc16(view[i + 2:stop]) != CRC.unpack_from(view, stop)[0]:
+                stats['crc_errors'] += 1
+                pos = i + 1
+                continue
+            frames.append(view[i + self.HEADER.size:stop])
+            pos = stop + CRC.size
+
+
+class DelimitedCodec(object):
+    """Base for codecs whose frames end with a delimiter byte."""
+    DELIMITER = b''
+
+    def __init__(self, max_payload=4096):
+        self.max_payload = max_payload
+        # Worst case encoded size, beyond which an unterminated frame is junk
+        self.max_encoded = 2 * (max_payload + CRC.size) + 2
+        self._delimiter = re.compile(re.escape(self.DELIMITER))
+
+    def encode_batch(self, payloads):
+        return b''.join([self.encode(p) for p in payloads])
+
+    def parse(self, view, pos, frames, stats):
+        end = len(view)
+        while True:
+            match = self._delimiter.search(view, pos)
+            if match is None:
+                if end - pos > self.max_encoded:
+                    stats['oversize'] += 1
+                    stats['skipped'] += end - pos
+                    return end
+                return pos
+            i = match.start()
+            if i > pos:
+                try:
+                    decoded = self.decode(view[pos:i])
+                except ValueError:
+                    stats['skipped'] += i - pos
+                    decoded = None
+                if decoded is not None:
+                    if len(decoded) < CRC.size:
+                        stats['skipped'] += i - pos
+                    elif crc16(decoded[:-CRC.size]) != CRC.unpack_from(decoded, len(decoded) - CRC.size)[0]:
+                        stats['crc_errors'] += 1
+                    else:
+                        frames.append(memoryview(decoded)[:-CRC.size])
+            pos = i + 1
+
+
+class CobsCodec(DelimitedCodec):
+    name = 'cobs'
+    DELIMITER = b'\x00'
+
+    def encode(self, payload):
+        out = bytearray()
+        # Each zero-free run becomes a length code followed by the run
+        for run in (payload + CRC.pack(crc16(payload))).split(b'\x00'):
+            while len(run) >= 254:
+                out.append(255)
+                out += run[:254]
+                run = run[254:]
+            out.append(len(run) + 1)
+            out += run
+        out.append(0)
+        return bytes(out)
+
+    def encode_batch(self, payloads):
+        # Leading delimiter, so line noise cannot merge into the first frame
+        return b'\x00' + b''.join([self.encode(p) for p in payloads])
+
+    def decode(self, data):
+        out = bytearray()
+        i = 0
+        end = len(data)
+        while i < end:
+            code = data[i]
+            if code == 0 or i + code > end:
+                raise ValueError("Bad COBS block")
+            out += data[i + 1:i + code]
+            i += code
+            if code < 255 and i < end:
+                out.append(0)
+        return out
+
+
+class SlipCodec(DelimitedCodec):
+    name = 'slip'
+    END = b'\xc0'
+    ESC = b'\xdb'
+    DELIMITER = END
+
+    def encode(self, payload):
+        data = payload + CRC.pack(crc16(payload))
+        data = data.replace(self.ESC, b'\xdb\xdd').replace(self.END, b'\xdb\xdc')
+        # Leading END flushes any line noise received before the frame
+        return self.END + data + self.END
+
+    def decode(self, data):
+        return bytearray(bytes(data).replace(b'\xdb\xdc', self.END).replace(b'\xdb\xdd', self.ESC))
+
+
+CODECS = {codec.name: codec for codec in (LengthCodec(), CobsCodec(), SlipCodec())}
+
+
+class FrameDecoder(object):
+    def __init__(self, codec, on_frame=None):
+        self.codec = codec
+        self.on_frame = on_frame
+        self._buf = bytearray()
+        self.stats = {'bytes': 0, 'frames': 0, 'crc_errors': 0, 'oversize': 0, 'skipped': 0}
+
+    def feed(self, data):
+        """Add received bytes; return the list of complete payloads."""
+        self.stats['bytes'] += len(data)
+        if self._buf:
+            # Frames hold views on the old buffer, so start a new one
+            self._buf += data
+            data, self._buf = self._buf, bytearray()
+        return self._parse(memoryview(data), 0)
+
+    def _parse(self, view, pos):
+        frames = []
+        used = self.codec.parse(view, pos, frames, self.stats)
+        if used < len(view):
+            # Only the incomplete tail is copied
+            self._buf += view[used:]
+        self.stats['frames'] += len(frames)
+        if self.on_frame:
+            for frame in frames:
+                self.on_frame(frame)
+        return frames
+
+    def resync(self):
+        """Abandon the frame being waited for and rescan the bytes after it.
+
+        A corrupted length field makes the length codec wait for data that
+        is not coming; call this when the line goes idle to recover the
+        frames queued behind it.
+        """
+        if not self._buf:
+            return []
+        data, self._buf = self._buf, bytearray()
+        self.stats['skipped'] += 1
+        return self._parse(memoryview(data), 1)
+
+    def pending(self):
+        return len(self._buf)
+
+
+def benchmark(codec, count, size, chunk_size):
+    payloads = [os.urandom(size) for _ in range(count)]
+    start = time.perf_counter()
+    stream = codec.encode_batch(payloads)
+    encode_time = time.perf_counter() - start
+
+    decoder = FrameDecoder(codec)
+    received = 0
+    start = time.perf_counter()
+    for i in range(0, len(stream), chunk_size):
+        received += len(decoder.feed(stream[i:i + chunk_size]))
+    decode_time = time.perf_counter() - start
+    return len(stream), encode_time, decode_time, received
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the UART framing codecs')
+    parser.add_argument('-n', '--count', type=int, default=20000, help='Frames per run (default: 20000)')
+    parser.add_argument('-s', '--size', type=int, default=64, help='Payload bytes (default: 64)')
+    parser.add_argument('-c', '--chunk', type=int, default=256, help='Receive chunk size (default: 256)')
+    parser.add_argument('-b', '--baud', type=int, default=921600,
+                        help='Line rate to compare against (default: 921600)')
+
+    args = parser.parse_args()
+
+    line_rate = args.baud / 10.0
+    print(f"{args.count} frames of {args.size} bytes, fed in {args.chunk} byte chunks")
+    print(f"{'codec':<8} {'wire B':>8} {'enc MB/s':>9} {'dec MB/s':>9} {'dec fr/s':>10} {'x line':>7} {'ok':>4}")
+    for codec in CODECS.values():
+        wire, enc, dec, received = benchmark(codec, args.count, args.size, args.chunk)
+        print(f"{codec.name:<8} {wire / args.count:>8.1f} {wire / enc / 1e6:>9.1f} {wire / dec / 1e6:>9.1f} "
+              f"{args.count / dec:>10.0f} {wire / dec / line_rate:>7.0f} "
+              f"{'yes' if received == args.count else 'NO':>4}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+UART request/response latency.
+
+Sends a numbered request, waits for it to come back and records the round
+trip with perf_counter_ns, with no sleeps between write and read.  The port
+is tuned for latency first:
+
+  * the serial driver's ASYNC_LOW_LATENCY flag (TIOCSSERIAL) is set where the
+    driver supports it, so received bytes are pushed to the tty layer
+    immediately instead of from a deferred work item,
+  * every wait has an exact deadline: poll() until the first byte of the
+    response, then either one VMIN/VTIME read for the whole response
+    (--read vmin, one wakeup) or poll()+read per arrival (--read poll).
+
+With TX wired to RX the port answers itself; with two cross-wired ports
+--echo runs a responder on the second one:
+
+    ./uart_latency.py /dev/ttyS4 -b 921600 -n 2000
+    ./uart_latency.py /dev/ttyS4 --echo /dev/ttyS5 -s 32 --read poll
+"""
+import argparse
+import fcntl
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from uart_termios import open_port
+
+TIOCGSERIAL = 0x541E
+TIOCSSERIAL = 0x541F
+ASYNC_LOW_LATENCY = 1 << 13
+# struct serial_struct starts with int type, line; unsigned port; int irq, flags
+SERIAL_FLAGS_OFFSET = 16
+SERIAL_STRUCT_SIZE = 128   # larger than the kernel struct on any ABI
+
+
+def set_low_latency(fd, enable=True):
+    """Set or clear ASYNC_LOW_LATENCY; return False if the driver has no such option."""
+    buf = bytearray(SERIAL_STRUCT_SIZE)
+    try:
+        fcntl.ioctl(fd, TIOCGSERIAL, buf)
+        (flags,) = struct.unpack_from('i', buf, SERIAL_FLAGS_OFFSET)
+        flags = flags | ASYNC_LOW_LATENCY if enable else flags & ~ASYNC_LOW_LATENCY
+        struct.pack_into('i', buf, SERIAL_FLAGS_OFFSET, flags)
+        fcntl.ioctl(fd, TIOCSSERIAL, buf)
+    except OSError:
+        return False
+    return True
+
+
+def read_exact(fd, size, deadline, mode):
+    """Read size bytes or give up at deadline (time.monotonic()); return bytes read."""
+    data = bytearray()
+    poller = select.poll()
+    poller.register(fd, select.POLLIN)
+    while len(data) < size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not poller.poll(max(0, int(remaining * 1000 + 0.999))):
+            break
+        # VMIN makes this one read wait for the rest of the response, with
+        # VTIME as the inter-byte timeout; VMIN=0 returns what is there
+        data += os.read(fd, size - len(data))
+        if mode == 'vmin' and len(data) < size:
+            # The inter-byte timer expired mid-response
+            break
+    return bytes(data)
+
+
+def echo_responder(fd, stop, size):
+    """Send every complete request straight back."""
+    poller = select.poll()
+    poller.register(fd, select.POLLIN)
+    pending = bytearray()
+    while not stop.is_set():
+        if not poller.poll(100):
+            continue
+        pending += os.read(fd, 4096)
+        whole = len(pending) - len(pending) % size
+        if whole:
+            os.write(fd, pending[:whole])
+            del pending[:whole]
+
+
+class Histogram(object):
+    """Latency samples in microseconds with log2 buckets."""
+
+    def __init__(self):
+        self.samples = []
+
+    def add(self, us):
+        self.samples.append(us)
+
+    def percentile(self, p):
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(p / 100.0 * len(ordered)))]
+
+    def buckets(self):
+        counts = {}
+        for us in self.samples:
+            bucket = 1 << max(0, int(us)).bit_length()
+            counts[bucket] = counts.get(bucket, 0) + 1
+        return sorted(counts.items())
+
+    def render(self, width=50):
+        lines = []
+        buckets = self.buckets()
+        peak = max(count for _, count in buckets)
+        for upper, count in buckets:
+            bar = '#' * max(1, count * width // peak)
+            lines.append(f"{upper // 2:>8} - {upper:<8} us {count:>7}  {bar}")
+        return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='UART round-trip latency histogram')
+    parser.add_argument('port', help='Serial port, e.g. /dev/ttyS4')
+    parser.add_argument('--echo', help='Cross-wired port to run an echo responder on')
+    parser.add_argument('-b', '--baud', type=int, default=115200, help='Baud rate (default: 115200)')
+    parser.add_argument('-n', '--count', type=int, default=1000, help='Requests to send (default: 1000)')
+    parser.add_argument('-s', '--size', type=int, default=16, help='Request size, 8..255 bytes (default: 16)')
+    parser.add_argument('-t', '--timeout', type=float, default=0.1, help='Response deadline in seconds (default: 0.1)')
+    parser.add_argument('-i', '--interval', type=float, default=0.0, help='Pause between requests (default: 0)')
+    parser.add_argument('--read', choices=['vmin', 'poll'], default='vmin',
+                        help='vmin: one blocking read per response; poll: read each arrival (default: vmin)')
+    parser.add_argument('--no-low-latency', action='store_true', help='Leave the driver low_latency flag alone')
+
+    args = parser.parse_args()
+    if not 8 <= args.size <= 255:
+        parser.error("size must be 8..255 (VMIN is one byte)")
+
+    vmin, vtime = (args.size, 1) if args.read == 'vmin' else (0, 0)
+    try:
+        fd = open_port(args.port, baud=args.baud, vmin=vmin, vtime=vtime)
+        echo_fd = open_port(args.echo, baud=args.baud, vmin=0, vtime=0) if args.echo else None
+    except OSError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    low_latency = None
+    if not args.no_low_latency:
+        low_latency = all(set_low_latency(f) for f in (fd, echo_fd) if f is not None)
+
+    stop = threading.Event()
+    if echo_fd is not None:
+        responder = threading.Thread(target=echo_responder, args=(echo_fd, stop, args.size), daemon=True)
+        responder.start()
+
+    line_time_us = 10.0 * args.size / args.baud * 1e6 * (2 if args.echo else 1)
+    print(f"{args.count} requests of {args.size} bytes on {args.port}"
+          f"{' echoed by ' + args.echo if args.echo else ' (loopback)'} at {args.baud} baud, "
+          f"{args.read} reads, low_latency "
+          + {None: 'untouched', True: 'on', False: 'not supported'}[low_latency])
+
+    hist = Histogram()
+    timeouts = 0
+    mismatches = 0
+    filler = bytes(range(args.size - 4))
+    try:
+        for seq in range(args.count):
+            request = struct.pack('<I', seq) + filler
+            start = time.perf_counter_ns()
+            os.write(fd, request)
+            response = read_exact(fd, args.size, time.monotonic() + args.timeout, args.read)
+            elapsed = time.perf_counter_ns() - start
+            if len(response) < args.size:
+                timeouts += 1
+                # Drop any late tail so the next request starts clean
+                if select.select([fd], [], [], 0.01)[0]:
+                    os.read(fd, 4096)
+                continue
+            if response != request:
+                mismatches += 1
+                continue
+            hist.add(elapsed / 1000.0)
+            if args.interval:
+                time.sleep(args.interval)
+    except KeyboardInterrupt:
+        print("\nInterrupted")
+    finally:
+        stop.set()
+        os.close(fd)
+        if echo_fd is not None:
+            responder.join(1.0)
+            os.close(echo_fd)
+
+    print(f"\nCompleted {len(hist.samples)}, timeouts {timeouts}, mismatches {mismatches}")
+    if not hist.samples:
+        sys.exit(1)
+    print(f"Line time {line_time_us:.0f} us; round trip min {min(hist.samples):.0f}  "
+          f"p50 {hist.percentile(50):.0f}  p90 {hist.percentile(90):.0f}  "
+          f"p99 {hist.percentile(99):.0f}  max {max(hist.samples):.0f} us\n")
+    print(hist.render())
+    sys.exit(0 if not timeouts and not mismatches else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Multi-port UART monitor.
+
+One process, one poll() loop, any number of ports.  Per port it keeps the
+rx/tx byte counters and the line error counters (framing, parity, overrun,
+buffer overrun, break) that the serial driver reports through TIOCGICOUNT,
+plus rates over the last interval and a rolling window.
+
+By default received data is read and discarded, like t4.  With --observe
+the ports are not read at all and the counts come only from TIOCGICOUNT, so
+the monitor can sit next to the process that owns the port.
+
+Other processes get the current snapshot as JSON, either from a unix
+socket (connect, read to EOF) or from a file replaced atomically every
+interval (put it on tmpfs, e.g. /dev/shm, like back_5's /tmp/uart_status):
+
+    ./uart_monitor.py watch /dev/ttyS4 /dev/ttyS5 -b 115200 --socket /tmp/uart_monitor.sock
+    ./uart_monitor.py watch /dev/ttyS4 --observe --snapshot /dev/shm/uart_status.json
+    ./uart_monitor.py query /tmp/uart_monitor.sock
+"""
+import argparse
+import collections
+import fcntl
+import json
+import os
+import select
+import socket
+import struct
+import sys
+import time
+
+from uart_termios import open_port
+
+TIOCGICOUNT = 0x545D
+# struct serial_icounter_struct: cts, dsr, rng, dcd, rx, tx, frame, overrun,
+# parity, brk, buf_overrun, reserved[9]
+ICOUNT = struct.Struct('20i')
+ICOUNT_FIELDS = ('cts', 'dsr', 'rng', 'dcd', 'rx', 'tx', 'frame', 'overrun', 'parity', 'brk', 'buf_overrun')
+ERROR_FIELDS = ('frame', 'parity', 'overrun', 'buf_overrun', 'brk')
+
+
+def get_icount(fd):
+    """Driver counters as a dict, or None if the driver does not keep them."""
+    buf = bytearray(ICOUNT.size)
+    try:
+        fcntl.ioctl(fd, TIOCGICOUNT, buf)
+    except OSError:
+        return None
+    return dict(zip(ICOUNT_FIELDS, ICOUNT.unpack(buf)))
+
+
+class PortStats(object):
+    def __init__(self, path, fd, window):
+        self.path = path
+        self.fd = fd
+        self.read_bytes = 0
+        self.reads = 0
+        base = get_icount(fd)
+        self.has_icount = base is not None
+        # Counters are cumulative since boot; report them relative to start
+        self.base = base or {}
+        self.icount = dict.fromkeys(ICOUNT_FIELDS, 0)
+        self.history = collections.deque(maxlen=window + 1)
+        self.error = None
+
+    def sample(self, now):
+        if self.has_icount:
+            current = get_icount(self.fd)
+            if current is None:
+                self.error = 'TIOCGICOUNT failed'
+            else:
+                self.icount = {k: current[k] - self.base.get(k, 0) for k in ICOUNT_FIELDS}
+        self.history.append((now, self.rx_bytes, self.tx_bytes))
+
+    @property
+    def rx_bytes(self):
+        return self.icount['rx'] if self.has_icount else self.read_bytes
+
+    @property
+    def tx_bytes(self):
+        return self.icount['tx'] if self.has_icount else None
+
+    def rates(self, span):
+        """(rx, tx) bytes/s over the last span samples, None for unknown."""
+        if len(self.history) < 2:
+            return None, None
+        t1, rx1, tx1 = self.history[-1]
+        t0, rx0, tx0 = self.history[max(0, len(self.history) - 1 - span)]
+        dt = t1 - t0
+        if dt <= 0:
+            return None, None
+        return (rx1 - rx0) / dt, (tx1 - tx0) / dt if tx1 is not None else None
+
+    def snapshot(self):
+        rx_rate, tx_rate = self.rates(1)
+        rx_avg, tx_avg = self.rates(len(self.history) - 1)
+        return {
+            'port': self.path,
+            'rx_bytes': self.rx_bytes,
+            'tx_bytes': self.tx_bytes,
+            'read_bytes': self.read_bytes,
+            'reads': self.reads,
+            'rx_rate': rx_rate,
+            'tx_rate': tx_rate,
+            'rx_rate_avg': rx_avg,
+            'tx_rate_avg': tx_avg,
+            'errors': {k: self.icount[k] for k in ERROR_FIELDS} if self.has_icount else None,
+            'modem': {k: self.icount[k] for k in ('cts', 'dsr', 'rng', 'dcd')} if self.has_icount else None,
+            'error': self.error,
+        }
+
+
+class UartMonitor(object):
+    def __init__(self, ports, baud=115200, observe=False, interval=1.0, window=10,
+                 socket_path=None, snapshot_path=None, read_size=65536):
+        self.interval = interval
+        self.observe = observe
+        self.snapshot_path = snapshot_path
+        self.socket_path = socket_path
+        self.started = time.time()
+        self.ports = []
+        for path in ports:
+            if observe:
+                # Leave the owner's settings alone, just hold an fd for ioctls
+                fd = os.open(path, os.O_RDONLY | os.O_NOCTTY | os.O_NONBLOCK)
+            else:
+                fd = open_port(path, nonblocking=True, baud=baud)
+            self.ports.append(PortStats(path, fd, window))
+        self.by_fd = {p.fd: p for p in self.ports}
+
+        self._buf = bytearray(read_size)
+        self._view = memoryview(self._buf)
+        self.poller = select.poll()
+        if not observe:
+            for p in self.ports:
+                self.poller.register(p.fd, select.POLLIN)
+
+        self.server = None
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.server.bind(socket_path)
+            self.server.listen(8)
+            self.server.setblocking(False)
+            self.poller.register(self.server.fileno(), select.POLLIN)
+
+    def snapshot(self):
+        return {
+            'time': time.time(),
+            'uptime': time.time() - self.started,
+            'interval': self.interval,
+            'ports': [p.snapshot() for p in self.ports],
+        }
+
+    def _serve(self):
+        try:
+            conn, _ = self.server.accept()
+        except BlockingIOError:
+            return
+        try:
+            conn.settimeout(1.0)
+            conn.sendall(json.dumps(self.snapshot()).encode() + b'\n')
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+    def _read(self, port):
+        try:
+            n = os.readv(port.fd, [self._view])
+        except BlockingIOError:
+            return
+        except OSError as e:
+            port.error = str(e)
+            self.poller.unregister(port.fd)
+            return
+        if n == 0:
+            # EOF / hangup: the fd stays readable and would spin the loop
+            port.error = "end of file (hangup)"
+            self.poller.unregister(port.fd)
+            return
+        port.reads += 1
+        port.read_bytes += n
+
+    def _write_snapshot(self):
+        tmp = self.snapshot_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp, self.snapshot_path)
+
+    def tick(self, now):
+        for p in self.ports:
+            p.sample(now)
+        if self.snapshot_path:
+            self._write_snapshot()
+
+    def run(self, duration=0, on_tick=None):
+        start = time.monotonic()
+        self.tick(start)
+        next_tick = start + self.interval
+        server_fd = self.server.fileno() if self.server else None
+        while not duration or time.monotonic() - start < duration:
+            timeout = max(0.0, next_tick - time.monotonic())
+            for fd, _ in self.poller.poll(timeout * 1000):
+                if fd == server_fd:
+                    self._serve()
+                else:
+                    self._read(self.by_fd[fd])
+            now = time.monotonic()
+            if now >= next_tick:
+                self.tick(now)
+                next_tick = max(next_tick + self.interval, now)
+                if on_tick:
+                    on_tick(self)
+
+    def close(self):
+        for p in self.ports:
+            os.close(p.fd)
+        if self.server:
+            self.server.close()
+            os.unlink(self.socket_path)
+
+
+def fmt_rate(rate):
+    return '-' if rate is None else f"{rate / 1000:.1f}"
+
+
+def print_dashboard(monitor):
+    print(f"\n{time.strftime('%H:%M:%S')}  {'port':<14} {'rx kB/s':>8} {'tx kB/s':>8} {'rx avg':>7} "
+          f"{'rx total':>10} {'tx total':>10} {'frame':>6} {'parity':>6} {'ovrun':>6} {'bufov':>6} {'brk':>4}")
+    for snap in (p.snapshot() for p in monitor.ports):
+        errors = snap['errors'] or {}
+        print(f"{'':10}{snap['port']:<14} {fmt_rate(snap['rx_rate']):>8} {fmt_rate(snap['tx_rate']):>8} "
+              f"{fmt_rate(snap['rx_rate_avg']):>7} {snap['rx_bytes']:>10} "
+              f"{'-' if snap['tx_bytes'] is None else snap['tx_bytes']:>10} "
+              + ' '.join(f"{errors.get(k, '-'):>{w}}" for k, w in
+                         (('frame', 6), ('parity', 6), ('overrun', 6), ('buf_overrun', 6), ('brk', 4)))
+              + (f"  {snap['error']}" if snap['error'] else ''))
+    sys.stdout.flush()
+
+
+def cmd_watch(args):
+    try:
+        monitor = UartMonitor(args.ports, args.baud, args.observe, args.interval, args.window,
+                              args.socket, args.snapshot)
+    except OSError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    for p in monitor.ports:
+        if not p.has_icount:
+            print(f"{p.path}: no TIOCGICOUNT, counting read bytes only")
+    print(f"Monitoring {len(monitor.ports)} port(s)"
+          + (f", snapshots on {args.socket}" if args.socket else "")
+          + (f", {args.snapshot}" if args.snapshot else "") + " (Ctrl+C to stop)")
+    try:
+        monitor.run(args.duration, None if args.quiet else print_dashboard)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        monitor.close()
+
+
+def query(socket_path, timeout=2.0):
+    """Fetch a snapshot from a running monitor."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+        data = bytearray()
+        while True:
+            part = sock.recv(65536)
+            if not part:
+                break
+            data += part
+    finally:
+        sock.close()
+    return json.loads(data)
+
+
+def cmd_query(args):
+    try:
+        snap = query(args.socket)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    print(json.dumps(snap, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Watch several UARTs from one poll loop')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    watch = sub.add_parser('watch', help='Monitor ports and print a dashboard')
+    watch.add_argument('ports', nargs='+', help='Serial ports, e.g. /dev/ttyS4 /dev/ttyS5')
+    watch.add_argument('-b', '--baud', type=int, default=115200, help='Baud rate (default: 115200)')
+    watch.add_argument('--observe', action='store_true',
+                       help='Do not configure or read the ports, only sample driver counters')
+    watch.add_argument('-i', '--interval', type=float, default=1.0, help='Seconds between samples (default: 1)')
+    watch.add_argument('-w', '--window', type=int, default=10,
+                       help='Samples in the rolling average (default: 10)')
+    watch.add_argument('-d', '--duration', type=float, default=0, help='Seconds to run, 0 = until Ctrl+C')
+    watch.add_argument('--socket', help='Serve JSON snapshots on this unix socket')
+    watch.add_argument('--snapshot', help='Atomically rewrite this JSON file every interval')
+    watch.add_argument('-q', '--quiet', action='store_true', help='No dashboard output')
+    watch.set_defaults(func=cmd_watch)
+
+    q = sub.add_parser('query', help='Print the snapshot of a running monitor')
+    q.add_argument('socket', help='Monitor unix socket')
+    q.set_defaults(func=cmd_query)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Bulk UART receiver.
+
+Blocks in poll() on the serial fd instead of spinning on in_waiting, reads
+everything the driver has buffered straight into one preallocated
+bytearray, and hands it on in fixed-size chunks.  A partial chunk is flushed
+once the line has been idle for flush_timeout, so short messages are not
+held back.
+
+    rx = BulkReceiver(ser, chunk_size=256, on_chunk=handle)
+    rx.start()
+    ...
+    rx.stop()
+
+Without on_chunk the chunks go to rx.queue.
+"""
+import os
+import queue
+import select
+import threading
+import time
+
+PATTERN = bytes(range(256))
+
+
+class BulkReceiver(object):
+    def __init__(self, port, chunk_size=256, on_chunk=None, buffer_size=65536,
+                 flush_timeout=0.05, queue_size=0):
+        # port is a pyserial Serial or a raw file descriptor
+        self.fd = port if isinstance(port, int) else port.fileno()
+        self.chunk_size = chunk_size
+        self.on_chunk = on_chunk
+        self.flush_timeout = flush_timeout
+        self.queue = queue.Queue(maxsize=queue_size)
+
+        assert buffer_size >= 2 * chunk_size, "buffer_size must hold at least two chunks"
+        self._buf = bytearray(buffer_size)
+        self._view = memoryview(self._buf)
+        self._fill = 0
+
+        self.bytes_received = 0
+        self.chunks = 0
+        self.reads = 0
+        self.max_read = 0
+        self.dropped_chunks = 0
+        self.error = None  # why the receiver stopped on its own, if it did
+
+        self._wake_r, self._wake_w = os.pipe()
+        self._stop = False
+        self._thread = None
+
+    def start(self):
+        self._stop = False
+        self._thread = threading.Thread(target=self.run, name=f"BulkReceiver-{self.fd}")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        self._stop = True
+        os.write(self._wake_w, b'\0')
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def run(self):
+        poller = select.poll()
+        poller.register(self.fd, select.POLLIN | select.POLLERR | select.POLLHUP)
+        poller.register(self._wake_r, select.POLLIN)
+        idle_ms = max(1, int(self.flush_timeout * 1000))
+
+        while not self._stop:
+            events = poller.poll(idle_ms)
+            if not events:
+                # Line idle: pass on whatever partial chunk is buffered
+                if self._fill:
+                    self._emit(self._fill)
+                continue
+
+            for fd, mask in events:
+                if fd == self._wake_r:
+                    continue
+                if mask & (select.POLLERR | select.POLLHUP | select.POLLNVAL) and not mask & select.POLLIN:
+                    self.error = "hangup" if mask & select.POLLHUP else "poll error"
+                    self._stop = True
+                    break
+                self._read()
+
+        if self._fill:
+            self._emit(self._fill)
+
+    def _read(self):
+        try:
+            n = os.readv(self.fd, [self._view[self._fill:]])
+        except BlockingIOError:
+            return
+        except OSError as e:
+            # EIO and friends: the device is gone (USB adapter unplugged)
+            self.error = str(e)
+            self._stop = True
+            return
+        if n == 0:
+            # EOF / hangup: the fd stays readable and would spin the loop
+            self.error = "end of file (hangup)"
+            self._stop = True
+            return
+        self.reads += 1
+        self.bytes_received += n
+        if n > self.max_read:
+            self.max_read = n
+        self._fill += n
+
+        start = 0
+        while self._fill - start >= self.chunk_size:
+            self._deliver(self._view[start:start + self.chunk_size])
+            start += self.chunk_size
+        if start:
+            # Move the leftover partial chunk to the front of the buffer
+            remaining = self._fill - start
+            self._buf[:remaining] = self._view[start:self._fill]
+            self._fill = remaining
+
+    def _emit(self, length):
+        self._deliver(self._view[:length])
+        self._fill = 0
+
+    def _deliver(self, view):
+        chunk = view.tobytes()
+        self.chunks += 1
+        if self.on_chunk:
+            self.on_chunk(chunk)
+            return
+        try:
+            self.queue.put_nowait(chunk)
+        except queue.Full:
+            self.dropped_chunks += 1
+
+    def stats(self):
+        return {
+            'bytes': self.bytes_received,
+            'reads': self.reads,
+            'chunks': self.chunks,
+            'max_read': self.max_read,
+            'avg_read': self.bytes_received / self.reads if self.reads else 0,
+            'dropped_chunks': self.dropped_chunks,
+            'error': self.error,
+        }
+
+
+def format_chunk(chunk, offset=0):
+    """One printable line per chunk: offset, length, hex prefix and ASCII."""
+    ascii_part = ''.join(chr(b) if 32 <= b <= 126 else '.' for b in chunk)
+    hex_part = chunk[:16].hex(' ')
+    if len(chunk) > 16:
+        hex_part += ' ...'
+    return f"READ[{offset}+{len(chunk)}]: {hex_part}  '{ascii_part}'"
+
+
+def wait_for(receiver, predicate, timeout):
+    """Collect queued chunks until predicate(data) is true or timeout expires."""
+    data = bytearray()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            data += receiver.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+        except queue.Empty:
+            break
+        if predicate(data):
+            break
+    return data
+
+
+class PatternChecker(object):
+    """on_chunk callback checking data against the repeating PATTERN."""
+
+    def __init__(self, max_chunk):
+        # Long enough to compare any chunk starting at any pattern offset
+        self.reference = PATTERN * (max_chunk // 256 + 2)
+        self.expected = None
+        self.bytes = 0
+        self.gaps = 0
+        self.first = None
+        self.last = None
+
+    def __call__(self, chunk):
+        now = time.monotonic()
+        if self.first is None:
+            self.first = now
+        self.last = now
+        self.bytes += len(chunk)
+
+        if self.expected is None:
+            self.expected = chunk[0]
+        if chunk != self.reference[self.expected:self.expected + len(chunk)]:
+            self.gaps += 1
+        self.expected = (chunk[-1] + 1) & 0xFF
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Flow-control aware UART sender.
+
+Producers hand data to FlowSender.send(), which queues it for a writer
+thread and blocks once max_queue bytes are waiting, so a fast producer is
+held back instead of growing memory or the kernel buffer without bound.
+The writer keeps the kernel output queue (TIOCOUTQ) between low_water and
+high_water: it only writes what fits under high_water and, when the queue
+is full, waits for it to drain at line rate.
+
+RTS/CTS and XON/XOFF are done by the kernel (CRTSCTS / IXON set through
+uart_termios); while the far end holds us off the output queue stops
+draining, which the writer sees and counts as a flow stall.  Bytes in
+the kernel queue are at most high_water / line rate seconds from the wire.
+
+    sender = FlowSender(fd, baud=921600)
+    sender.start()
+    sender.send(block)          # blocks while the queue is full
+    sender.flush()
+    print(sender.stats())
+
+    ./uart_sender.py /dev/ttyS4 --rx /dev/ttyS5 -b 921600 --rtscts -d 10
+"""
+import argparse
+import collections
+import fcntl
+import os
+import select
+import struct
+import sys
+import termios
+import threading
+import time
+
+from uart_rx import PATTERN, BulkReceiver, PatternChecker
+from uart_termios import open_port
+
+TIOCOUTQ = getattr(termios, 'TIOCOUTQ', 0x5411)
+TIOCMGET = getattr(termios, 'TIOCMGET', 0x5415)
+TIOCM_CTS = getattr(termios, 'TIOCM_CTS', 0x020)
+INT = struct.Struct('i')
+
+
+def out_queue(fd):
+    """Bytes written but not yet sent by the UART."""
+    buf = bytearray(INT.size)
+    fcntl.ioctl(fd, TIOCOUTQ, buf)
+    return INT.unpack(buf)[0]
+
+
+def cts_state(fd):
+    """True/False for the CTS line, None if the driver has no modem lines."""
+    buf = bytearray(INT.size)
+    try:
+        fcntl.ioctl(fd, TIOCMGET, buf)
+    except OSError:
+        return None
+    return bool(INT.unpack(buf)[0] & TIOCM_CTS)
+
+
+class FlowSender(object):
+    def __init__(self, port, baud=115200, high_water=4096, low_water=1024, max_queue=64 * 1024):
+        # port is a pyserial Serial or a raw file descriptor
+        self.fd = port if isinstance(port, int) else port.fileno()
+        self.line_rate = baud / 10.0
+        self.high_water = high_water
+        self.low_water = low_water
+        self.max_queue = max_queue
+
+        self._queue = collections.deque()
+        self._queued = 0
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+
+        self.bytes_sent = 0
+        self.writes = 0
+        self.max_outq = 0
+        self.flow_stalls = 0
+        self.kernel_wait = 0.0      # writer waiting for the output queue to drain
+        self.producer_wait = 0.0    # send() callers blocked on a full queue
+        self.producer_stalls = 0
+
+    def start(self):
+        self._stop = False
+        self._thread = threading.Thread(target=self.run, name=f"FlowSender-{self.fd}")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def send(self, data, timeout=None):
+        """Queue data; block while the queue is full.  False on timeout."""
+        with self._cond:
+            # A block larger than max_queue is still accepted into an empty queue
+            if self._queued and self._queued + len(data) > self.max_queue:
+                self.producer_stalls += 1
+                start = time.monotonic()
+                ok = self._cond.wait_for(
+                    lambda: self._stop or not self._queued or self._queued + len(data) <= self.max_queue,
+                    timeout)
+                self.producer_wait += time.monotonic() - start
+                if not ok or self._stop:
+                    return False
+            self._queue.append(memoryview(data))
+            self._queued += len(data)
+            self._cond.notify_all()
+        return True
+
+    @property
+    def queued(self):
+        return self._queued
+
+    def flush(self, timeout=None):
+        """Wait until everything queued has left the UART."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            if not self._cond.wait_for(lambda: not self._queued or self._stop, timeout):
+                return False
+        while True:
+            outq = out_queue(self.fd)
+            if not outq:
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(min(0.05, max(0.001, outq / self.line_rate)))
+
+    def _wait_drain(self, outq):
+        """Sleep until the output queue should be at low_water; count stalls."""
+        delay = min(0.05, max(0.001, (outq - self.low_water) / self.line_rate))
+        start = time.monotonic()
+        with self._cond:
+            self._cond.wait_for(lambda: self._stop, delay)
+        self.kernel_wait += time.monotonic() - start
+        if out_queue(self.fd) >= outq:
+            # Nothing left the UART in that time: CTS low or XOFF received
+            self.flow_stalls += 1
+
+    def run(self):
+        poller = select.poll()
+        poller.register(self.fd, select.POLLOUT)
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._stop or self._queued)
+                if self._stop:
+                    return
+                head = self._queue[0]
+
+            outq = out_queue(self.fd)
+            if outq > self.max_outq:
+                self.max_outq = outq
+            room = self.high_water - outq
+            if room <= 0:
+                self._wait_drain(outq)
+                continue
+
+            try:
+                n = os.write(self.fd, head[:room])
+            except BlockingIOError:
+                start = time.monotonic()
+                poller.poll(50)
+                self.kernel_wait += time.monotonic() - start
+                continue
+            self.writes += 1
+            self.bytes_sent += n
+            with self._cond:
+                if n < len(head):
+                    self._queue[0] = head[n:]
+                else:
+                    self._queue.popleft()
+                self._queued -= n
+                self._cond.notify_all()
+
+    def stats(self):
+        return {
+            'bytes': self.bytes_sent,
+            'writes': self.writes,
+            'queued': self._queued,
+            'max_outq': self.max_outq,
+            'max_outq_ms': 1000.0 * self.max_outq / self.line_rate,
+            'flow_stalls': self.flow_stalls,
+            'kernel_wait': self.kernel_wait,
+            'producer_wait': self.producer_wait,
+            'producer_stalls': self.producer_stalls,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk send with flow control and output queue backpressure')
+    parser.add_argument('port', help='Transmit port, e.g. /dev/ttyS4')
+    parser.add_argument('--rx', help='Receive port to verify the data on (default: none)')
+    parser.add_argument('-b', '--baud', type=int, default=115200, help='Baud rate (default: 115200)')
+    parser.add_argument('--rtscts', action='store_true', help='RTS/CTS hardware flow control')
+    parser.add_argument('--xonxoff', action='store_true', help='XON/XOFF software flow control')
+    parser.add_argument('-d', '--duration', type=float, default=10.0, help='Seconds to produce data (default: 10)')
+    parser.add_argument('-w', '--write-size', type=int, default=4096, help='Bytes per send() (default: 4096)')
+    parser.add_argument('--high-water', type=int, default=4096,
+                        help='Max bytes in the kernel output queue (default: 4096)')
+    parser.add_argument('--low-water', type=int, default=1024, help='Refill below this (default: 1024)')
+    parser.add_argument('--max-queue', type=int, default=64 * 1024,
+                        help='Bytes queued before send() blocks (default: 65536)')
+
+    args = parser.parse_args()
+
+    settings = dict(baud=args.baud, rtscts=args.rtscts, xonxoff=args.xonxoff)
+    try:
+        tx = open_port(args.port, nonblocking=True, **settings)
+        rx = open_port(args.rx, nonblocking=True, **settings) if args.rx else None
+    except OSError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    checker = receiver = None
+    if rx is not None:
+        checker = PatternChecker(4096)
+        receiver = BulkReceiver(rx, chunk_size=4096, on_chunk=checker)
+        receiver.start()
+
+    sender = FlowSender(tx, args.baud, args.high_water, args.low_water, args.max_queue)
+    sender.start()
+    block = PATTERN * max(1, args.write_size // 256)
+    produced = 0
+    flow = 'RTS/CTS' if args.rtscts else 'XON/XOFF' if args.xonxoff else 'no flow control'
+    print(f"Sending on {args.port} at {args.baud} baud, {flow}, CTS {cts_state(tx)}, "
+          f"kernel queue {args.low_water}..{args.high_water} bytes")
+    start = time.monotonic()
+    try:
+        while time.monotonic() - start < args.duration:
+            sender.send(block)
+            produced += len(block)
+        sender.flush(timeout=5.0 + sender.queued / sender.line_rate)
+    except KeyboardInterrupt:
+        print("\nInterrupted")
+    elapsed = time.monotonic() - start
+    sender.stop()
+    if receiver:
+        # Let the tail arrive: wait until nothing more comes for a second
+        last = -1
+        while checker.bytes < produced and checker.bytes != last:
+            last = checker.bytes
+            time.sleep(1.0)
+        receiver.stop()
+    os.close(tx)
+    if rx is not None:
+        os.close(rx)
+
+    stats = sender.stats()
+    print(f"\nProduced:        {produced} bytes, sent {stats['bytes']} in {stats['writes']} writes "
+          f"({stats['bytes'] / elapsed / 1000:.1f} kB/s, "
+          f"{100.0 * stats['bytes'] / elapsed / sender.line_rate:.1f}% of line rate)")
+    print(f"Producer blocked: {stats['producer_wait']:.2f} s in {stats['producer_stalls']} stalls "
+          f"({100.0 * stats['producer_wait'] / elapsed:.0f}% of run)")
+    print(f"Writer waiting:   {stats['kernel_wait']:.2f} s for the output queue, "
+          f"{stats['flow_stalls']} flow-control stalls")
+    print(f"Output queue max: {stats['max_outq']} bytes ({stats['max_outq_ms']:.1f} ms of line time)")
+    ok = stats['bytes'] == produced
+    if checker is not None:
+        print(f"Received:         {checker.bytes} bytes, pattern gaps: {checker.gaps}")
+        ok = ok and checker.bytes == produced and not checker.gaps
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Pseudo-terminal UART simulator.
+
+Creates a pair of linked virtual serial ports (or a single looped-back one)
+so the UART tools can run without /dev/ttyS* hardware.  Bytes written to
+one port come out of the other after:
+
+  * pacing at the line rate of --baud (10 bits per byte, 8N1),
+  * a fixed --latency,
+  * random --loss (dropped bytes) and --corrupt (one flipped bit per hit),
+    both given as per-byte probabilities.
+
+The ports are symlinked to stable names, so existing tools run unchanged:
+
+    ./uart_sim.py --link /tmp/ttyS4 --link /tmp/ttyS5 -b 115200 --loss 1e-5 &
+    ./uart_ber.py /tmp/ttyS4 --rx /tmp/ttyS5 -b 115200
+    ./t_uart_keep.py /tmp/ttyS4
+
+With a single --link the port is looped back to itself (TX wired to RX).
+"""
+import argparse
+import collections
+import math
+import os
+import random
+import select
+import signal
+import sys
+import threading
+import time
+import tty
+
+
+class Impairments(object):
+    def __init__(self, baud=115200, latency=0.0, loss=0.0, corrupt=0.0, seed=None):
+        self.baud = baud
+        self.latency = latency
+        self.loss = loss
+        self.corrupt = corrupt
+        self.random = random.Random(seed)
+
+    @property
+    def byte_time(self):
+        return 10.0 / self.baud if self.baud else 0.0
+
+    def gap(self, p):
+        # Bytes until the next hit for per-byte probability p (geometric)
+        if p <= 0:
+            return None
+        if p >= 1:
+            return 0
+        return int(math.log(1.0 - self.random.random()) / math.log(1.0 - p))
+
+
+class Direction(object):
+    """One way of the link: reads a master fd, delivers to another."""
+
+    def __init__(self, name, src, dst, impairments, slice_time=0.002):
+        self.name = name
+        self.src = src
+        self.dst = dst
+        self.imp = impairments
+        # Deliver in slices of about slice_time of line time for smooth pacing
+        self.slice_bytes = max(1, int(slice_time / impairments.byte_time)) if impairments.byte_time else 65536
+        self.pending = collections.deque()   # (due time, bytes)
+        self.out = bytearray()               # due but not yet accepted by dst
+        self.queued = 0
+        self.wire_free = 0.0
+        self.next_loss = impairments.gap(impairments.loss)
+        self.next_corrupt = impairments.gap(impairments.corrupt)
+
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.lost = 0
+        self.corrupted = 0
+
+    def backlog(self):
+        return len(self.out) + self.queued
+
+    def impair(self, data):
+        data = bytearray(data)
+        if self.next_corrupt is not None:
+            pos = self.next_corrupt
+            while pos < len(data):
+                data[pos] ^= 1 << self.imp.random.randrange(8)
+                self.corrupted += 1
+                pos += 1 + self.imp.gap(self.imp.corrupt)
+            self.next_corrupt = pos - len(data)
+        if self.next_loss is not None:
+            keep = bytearray()
+            start = 0
+            pos = self.next_loss
+            while pos < len(data):
+                keep += data[start:pos]
+                self.lost += 1
+                start = pos + 1
+                pos = start + self.imp.gap(self.imp.loss)
+            keep += data[start:]
+            self.next_loss = pos - len(data)
+            data = keep
+        return bytes(data)
+
+    def on_input(self, data, now):
+        self.bytes_in += len(data)
+        # Line time is spent on the sending side even for bytes that get lost
+        for i in range(0, len(data), self.slice_bytes):
+            part = data[i:i + self.slice_bytes]
+            self.wire_free = max(self.wire_free, now) + len(part) * self.imp.byte_time
+            part = self.impair(part)
+            if part:
+                self.pending.append((self.wire_free + self.imp.latency, part))
+                self.queued += len(part)
+
+    def next_due(self):
+        return self.pending[0][0] if self.pending else None
+
+    def deliver(self, now):
+        while self.pending and self.pending[0][0] <= now:
+            part = self.pending.popleft()[1]
+            self.queued -= len(part)
+            self.out += part
+        if self.out:
+            try:
+                n = os.write(self.dst, self.out)
+            except BlockingIOError:
+                return
+            except OSError:
+                # Nobody has the port open; the bytes fall on the floor
+                n = len(self.out)
+            self.bytes_out += n
+            del self.out[:n]
+
+
+class UartSimulator(object):
+    def __init__(self, links, impairments=None, max_backlog=4096):
+        """links: one path (loopback) or two paths (linked pair).
+
+        max_backlog bounds the bytes in flight per direction, like the 4 KiB
+        transmit buffer of the serial core; beyond it the pty fills and
+        writers block, as they would on a real port at line rate.
+        """
+        assert 1 <= len(links) <= 2, "One (loopback) or two (pair) links"
+        self.links = links
+        self.imp = impairments or Impairments()
+        self.max_backlog = max_backlog
+        self.masters = []
+        self.slaves = []
+        for link in links:
+            master, slave = os.openpty()
+            tty.setraw(slave)
+            os.set_blocking(master, False)
+            # Keeping our own slave fd open stops the master seeing EIO
+            # whenever the tool under test closes the port.
+            self.masters.append(master)
+            self.slaves.append(slave)
+            if os.path.lexists(link):
+                os.unlink(link)
+            os.symlink(os.ttyname(slave), link)
+
+        if len(links) == 1:
+            self.directions = [Direction(links[0] + ' loop', self.masters[0], self.masters[0], self.imp)]
+        else:
+            self.directions = [
+                Direction(f'{links[0]} -> {links[1]}', self.masters[0], self.masters[1], self.imp),
+                Direction(f'{links[1]} -> {links[0]}', self.masters[1], self.masters[0], self.imp),
+            ]
+        self._stop_r, self._stop_w = os.pipe()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='UartSimulator')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        os.write(self._stop_w, b'\0')
+        if self._thread:
+            self._thread.join(2.0)
+        for link in self.links:
+            if os.path.islink(link):
+                os.unlink(link)
+        for fd in self.masters + self.slaves + [self._stop_r, self._stop_w]:
+            os.close(fd)
+
+    def run(self):
+        by_src = {d.src: d for d in self.directions}
+        while True:
+            now = time.monotonic()
+            # Stop reading a source whose backlog is full (crude flow control)
+            readers = [d.src for d in self.directions if d.backlog() < self.max_backlog]
+            writers = [d.dst for d in self.directions if d.out]
+            due = [d.next_due() for d in self.directions if d.pending]
+            timeout = max(0.0, min(due) - now) if due else None
+            r, w, _ = select.select(readers + [self._stop_r], writers, [], timeout)
+            if self._stop_r in r:
+                return
+            now = time.monotonic()
+            for fd in r:
+                try:
+                    data = os.read(fd, 65536)
+                except (BlockingIOError, OSError):
+                    continue
+                by_src[fd].on_input(data, now)
+            for d in self.directions:
+                d.deliver(now)
+
+    def stats(self):
+        return [(d.name, d.bytes_in, d.bytes_out, d.lost, d.corrupted) for d in self.directions]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Virtual serial ports with pacing and error injection')
+    parser.add_argument('-l', '--link', action='append', required=True,
+                        help='Path to create for a port; give once for loopback, twice for a pair')
+    parser.add_argument('-b', '--baud', type=int, default=115200,
+                        help='Line rate to pace at, 0 = unpaced (default: 115200)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Extra one-way latency in seconds')
+    parser.add_argument('--loss', type=float, default=0.0, help='Per-byte drop probability')
+    parser.add_argument('--corrupt', type=float, default=0.0, help='Per-byte bit-flip probability')
+    parser.add_argument('--seed', type=int, help='Random seed for reproducible error patterns')
+
+    args = parser.parse_args()
+
+    imp = Impairments(args.baud, args.latency, args.loss, args.corrupt, args.seed)
+    try:
+        sim = UartSimulator(args.link, imp)
+    except (OSError, AssertionError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    print(f"Simulating {' <-> '.join(args.link) if len(args.link) == 2 else args.link[0] + ' (loopback)'} "
+          f"at {args.baud} baud, latency {args.latency * 1000:.1f} ms, "
+          f"loss {args.loss:g}, corrupt {args.corrupt:g}  (Ctrl+C to stop)")
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    sim.start()
+    try:
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    sim.stop()
+    for name, bytes_in, bytes_out, lost, corrupted in sim.stats():
+        print(f"{name}: in {bytes_in}, out {bytes_out}, lost {lost}, corrupted {corrupted}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+termios port configuration and monitor.
+
+Replaces the stty/dd shell scripts (t4, back_5, s-unii5, uart5.sh,
+test_uart.sh, the uni5 loopback test): the whole line discipline is set
+with one tcsetattr() call, and data is read in blocks by the kernel's
+VMIN/VTIME logic rather than by a dd process per byte.  Rates without a
+Bxxx constant (e.g. 1000000 on some builds, or 250000) are set through the
+Linux termios2 BOTHER interface.
+
+    ./uart_termios.py config /dev/ttyS4 -b 1000000 --rtscts   # like stty
+    ./uart_termios.py show /dev/ttyS4
+    ./uart_termios.py monitor /dev/ttyS4 -b 19200              # like t4
+    ./uart_termios.py monitor /dev/ttyS5 --status-file /tmp/uart_status
+    ./uart_termios.py loopback /dev/ttyS5 -b 19200 -d 10       # like uni5
+    ./uart_termios.py loopback /dev/ttyS4 --rx /dev/ttyS5 -m "UART Loopback Test"
+"""
+import argparse
+import fcntl
+import os
+import select
+import struct
+import sys
+import termios
+import time
+
+# struct termios2 from asm-generic/termbits.h: four tcflag_t, c_line, c_cc[19], speeds
+TERMIOS2 = struct.Struct('IIIIB19sII')
+TCGETS2 = 0x80000000 | (TERMIOS2.size << 16) | (ord('T') << 8) | 0x2A
+TCSETS2 = 0x40000000 | (TERMIOS2.size << 16) | (ord('T') << 8) | 0x2B
+BOTHER = 0o010000
+CBAUD = getattr(termios, 'CBAUD', 0o010017)
+
+BYTESIZES = {5: termios.CS5, 6: termios.CS6, 7: termios.CS7, 8: termios.CS8}
+
+
+def baud_constant(baud):
+    return getattr(termios, f'B{baud}', None)
+
+
+def set_custom_baud(fd, baud):
+    """Set an arbitrary rate with TCSETS2/BOTHER (Linux only)."""
+    buf = bytearray(TERMIOS2.size)
+    fcntl.ioctl(fd, TCGETS2, buf)
+    iflag, oflag, cflag, lflag, line, cc, _, _ = TERMIOS2.unpack(buf)
+    cflag = (cflag & ~CBAUD) | BOTHER
+    # Input speed 0 means "same as output"
+    cflag &= ~(CBAUD << 16)
+    fcntl.ioctl(fd, TCSETS2, TERMIOS2.pack(iflag, oflag, cflag, lflag, line, cc, baud, baud))
+
+
+def get_baud(fd):
+    buf = bytearray(TERMIOS2.size)
+    try:
+        fcntl.ioctl(fd, TCGETS2, buf)
+        return TERMIOS2.unpack(buf)[7]
+    except OSError:
+        speed = termios.tcgetattr(fd)[5]
+        for name in dir(termios):
+            if name[0] == 'B' and name[1:].isdigit() and getattr(termios, name) == speed:
+                return int(name[1:])
+        return None
+
+
+def configure(fd, baud=115200, bytesize=8, parity='N', stopbits=1, rtscts=False, xonxoff=False,
+              vmin=0, vtime=0, hupcl=False, flush=True):
+    """Raw mode plus framing, flow control and VMIN/VTIME in one tcsetattr().
+
+    Equivalent of "stty raw -echo cs8 -parenb -cstopb -crtscts min 0 time 0"
+    and friends.  vtime is in tenths of a second.
+    """
+    if parity not in ('N', 'E', 'O'):
+        raise ValueError(f"Unsupported parity {parity!r}")
+    iflag, oflag, cflag, lflag, ispeed, ospeed, cc = termios.tcgetattr(fd)
+
+    iflag &= ~(termios.IGNBRK | termios.BRKINT | termios.PARMRK | termios.ISTRIP | termios.INLCR |
+               termios.IGNCR | termios.ICRNL | termios.IXON | termios.IXOFF | termios.IXANY | termios.INPCK)
+    if xonxoff:
+        iflag |= termios.IXON | termios.IXOFF
+    if parity != 'N':
+        iflag |= termios.INPCK
+    oflag &= ~termios.OPOST
+    lflag &= ~(termios.ECHO | termios.ECHONL | termios.ICANON | termios.ISIG | termios.IEXTEN)
+
+    cflag &= ~(termios.CSIZE | termios.PARENB | termios.PARODD | termios.CSTOPB |
+               termios.CRTSCTS | termios.HUPCL)
+    cflag |= BYTESIZES[bytesize] | termios.CLOCAL | termios.CREAD
+    if parity != 'N':
+        cflag |= termios.PARENB | (termios.PARODD if parity == 'O' else 0)
+    if stopbits == 2:
+        cflag |= termios.CSTOPB
+    if rtscts:
+        cflag |= termios.CRTSCTS
+    if hupcl:
+        cflag |= termios.HUPCL
+
+    cc = list(cc)
+    cc[termios.VMIN] = vmin
+    cc[termios.VTIME] = vtime
+
+    speed = baud_constant(baud)
+    if speed is not None:
+        ispeed = ospeed = speed
+    termios.tcsetattr(fd, termios.TCSANOW, [iflag, oflag, cflag, lflag, ispeed, ospeed, cc])
+    if speed is None:
+        set_custom_baud(fd, baud)
+    if flush:
+        termios.tcflush(fd, termios.TCIOFLUSH)
+
+
+def open_port(path, nonblocking=False, **settings):
+    # Opened non-blocking so a missing carrier cannot hang open()
+    fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    try:
+        if not nonblocking:
+            os.set_blocking(fd, True)
+        configure(fd, **settings)
+    except (OSError, termios.error, ValueError):
+        os.close(fd)
+        raise
+    return fd
+
+
+def describe(fd):
+    iflag, oflag, cflag, lflag, _, _, cc = termios.tcgetattr(fd)
+    size = {v: k for k, v in BYTESIZES.items()}[cflag & termios.CSIZE]
+    parity = 'N' if not cflag & termios.PARENB else ('O' if cflag & termios.PARODD else 'E')
+    flags = [
+        ('raw', not lflag & termios.ICANON and not oflag & termios.OPOST),
+        ('echo', lflag & termios.ECHO),
+        ('crtscts', cflag & termios.CRTSCTS),
+        ('ixon', iflag & termios.IXON),
+        ('clocal', cflag & termios.CLOCAL),
+        ('hupcl', cflag & termios.HUPCL),
+    ]
+    return (f"speed {get_baud(fd)} baud; {size}{parity}{2 if cflag & termios.CSTOPB else 1}; "
+            f"min {cc[termios.VMIN]}; time {cc[termios.VTIME]}; "
+            + ' '.join(name if on else '-' + name for name, on in flags))
+
+
+def port_settings(args, **overrides):
+    settings = dict(baud=args.baud, bytesize=args.bytesize, parity=args.parity, stopbits=args.stopbits,
+                    rtscts=args.rtscts, xonxoff=args.xonxoff)
+    settings.update(overrides)
+    return settings
+
+
+def cmd_config(args):
+    fd = open_port(args.port, vmin=args.min, vtime=args.time, flush=False, **port_settings(args))
+    print(f"{args.port}: {describe(fd)}")
+    os.close(fd)
+
+
+def cmd_show(args):
+    fd = os.open(args.port, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    print(f"{args.port}: {describe(fd)}")
+    os.close(fd)
+
+
+def write_status(path, value):
+    # Replace atomically so readers never see a half-written file
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(f"{value}\n")
+    os.replace(tmp, path)
+
+
+def cmd_monitor(args):
+    # Block in read() until data arrives or VTIME expires, no sleep/poll loop
+    fd = open_port(args.port, vmin=0, vtime=args.time, **port_settings(args))
+    buf = bytearray(args.read_size)
+    view = memoryview(buf)
+    log = open(args.log, 'a') if args.log else None
+    out = open(args.output, 'ab') if args.output else None
+
+    print(f"Monitoring binary data on {args.port} at {args.baud} baud...")
+    print("Press Ctrl+C to stop")
+    print("=== Data Statistics ===")
+    print("Time       | Bytes (Interval) | Bytes (Total)")
+    print("-----------+-----------------+---------------")
+
+    total = 0
+    last_total = 0
+    reads = 0
+    start = time.monotonic()
+    next_report = start + args.interval
+    if args.status_file:
+        write_status(args.status_file, 0)
+    try:
+        while not args.duration or time.monotonic() - start < args.duration:
+            n = os.readv(fd, [view])
+            if n:
+                reads += 1
+                total += n
+                if out:
+                    out.write(view[:n])
+                if log:
+                    log.write(f"Received {n} bytes at {time.strftime('%H:%M:%S')}.{int(time.time() % 1 * 1e6):06d}\n")
+            now = time.monotonic()
+            if now >= next_report:
+                print(f"{time.strftime('%H:%M:%S')}   | {total - last_total:15d} | {total:15d}", flush=True)
+                if args.status_file:
+                    write_status(args.status_file, total)
+                last_total = total
+                next_report = max(next_report + args.interval, now)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        os.close(fd)
+        for f in (log, out):
+            if f:
+                f.close()
+    elapsed = time.monotonic() - start
+    print(f"\nTotal: {total} bytes in {reads} reads over {elapsed:.1f} s "
+          f"({total / elapsed / 1000 if elapsed else 0:.1f} kB/s, "
+          f"{100.0 * total * 10 / args.baud / elapsed if elapsed else 0:.1f}% of line rate)")
+
+
+def write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        try:
+            n = os.write(fd, view)
+        except BlockingIOError:
+            select.select([], [fd], [])
+            continue
+        view = view[n:]
+
+
+def cmd_loopback(args):
+    # Reads return as soon as 255 bytes are in or after 0.1 s of silence
+    tx = open_port(args.port, vmin=255, vtime=1, **port_settings(args))
+    rx = open_port(args.rx, vmin=255, vtime=1, **port_settings(args)) if args.rx else tx
+
+    if args.message is not None:
+        pattern = args.message.encode() + b'\n'
+    else:
+        pattern = os.urandom(args.size)
+    print(f"Loopback test {args.port}{' -> ' + args.rx if args.rx else ''} at {args.baud} baud"
+          + ("" if args.message is not None else f" for {args.duration:g} seconds"))
+    print(f"Test pattern: {pattern[:8].hex()}... ({len(pattern)} bytes)")
+
+    sent = bytearray()
+    received = bytearray()
+    reads = 0
+    buf = bytearray(4096)
+    view = memoryview(buf)
+    deadline = time.monotonic() + args.duration
+    os.set_blocking(rx, False)
+    try:
+        while True:
+            write_all(tx, pattern)
+            sent += pattern
+            # Take whatever has arrived without holding up the sender
+            while True:
+                try:
+                    n = os.readv(rx, [view])
+                except BlockingIOError:
+                    break
+                if not n:
+                    break
+                reads += 1
+                received += view[:n]
+            # A message is sent once, the random pattern for the whole duration
+            if args.message is not None or time.monotonic() >= deadline:
+                break
+            termios.tcdrain(tx)
+        # Collect the tail: blocking VMIN/VTIME reads until 0.1 s of silence.
+        # VTIME only runs once a byte is in, so wait for readiness first or
+        # a missing echo would block past --wait
+        os.set_blocking(rx, True)
+        deadline = time.monotonic() + args.wait
+        while len(received) < len(sent):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([rx], [], [], remaining)[0]:
+                break
+            n = os.readv(rx, [view])
+            if n:
+                reads += 1
+                received += view[:n]
+    except KeyboardInterrupt:
+        print("\nInterrupted")
+    finally:
+        os.close(tx)
+        if rx != tx:
+            os.close(rx)
+
+    good = sum(1 for a, b in zip(sent, received) if a == b) if received else 0
+    print("=== Test Complete ===")
+    if args.message is not None:
+        print(f"Received data: {bytes(received).decode(errors='replace').strip()!r}")
+    print(f"Total bytes sent:     {len(sent)}")
+    print(f"Total bytes received: {len(received)}")
+    print(f"Matching bytes:       {good}")
+    print(f"Read attempts:        {reads}")
+    print(f"Loopback efficiency:  {100 * len(received) // len(sent) if sent else 0}%")
+    if not received:
+        print("RESULT: FAILED (no data received)")
+        sys.exit(1)
+    if received == sent:
+        print("RESULT: PASSED")
+        sys.exit(0)
+    print("RESULT: FAILED (data mismatch or loss)")
+    sys.exit(1)
+
+
+def main():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('port', help='Serial port, e.g. /dev/ttyS4')
+    common.add_argument('-b', '--baud', type=int, default=115200,
+                        help='Baud rate; non-standard rates use termios2 (default: 115200)')
+    common.add_argument('--bytesize', type=int, choices=sorted(BYTESIZES), default=8, help='Data bits (default: 8)')
+    common.add_argument('--parity', choices=['N', 'E', 'O'], default='N', help='Parity (default: N)')
+    common.add_argument('--stopbits', type=int, choices=[1, 2], default=1, help='Stop bits (default: 1)')
+    common.add_argument('--rtscts', action='store_true', help='RTS/CTS hardware flow control')
+    common.add_argument('--xonxoff', action='store_true', help='XON/XOFF software flow control')
+
+    parser = argparse.ArgumentParser(description='termios UART configuration and monitoring')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    config = sub.add_parser('config', parents=[common], help='Apply settings (like stty -F)')
+    config.add_argument('--min', type=int, default=0, help='VMIN (default: 0)')
+    config.add_argument('--time', type=int, default=0, help='VTIME in tenths of a second (default: 0)')
+    config.set_defaults(func=cmd_config)
+
+    show = sub.add_parser('show', help='Print current settings')
+    show.add_argument('port')
+    show.set_defaults(func=cmd_show)
+
+    monitor = sub.add_parser('monitor', parents=[common], help='Count received bytes (t4, back_5)')
+    monitor.add_argument('-i', '--interval', type=float, default=1.0, help='Seconds between stats lines (default: 1)')
+    monitor.add_argument('-d', '--duration', type=float, default=0, help='Seconds to run, 0 = until Ctrl+C')
+    monitor.add_argument('--time', type=int, default=5,
+                         help='VTIME: read timeout in tenths of a second (default: 5)')
+    monitor.add_argument('--read-size', type=int, default=65536, help='Bytes per read (default: 65536)')
+    monitor.add_argument('--status-file', help='Keep the running byte count in this file (back_5)')
+    monitor.add_argument('--log', help='Append a timestamped line per read to this file')
+    monitor.add_argument('-o', '--output', help='Append received bytes to this file')
+    monitor.set_defaults(func=cmd_monitor)
+
+    loopback = sub.add_parser('loopback', parents=[common], help='Send and check what comes back (uni5)')
+    loopback.add_argument('--rx', help='Separate receive port (default: same port)')
+    loopback.add_argument('-m', '--message', help='Send this line once instead of a random pattern')
+    loopback.add_argument('-s', '--size', type=int, default=32, help='Random pattern size (default: 32)')
+    loopback.add_argument('-d', '--duration', type=float, default=10.0,
+                          help='Seconds to keep sending the pattern (default: 10)')
+    loopback.add_argument('-w', '--wait', type=float, default=1.0,
+                          help='Seconds to wait for the tail (default: 1)')
+    loopback.set_defaults(func=cmd_loopback)
+
+    args = parser.parse_args()
+    try:
+        args.func(args)
+    except (OSError, termios.error, ValueError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Sustained UART throughput / loss test for uart_rx.BulkReceiver.
+
+Writes a counting byte pattern (0x00..0xFF repeating) as fast as the port
+accepts it and checks every received chunk against the pattern.  Use one
+port with TX looped back to RX, or --rx to receive on a second port wired
+to the first.
+
+Examples:
+    ./uart_throughput.py /dev/ttyS4 -b 115200 -d 20
+    ./uart_throughput.py /dev/ttyS4 --rx /dev/ttyS5 -b 921600 -c 256
+"""
+import argparse
+import sys
+import time
+
+import serial
+
+from uart_rx import PATTERN, BulkReceiver, PatternChecker
+
+
+def open_port(port, baud):
+    return serial.Serial(port=port, baudrate=baud, bytesize=serial.EIGHTBITS,
+                         parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE,
+                         timeout=0.5, xonxoff=False, rtscts=False, dsrdtr=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='UART throughput and loss test')
+    parser.add_argument('port', help='Transmit port (also receive port unless --rx is given)')
+    parser.add_argument('--rx', help='Separate receive port')
+    parser.add_argument('-b', '--baud', type=int, default=115200, help='Baud rate (default: 115200)')
+    parser.add_argument('-d', '--duration', type=float, default=10.0, help='Seconds to transmit (default: 10)')
+    parser.add_argument('-c', '--chunk', type=int, default=256, help='Receive chunk size (default: 256)')
+    parser.add_argument('-w', '--write-size', type=int, default=4096, help='Bytes per write (default: 4096)')
+
+    args = parser.parse_args()
+
+    try:
+        tx = open_port(args.port, args.baud)
+        rx = open_port(args.rx, args.baud) if args.rx else tx
+    except serial.SerialException as e:
+        print(f"Serial error: {e}")
+        sys.exit(1)
+
+    tx.reset_output_buffer()
+    rx.reset_input_buffer()
+
+    checker = PatternChecker(args.chunk)
+    receiver = BulkReceiver(rx, chunk_size=args.chunk, on_chunk=checker)
+    receiver.start()
+
+    block = PATTERN * (args.write_size // 256)
+    sent = 0
+    line_rate = args.baud / 10.0  # 8N1: 10 bits per byte
+
+    print(f"Transmitting on {args.port} at {args.baud} baud for {args.duration:.0f} s "
+          f"(line rate {line_rate / 1000:.1f} kB/s)...")
+    start = time.monotonic()
+    try:
+        while time.monotonic() - start < args.duration:
+            sent += tx.write(block)
+        tx.flush()
+    except KeyboardInterrupt:
+        print("\nInterrupted")
+    tx_time = time.monotonic() - start
+
+    # Let the tail arrive: wait until nothing more comes for a second, as
+    # the link may still hold more than a write's worth after tx.flush()
+    last = -1
+    while checker.bytes < sent and checker.bytes != last:
+        last = checker.bytes
+        time.sleep(1.0)
+    receiver.stop()
+    tx.close()
+    if rx is not tx:
+        rx.close()
+
+    stats = receiver.stats()
+    rx_time = (checker.last - checker.first) if checker.first else 0.0
+    lost = sent - checker.bytes
+    print(f"\nSent:      {sent} bytes in {tx_time:.2f} s ({sent / tx_time / 1000:.1f} kB/s)")
+    print(f"Received:  {checker.bytes} bytes" +
+          (f" at {checker.bytes / rx_time / 1000:.1f} kB/s ({100.0 * checker.bytes / rx_time / line_rate:.1f}% of line rate)"
+           if rx_time else ""))
+    print(f"Lost:      {lost} bytes, pattern gaps: {checker.gaps}")
+    print(f"Reads:     {stats['reads']} (avg {stats['avg_read']:.1f} B, max {stats['max_read']} B), "
+          f"chunks: {stats['chunks']}")
+    print("Result:    " + ("PASS" if lost == 0 and checker.gaps == 0 else "FAIL"))
+    sys.exit(0 if lost == 0 and checker.gaps == 0 else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+Pool of BLEDriver instances, one per connectivity dongle.
+
+The pool dedicates the first `scan_adapters` dongles to scanning and spreads
+connections over the rest (least loaded first), so scanning on one radio is
+never interrupted by connection setup on another. Events from every adapter
+are merged into one stream of PoolEvent tuples tagged with the adapter they
+came from.
+
+    pool = AdapterPool(["/dev/ttyACM0", "/dev/ttyACM1", "/dev/ttyACM2"])
+    pool.observer_register(my_pool_observer)
+    pool.open()
+    pool.scan_start()
+    tag = pool.connect(peer_addr)
+"""
+import collections
+import inspect
+import logging
+import queue
+from threading import Lock
+
+from pc_ble_driver_py.ble_driver import (
+    BLEConfig,
+    BLEConfigBase,
+    BLEConfigConnGap,
+    BLEConfigGapRoleCount,
+    BLEDriver,
+    BLEEnableParams,
+    BLEGapRoles,
+    BLEGapTimeoutSrc,
+    nrf_sd_ble_api_ver,
+)
+from pc_ble_driver_py.exceptions import NordicSemiException
+from pc_ble_driver_py.observers import BLEDriverObserver
+
+logger = logging.getLogger(__name__)
+
+PoolEvent = collections.namedtuple("PoolEvent", "adapter_tag name params")
+
+
+def _param_names(name):
+    """Parameter names after ble_driver of BLEDriverObserver.<name>, for
+    callbacks BLEDriver makes positionally (on_rpc_status, on_rpc_log_entry)."""
+    method = getattr(BLEDriverObserver, name, None)
+    if method is None:
+        return ()
+    return tuple(inspect.signature(method).parameters)[2:]
+
+
+def default_setup(ble_driver, conn_count):
+    """Enable the SoftDevice as a central with room for conn_count links."""
+    if nrf_sd_ble_api_ver == 2:
+        ble_driver.ble_enable(
+            BLEEnableParams(
+                vs_uuid_count=1,
+                service_changed=0,
+                periph_conn_count=0,
+                central_conn_count=conn_count,
+                central_sec_count=conn_count,
+            )
+        )
+    else:
+        ble_driver.ble_cfg_set(BLEConfig.conn_gap, BLEConfigConnGap(conn_count=conn_count))
+        ble_driver.ble_cfg_set(
+            BLEConfig.role_count,
+            BLEConfigGapRoleCount(
+                central_role_count=conn_count, periph_role_count=0, central_sec_count=0
+            ),
+        )
+        ble_driver.ble_enable()
+
+
+class PooledAdapter(object):
+    def __init__(self, tag, ble_driver, scanner):
+        self.tag = tag
+        self.driver = ble_driver
+        self.scanner = scanner
+        self.connections = set()
+        self.pending_connects = 0
+        self.scanning = False
+
+    @property
+    def load(self):
+        return len(self.connections) + self.pending_connects
+
+    def __str__(self):
+        return "Adapter {0.tag} scanner({0.scanner}) scanning({0.scanning}) connections({1}) pending({0.pending_connects})".format(
+            self, len(self.connections)
+        )
+
+
+class _PoolForwarder(object):
+    """Registered as a BLEDriverObserver on one adapter; forwards every
+    on_* callback to the pool together with the adapter it came from."""
+
+    def __init__(self, pool, adapter):
+        self.pool = pool
+        self.adapter = adapter
+
+    def __getattr__(self, name):
+        if not name.startswith("on_"):
+            raise AttributeError(name)
+
+        names = _param_names(name)
+
+        def forward(*args, **params):
+            # args, if any, are (ble_driver, ...) in the observer's order
+            params.update(zip(names, args[1:]))
+            params.pop("ble_driver", None)
+            self.pool._on_adapter_event(self.adapter, name[3:], params)
+
+        return forward
+
+
+class AdapterPool(object):
+    def __init__(
+        self,
+        serial_ports,
+        tags=None,
+        scan_adapters=1,
+        max_connections_per_adapter=4,
+        event_queue_size=10000,
+        **driver_kwargs
+    ):
+        """Events are also queued for get_event(); once event_queue_size are
+        waiting, new ones are dropped (counted in events_dropped). Pass 0 for
+        an unbounded queue only if get_event() is certain to keep up."""
+        assert len(serial_ports) > 0, "At least one serial port is required"
+        assert tags is None or len(tags) == len(serial_ports), "One tag per serial port"
+        self.max_connections_per_adapter = max_connections_per_adapter
+        self.observers = list()
+        self.events = queue.Queue(maxsize=event_queue_size)
+        self.events_dropped = 0
+        self._lock = Lock()
+
+        self.adapters = collections.OrderedDict()
+        for i, serial_port in enumerate(serial_ports):
+            tag = tags[i] if tags else serial_port
+            ble_driver = BLEDriver(serial_port=serial_port, **driver_kwargs)
+            # With a single dongle it has to do both jobs.
+            scanner = i < scan_adapters or len(serial_ports) == 1
+            adapter = PooledAdapter(tag, ble_driver, scanner)
+            ble_driver.observer_register(_PoolForwarder(self, adapter))
+            self.adapters[tag] = adapter
+
+    def driver(self, tag):
+        return self.adapters[tag].driver
+
+    def open(self, setup=None):
+        """Open every adapter and enable its SoftDevice.
+
+        setup(ble_driver) is called after open() for each adapter; by
+        default the SoftDevice is enabled as a central sized for
+        max_connections_per_adapter links."""
+        for adapter in self.adapters.values():
+            adapter.driver.open()
+            if setup:
+                setup(adapter.driver)
+            else:
+                default_setup(adapter.driver, self.max_connections_per_adapter)
+            logger.info("Opened adapter %s", adapter.tag)
+
+    def close(self):
+        for adapter in self.adapters.values():
+            try:
+                adapter.driver.close()
+            except Exception as ex:
+                logger.error("Failed to close adapter %s: %s", adapter.tag, ex)
+            adapter.connections.clear()
+            adapter.pending_connects = 0
+            adapter.scanning = False
+
+    def observer_register(self, observer):
+        with self._lock:
+            self.observers.append(observer)
+
+    def observer_unregister(self, observer):
+        with self._lock:
+            self.observers.remove(observer)
+
+    def get_event(self, timeout=None):
+        """Next PoolEvent from the merged stream, or None on timeout."""
+        try:
+            return self.events.get(True, timeout)
+        except queue.Empty:
+            return None
+
+    def scan_start(self, scan_params=None):
+        started = []
+        for adapter in self.adapters.values():
+            if not adapter.scanner or adapter.scanning:
+                continue
+            adapter.driver.ble_gap_scan_start(scan_params)
+            adapter.scanning = True
+            started.append(adapter.tag)
+        return started
+
+    def scan_stop(self):
+        for adapter in self.adapters.values():
+            if adapter.scanning:
+                adapter.driver.ble_gap_scan_stop()
+                adapter.scanning = False
+
+    def connect(self, address, scan_params=None, conn_params=None, tag=BLEConfigBase.conn_cfg_tag):
+        """Connect on the least loaded adapter. Returns the adapter tag; the
+        connection handle arrives with the gap_evt_connected event."""
+        with self._lock:
+            adapter = self._pick_connection_adapter()
+            if adapter is None:
+                raise NordicSemiException("No adapter available for a new connection")
+            adapter.pending_connects += 1
+
+        try:
+            adapter.driver.ble_gap_connect(address, scan_params, conn_params, tag)
+        except Exception:
+            with self._lock:
+                adapter.pending_connects -= 1
+            raise
+        return adapter.tag
+
+    def disconnect(self, adapter_tag, conn_handle, *args):
+        return self.adapters[adapter_tag].driver.ble_gap_disconnect(conn_handle, *args)
+
+    def _pick_connection_adapter(self):
+        # The SoftDevice allows one pending connect per adapter, and a scanning
+        # adapter cannot initiate, so prefer idle connection-only dongles.
+        candidates = [
+            a for a in self.adapters.values()
+            if not a.scanning
+            and a.pending_connects == 0
+            and a.load < self.max_connections_per_adapter
+        ]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda a: (a.scanner, a.load))
+
+    def _on_adapter_event(self, adapter, name, params):
+        with self._lock:
+            if name == "gap_evt_connected":
+                adapter.connections.add(params["conn_handle"])
+                if params.get("role") == BLEGapRoles.central and adapter.pending_connects > 0:
+                    adapter.pending_connects -= 1
+            elif name == "gap_evt_disconnected":
+                adapter.connections.discard(params["conn_handle"])
+            elif name == "gap_evt_timeout":
+                if params.get("src") == BLEGapTimeoutSrc.conn and adapter.pending_connects > 0:
+                    adapter.pending_connects -= 1
+                elif params.get("src") == BLEGapTimeoutSrc.scan:
+                    adapter.scanning = False
+            observers = list(self.observers)
+
+        event = PoolEvent(adapter.tag, name, params)
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            self.events_dropped += 1
+
+        for obs in observers:
+            obs.on_pool_event(self, event)
+
+    def __str__(self):
+        return "\n".join(str(a) for a in self.adapters.values())
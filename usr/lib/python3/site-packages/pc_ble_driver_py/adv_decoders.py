@@ -0,0 +1,219 @@
+"""
+Decoders for manufacturer-specific and service data, by company ID / UUID.
+
+AdvDecoderRegistry maps a manufacturer company ID, or a 16-bit service
+data UUID, to decoders built around precompiled struct.Struct formats.
+decode(adv_data) looks at both record types in a BLEAdvData and returns
+one (name, result) pair per record a decoder recognised.
+
+Beacons repeat the same frame for minutes, so results are cached by the
+record bytes: a frame is decoded once and every identical frame after
+that is a dict lookup. Frames that change every time (counters in
+Eddystone TLM, sensor readings) simply miss the cache and are decoded.
+
+    registry = default_registry()
+    registry.register_company(0x0059, StructDecoder(
+        "nordic_sensor", "<bHH", ("temperature", "humidity", "battery_mv"), prefix=b"\\x01"))
+
+    for name, frame in registry.decode(adv_data):
+        print(name, frame)
+"""
+import collections
+import struct
+import uuid
+
+# AD types, as in BLEAdvData.Types
+MANUFACTURER_SPECIFIC_DATA = 0xFF
+SERVICE_DATA = 0x16
+
+COMPANY_ID = struct.Struct("<H")
+SERVICE_UUID16 = struct.Struct("<H")
+
+
+class StructDecoder(object):
+    """One fixed layout: payload (after the company ID or UUID) must start
+    with prefix and be at least as long as the format."""
+
+    def __init__(self, name, fmt, fields, prefix=b"", convert=None):
+        self.name = name
+        self.layout = struct.Struct(fmt)
+        self.prefix = prefix
+        self.tuple_type = collections.namedtuple(name, fields)
+        self.convert = convert  # optional function(tuple) -> result
+
+    def decode(self, payload):
+        if not payload.startswith(self.prefix):
+            return None
+        offset = len(self.prefix)
+        if len(payload) < offset + self.layout.size:
+            return None
+        result = self.tuple_type(*self.layout.unpack_from(payload, offset))
+        return self.convert(result) if self.convert else result
+
+
+class FrameTypeDecoder(object):
+    """Dispatch on the first payload byte (e.g. Eddystone frame types)."""
+
+    def __init__(self, decoders):
+        self.decoders = decoders  # frame type -> decoder
+
+    def decode(self, payload):
+        if not payload:
+            return None
+        decoder = self.decoders.get(payload[0])
+        if decoder is None:
+            return None
+        result = decoder.decode(payload[1:])
+        return None if result is None else (decoder.name, result)
+
+
+class AdvDecoderRegistry(object):
+    def __init__(self, cache_size=4096):
+        self.companies = collections.defaultdict(list)
+        self.services = collections.defaultdict(list)
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()  # (ad type, record bytes) -> result
+        self.hits = 0
+        self.misses = 0
+
+    def register_company(self, company_id, decoder):
+        self.companies[company_id].append(decoder)
+        self.cache.clear()
+
+    def register_service(self, uuid16, decoder):
+        self.services[uuid16].append(decoder)
+        self.cache.clear()
+
+    def _decode_record(self, ad_type, record):
+        if ad_type == MANUFACTURER_SPECIFIC_DATA:
+            table, key = self.companies, COMPANY_ID
+        else:
+            table, key = self.services, SERVICE_UUID16
+        if len(record) < key.size:
+            return None
+        decoders = table.get(key.unpack_from(record)[0])
+        if not decoders:
+            return None
+        payload = record[key.size:]
+        for decoder in decoders:
+            result = decoder.decode(payload)
+            if result is None:
+                continue
+            if isinstance(decoder, FrameTypeDecoder):
+                return result
+            return decoder.name, result
+        return None
+
+    def decode_record(self, ad_type, record):
+        """(name, result) for one manufacturer / service data record, or None."""
+        record = bytes(record)
+        cache_key = (ad_type, record)
+        try:
+            result = self.cache[cache_key]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            self.cache.move_to_end(cache_key)
+            return result
+
+        self.misses += 1
+        result = self._decode_record(ad_type, record)
+        self.cache[cache_key] = result
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return result
+
+    def decode(self, adv_data):
+        results = []
+        for ad_type, value in adv_data.records.items():
+            ad_type = getattr(ad_type, "value", ad_type)
+            if ad_type not in (MANUFACTURER_SPECIFIC_DATA, SERVICE_DATA):
+                continue
+            result = self.decode_record(ad_type, value)
+            if result is not None:
+                results.append(result)
+        return results
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "cached": len(self.cache)}
+
+
+# Built-in formats
+
+def _ibeacon(frame):
+    return frame._replace(uuid=str(uuid.UUID(bytes=frame.uuid)))
+
+
+IBEACON = StructDecoder(
+    "ibeacon", ">16sHHb", ("uuid", "major", "minor", "tx_power"), prefix=b"\x02\x15", convert=_ibeacon
+)
+
+EDDYSTONE_UUID = 0xFEAA
+URL_SCHEMES = ("http://www.", "https://www.", "http://", "https://")
+URL_CODES = (
+    ".com/", ".org/", ".edu/", ".net/", ".info/", ".biz/", ".gov/",
+    ".com", ".org", ".edu", ".net", ".info", ".biz", ".gov",
+)
+
+
+class EddystoneUrlDecoder(object):
+    name = "eddystone_url"
+    tuple_type = collections.namedtuple("eddystone_url", ("tx_power", "url"))
+    HEAD = struct.Struct(">bB")
+
+    def decode(self, payload):
+        if len(payload) < self.HEAD.size:
+            return None
+        tx_power, scheme = self.HEAD.unpack_from(payload)
+        if scheme >= len(URL_SCHEMES):
+            return None
+        url = URL_SCHEMES[scheme] + "".join(
+            URL_CODES[b] if b < len(URL_CODES) else chr(b) for b in payload[self.HEAD.size:]
+        )
+        return self.tuple_type(tx_power, url)
+
+
+def _eddystone_tlm(frame):
+    # Beacon temperature is signed 8.8 fixed point
+    return frame._replace(temperature=frame.temperature / 256.0)
+
+
+EDDYSTONE = FrameTypeDecoder({
+    0x00: StructDecoder(
+        "eddystone_uid", ">b10s6s", ("tx_power", "namespace", "instance"),
+        convert=lambda f: f._replace(namespace=f.namespace.hex(), instance=f.instance.hex()),
+    ),
+    0x10: EddystoneUrlDecoder(),
+    0x20: StructDecoder(
+        "eddystone_tlm", ">BHhII", ("version", "battery_mv", "temperature", "adv_count", "uptime_ds"),
+        convert=_eddystone_tlm,
+    ),
+})
+
+
+def _ruuvi_v5(frame):
+    return frame._replace(
+        temperature=frame.temperature * 0.005,
+        humidity=frame.humidity * 0.0025,
+        pressure=frame.pressure + 50000,
+        mac=frame.mac.hex(":").upper(),
+    )
+
+
+RUUVI_V5 = StructDecoder(
+    "ruuvi_v5",
+    ">hHHhhhHBH6s",
+    ("temperature", "humidity", "pressure", "acc_x", "acc_y", "acc_z", "power", "movements", "sequence", "mac"),
+    prefix=b"\x05",
+    convert=_ruuvi_v5,
+)
+
+
+def default_registry(cache_size=4096):
+    """Registry with iBeacon, Eddystone (UID, URL, TLM) and RuuviTag v5."""
+    registry = AdvDecoderRegistry(cache_size)
+    registry.register_company(0x004C, IBEACON)
+    registry.register_service(EDDYSTONE_UUID, EDDYSTONE)
+    registry.register_company(0x0499, RUUVI_V5)
+    return registry
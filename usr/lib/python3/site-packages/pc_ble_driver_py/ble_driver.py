@@ -35,6 +35,7 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 import collections
+import ctypes
 import functools
 import re
 import subprocess
@@ -86,7 +87,9 @@ else:
     )
 
 import pc_ble_driver_py.ble_driver_types as util
+from pc_ble_driver_py.evt_decoder import RawEvent, RawEventDecoder
 from pc_ble_driver_py.exceptions import NordicSemiException
+from pc_ble_driver_py.uuid_registry import UUIDBaseRegistry
 
 
 NRF_ERRORS = {
@@ -95,6 +98,23 @@ NRF_ERRORS = {
 }
 
 
+@functools.lru_cache(maxsize=None)
+def _native_function(name, *argtypes):
+    """A function of the SWIG extension module, called through ctypes for
+    arguments SWIG has no typemap for."""
+    native = getattr(driver, "_" + driver.__name__.rsplit(".", 1)[1])
+    function = getattr(ctypes.CDLL(native.__file__), name)
+    function.argtypes = argtypes
+    function.restype = ctypes.c_uint32
+    return function
+
+
+def _native_whitelist_set(adapter, pp_wl_addrs, length):
+    return _native_function(
+        "sd_ble_gap_whitelist_set", ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint8
+    )(adapter, pp_wl_addrs, length)
+
+
 def NordicSemiErrorCheck(wrapped=None, expected=driver.NRF_SUCCESS):
     if wrapped is None:
         return functools.partial(NordicSemiErrorCheck, expected=expected)
@@ -113,6 +133,31 @@ def NordicSemiErrorCheck(wrapped=None, expected=driver.NRF_SUCCESS):
     return wrapper(wrapped)
 
 
+def synchronized_on(lock_name):
+    """Like wrapt.synchronized(lock), but the lock is looked up by name on the
+    instance the method is called on, so every BLEDriver serialises on its own
+    locks instead of one shared by all adapters in the process."""
+    @wrapt.decorator
+    def wrapper(wrapped, instance, args, kwargs):
+        with getattr(instance, lock_name):
+            return wrapped(*args, **kwargs)
+
+    return wrapper
+
+
+def connection_ordered(wrapped):
+    """Serialise calls made for the same conn_handle (the first argument) so
+    commands on one link are issued in order. Calls on other links and
+    calls without a link only contend for BLEDriver.transport_lock."""
+    @wrapt.decorator
+    def wrapper(wrapped, instance, args, kwargs):
+        conn_handle = args[0] if args else kwargs["conn_handle"]
+        with instance.connection_lock(conn_handle):
+            return wrapped(*args, **kwargs)
+
+    return wrapper(wrapped)
+
+
 class EnumWithOffsets(Enum):
     """An extesion of Enum allowing lookup of intermediary values. The
     intermediary values must directly follow a member with a name that ends with
@@ -353,17 +398,22 @@ class BLEGapAdvParams(object):
 
 
 class BLEGapScanParams(object):
-    def __init__(self, interval_ms, window_ms, timeout_s, active=True):
+    def __init__(self, interval_ms, window_ms, timeout_s, active=True, use_whitelist=False):
         self.interval_ms = interval_ms
         self.window_ms = window_ms
         self.timeout_s = timeout_s
         self.active = active
+        self.use_whitelist = use_whitelist
 
     def to_c(self):
         scan_params = driver.ble_gap_scan_params_t()
         scan_params.active = self.active
-        scan_params.selective = False
-        scan_params.p_whitelist = None
+        if nrf_sd_ble_api_ver == 2:
+            # BLEDriver.ble_gap_scan_start attaches the whitelist itself
+            scan_params.selective = self.use_whitelist
+            scan_params.p_whitelist = None
+        else:
+            scan_params.use_whitelist = int(self.use_whitelist)
         scan_params.interval = util.msec_to_units(self.interval_ms, util.UNIT_0_625_MS)
         scan_params.window = util.msec_to_units(self.window_ms, util.UNIT_0_625_MS)
         scan_params.timeout = self.timeout_s
@@ -525,12 +575,21 @@ class BLEGapAddr(object):
     def from_c(cls, addr):
         addr_list = util.uint8_array_to_list(addr.addr, driver.BLE_GAP_ADDR_LEN)
         addr_list.reverse()
-        if addr.addr_type in BLEGapAddr.Types.__members__.items():
+        try:
             addr_type = BLEGapAddr.Types(addr.addr_type)
-        else:
+        except ValueError:
             addr_type = addr.addr_type
         return cls(addr_type=addr_type, addr=addr_list)
 
+    @classmethod
+    def from_bytes(cls, addr_type, addr):
+        """From a raw ble_gap_addr_t: addr_type and six address bytes, LSB first."""
+        try:
+            addr_type = BLEGapAddr.Types(addr_type)
+        except ValueError:
+            pass
+        return cls(addr_type=addr_type, addr=list(addr[::-1]))
+
     def to_c(self):
         addr_array = util.list_to_uint8_array(self.addr[::-1])
         addr = driver.ble_gap_addr_t()
@@ -1030,6 +1089,11 @@ class BLEAdvData(object):
     @classmethod
     def from_c(cls, adv_report_evt):
         ad_list = util.uint8_array_to_list(adv_report_evt.data, adv_report_evt.dlen)
+        return cls.from_bytes(ad_list)
+
+    @classmethod
+    def from_bytes(cls, ad_list):
+        """Parse AD structures from a list of ints or a bytes-like object."""
         ble_adv_data = cls()
         index = 0
 
@@ -1046,7 +1110,7 @@ class BLEAdvData(object):
                 ad_type = ad_list[index + 1]
                 offset = index + 2
                 key = BLEAdvData.Types(ad_type)
-                ble_adv_data.records[key] = ad_list[offset: offset + ad_len - 1]
+                ble_adv_data.records[key] = list(ad_list[offset: offset + ad_len - 1])
             except ValueError:
                 if ad_type:
                     logger.info(
@@ -1849,8 +1913,8 @@ class RpcLogSeverity(Enum):
 
 
 class BLEDriver(object):
-    observer_lock = Lock()
-    api_lock = Lock()
+    # Only used by the enum_serial_ports classmethod, which has no adapter.
+    serial_port_enum_lock = Lock()
 
     def __init__(
         self,
@@ -1860,9 +1924,21 @@ class BLEDriver(object):
         retransmission_interval=300,  # type: int
         response_timeout=1500,  # type: int
         log_severity_level="info",  # type: str
+        flow_control=False,  # type: bool
+        raw_events=False,  # type: bool
     ):
         super(BLEDriver, self).__init__()
         self.observers = list()  # type: List[BLEDriverObserver]
+        self.observer_lock = Lock()
+        # api_lock covers open()/close(); transport_lock only the RPC
+        # round-trip itself, so argument marshalling and calls queued for
+        # other connections do not wait behind a slow command.
+        self.api_lock = Lock()
+        self.transport_lock = Lock()
+        self._connection_locks = dict()
+        self._whitelist = ([], None)
+        self._whitelist_c = None
+        self.uuid_bases = UUIDBaseRegistry()
 
         if auto_flash:
             try:
@@ -1882,7 +1958,7 @@ class BLEDriver(object):
         phy_layer = driver.sd_rpc_physical_layer_create_uart(
             serial_port,
             baud_rate,
-            driver.SD_RPC_FLOW_CONTROL_NONE,
+            driver.SD_RPC_FLOW_CONTROL_HARDWARE if flow_control else driver.SD_RPC_FLOW_CONTROL_NONE,
             driver.SD_RPC_PARITY_NONE,
         )
         link_layer = driver.sd_rpc_data_link_layer_create_bt_three_wire(
@@ -1902,6 +1978,25 @@ class BLEDriver(object):
         self.status_queue = queue.Queue()
         self.ble_event_queue = queue.Queue()
 
+        # Opt-in: hot events are copied out of the callback and decoded with
+        # struct layouts calibrated from the SWIG structs (check them with
+        # evt_decode_bench.py on the target first); everything else, or all
+        # events if this fails, goes through the SWIG proxies.
+        self.raw_events = None
+        if raw_events:
+            try:
+                self.raw_events = RawEventDecoder(driver, nrf_sd_ble_api_ver)
+            except Exception as ex:
+                logger.warning("Raw event decoding disabled: {}".format(ex))
+
+    def transport_call(self, sd_function, *args):
+        with self.transport_lock:
+            return sd_function(self.rpc_adapter, *args)
+
+    def connection_lock(self, conn_handle):
+        # dict.setdefault is atomic, so racing callers get the same lock
+        return self._connection_locks.setdefault(conn_handle, Lock())
+
     def init_keyset(self):
         keyset = driver.ble_gap_sec_keyset_t()
 
@@ -1992,24 +2087,22 @@ class BLEDriver(object):
         return lesc_dhkey
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
     def rpc_log_severity_filter(self, severity):
         # type: (RpcLogSeverity) -> ()
-        return driver.sd_rpc_log_handler_severity_filter_set(
-            self.rpc_adapter, severity.value
+        return self.transport_call(
+            driver.sd_rpc_log_handler_severity_filter_set, severity.value
         )
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
     def ble_cfg_set(self, cfg_id, cfg):
         app_ram_base = 0
         assert isinstance(cfg, BLEConfigBase)
         assert isinstance(cfg_id, BLEConfig)
-        return driver.sd_ble_cfg_set(
-            self.rpc_adapter, cfg_id.value, cfg.to_c(), app_ram_base
+        return self.transport_call(
+            driver.sd_ble_cfg_set, cfg_id.value, cfg.to_c(), app_ram_base
         )
 
-    @wrapt.synchronized(api_lock)
+    @wrapt.synchronized(serial_port_enum_lock)
     @classmethod
     def enum_serial_ports(cls):
         MAX_SERIAL_PORTS = 64
@@ -2033,7 +2126,7 @@ class BLEDriver(object):
         return list(map(SerialPortDescriptor.from_c, descs))
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @synchronized_on("api_lock")
     def open(self):
         self.run_workers = True
 
@@ -2055,17 +2148,17 @@ class BLEDriver(object):
         self.ble_event_worker.daemon = True
         self.ble_event_worker.start()
 
-        return driver.sd_rpc_open(
-            self.rpc_adapter,
+        return self.transport_call(
+            driver.sd_rpc_open,
             self.status_handler,
             self.ble_event_handler,
             self.log_message_handler,
         )
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @synchronized_on("api_lock")
     def close(self):
-        result = driver.sd_rpc_close(self.rpc_adapter)
+        result = self.transport_call(driver.sd_rpc_close)
         logger.debug("close result %s", result)
 
         # Cleanup workers
@@ -2105,11 +2198,11 @@ class BLEDriver(object):
 
         return result
 
-    @wrapt.synchronized(observer_lock)
+    @synchronized_on("observer_lock")
     def observer_register(self, observer):
         self.observers.append(observer)
 
-    @wrapt.synchronized(observer_lock)
+    @synchronized_on("observer_lock")
     def observer_unregister(self, observer):
         self.observers.remove(observer)
 
@@ -2131,26 +2224,41 @@ class BLEDriver(object):
         )
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
     def ble_enable(self, ble_enable_params=None):
         app_ram_base = driver.new_uint32()
         if nrf_sd_ble_api_ver == 2:
             assert isinstance(ble_enable_params, BLEEnableParams)
-            err_code = driver.sd_ble_enable(
-                self.rpc_adapter, ble_enable_params.to_c(), app_ram_base
+            err_code = self.transport_call(
+                driver.sd_ble_enable, ble_enable_params.to_c(), app_ram_base
             )
         elif nrf_sd_ble_api_ver == 5:
             assert (
                 ble_enable_params is None
             ), "ble_enable_params not used in s132 v5 API"
             driver.uint32_assign(app_ram_base, 0)
-            err_code = driver.sd_ble_enable(self.rpc_adapter, app_ram_base)
+            err_code = self.transport_call(driver.sd_ble_enable, app_ram_base)
+        if err_code == driver.NRF_SUCCESS:
+            # A freshly enabled stack has an empty vendor UUID table
+            self.uuid_bases.reset()
+            self._uuid_bases_restore()
         return err_code
 
-    @wrapt.synchronized(api_lock)
+    def _uuid_bases_restore(self):
+        for base, uuid_type in self.uuid_bases.pending():
+            restored = BLEUUIDBase(base)
+            try:
+                self.ble_vs_uuid_add(restored)
+            except NordicSemiException as ex:
+                logger.error("Failed to restore vendor UUID base: {}".format(ex))
+                continue
+            if restored.type != uuid_type:
+                logger.warning(
+                    "Vendor UUID base restored as type {} instead of {}".format(restored.type, uuid_type)
+                )
+
     def ble_version_get(self):
         version = driver.ble_version_t()
-        err_code = driver.sd_ble_version_get(self.rpc_adapter, version)
+        err_code = self.transport_call(driver.sd_ble_version_get, version)
 
         if err_code != driver.NRF_SUCCESS:
             raise NordicSemiException(
@@ -2160,24 +2268,22 @@ class BLEDriver(object):
         return BLEVersion.from_c(version)
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
     def ble_gap_addr_set(self, gap_addr):
         assert isinstance(gap_addr, BLEGapAddr), "Invalid argument type"
         if gap_addr:
             gap_addr = gap_addr.to_c()
         if nrf_sd_ble_api_ver == 2:
-            return driver.sd_ble_gap_address_set(self.rpc_adapter, 0, gap_addr)
+            return self.transport_call(driver.sd_ble_gap_address_set, 0, gap_addr)
         elif nrf_sd_ble_api_ver == 5:
-            return driver.sd_ble_gap_addr_set(self.rpc_adapter, gap_addr)
+            return self.transport_call(driver.sd_ble_gap_addr_set, gap_addr)
 
-    @wrapt.synchronized(api_lock)
     def ble_gap_addr_get(self):
         address = BLEGapAddr(BLEGapAddr.Types.public, [0] * 6)
         addr = address.to_c()
         if nrf_sd_ble_api_ver >= 3:
-            err_code = driver.sd_ble_gap_addr_get(self.rpc_adapter, addr)
+            err_code = self.transport_call(driver.sd_ble_gap_addr_get, addr)
         else:
-            err_code = driver.sd_ble_gap_address_get(self.rpc_adapter, addr)
+            err_code = self.transport_call(driver.sd_ble_gap_address_get, addr)
         if err_code != driver.NRF_SUCCESS:
             raise NordicSemiException(
                 "Failed to get ble_gap_addr. Error code: {}".format(err_code)
@@ -2185,55 +2291,92 @@ class BLEDriver(object):
         return BLEGapAddr.from_c(addr)
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
     def ble_gap_privacy_set(self, privacy_params):
         assert isinstance(privacy_params, BLEGapPrivacyParams), "Invalid argument type"
         privacy_params = privacy_params.to_c()
-        return driver.sd_ble_gap_privacy_set(self.rpc_adapter, privacy_params)
+        return self.transport_call(driver.sd_ble_gap_privacy_set, privacy_params)
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
     def ble_gap_adv_start(self, adv_params=None, tag=0):
         if not adv_params:
             adv_params = self.adv_params_setup()
         assert isinstance(adv_params, BLEGapAdvParams), "Invalid argument type"
         if nrf_sd_ble_api_ver == 5:
-            return driver.sd_ble_gap_adv_start(self.rpc_adapter, adv_params.to_c(), tag)
+            return self.transport_call(driver.sd_ble_gap_adv_start, adv_params.to_c(), tag)
         else:
-            return driver.sd_ble_gap_adv_start(self.rpc_adapter, adv_params.to_c())
+            return self.transport_call(driver.sd_ble_gap_adv_start, adv_params.to_c())
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @connection_ordered
     def ble_gap_conn_param_update(self, conn_handle, conn_params):
         assert isinstance(
             conn_params, (BLEGapConnParams, type(None))
         ), "Invalid argument type"
         if not conn_params:
             conn_params = self.conn_params_setup()
-        return driver.sd_ble_gap_conn_param_update(
-            self.rpc_adapter, conn_handle, conn_params.to_c()
+        return self.transport_call(
+            driver.sd_ble_gap_conn_param_update, conn_handle, conn_params.to_c()
         )
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
     def ble_gap_adv_stop(self):
-        return driver.sd_ble_gap_adv_stop(self.rpc_adapter)
+        return self.transport_call(driver.sd_ble_gap_adv_stop)
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
     def ble_gap_scan_start(self, scan_params=None):
         if not scan_params:
             scan_params = self.scan_params_setup()
         assert isinstance(scan_params, BLEGapScanParams), "Invalid argument type"
-        return driver.sd_ble_gap_scan_start(self.rpc_adapter, scan_params.to_c())
+        c_params = scan_params.to_c()
+        if scan_params.use_whitelist and nrf_sd_ble_api_ver == 2:
+            if self._whitelist_c is None:
+                raise NordicSemiException(
+                    "Scan with use_whitelist needs ble_gap_whitelist_set() first on SD API v2"
+                )
+            c_params.p_whitelist = self._whitelist_c
+        return self.transport_call(driver.sd_ble_gap_scan_start, c_params)
+
+    @NordicSemiErrorCheck
+    def ble_gap_whitelist_set(self, addresses):
+        """Set the whitelist that scans with use_whitelist filter on; an
+        empty list clears it. At most BLE_GAP_WHITELIST_ADDR_MAX_COUNT
+        addresses, and not while a whitelisted scan is running.
+
+        SWIG has no typemap for the ble_gap_addr_t pointer array, so it is
+        built with ctypes. SD v5 takes it through sd_ble_gap_whitelist_set,
+        called directly from the extension module; SD v2 has no such call and
+        gets a ble_gap_whitelist_t with every whitelisted scan_start."""
+        for address in addresses:
+            assert isinstance(address, BLEGapAddr), "Invalid argument type"
+        c_addrs = [address.to_c() for address in addresses]
+        pointers = (ctypes.c_void_p * max(1, len(c_addrs)))(*[int(a.this) for a in c_addrs])
+
+        if nrf_sd_ble_api_ver == 2:
+            whitelist = driver.ble_gap_whitelist_t()
+            # pp_addrs is the first member of ble_gap_whitelist_t
+            ctypes.c_void_p.from_address(int(whitelist.this)).value = ctypes.addressof(pointers)
+            whitelist.addr_count = len(c_addrs)
+            whitelist.irk_count = 0
+            self._whitelist = (c_addrs, pointers)
+            self._whitelist_c = whitelist
+            return driver.NRF_SUCCESS
+
+        with self.transport_lock:
+            err_code = _native_whitelist_set(
+                ctypes.c_void_p(int(self.rpc_adapter.this)),
+                pointers if c_addrs else None,
+                len(c_addrs),
+            )
+        if err_code == driver.NRF_SUCCESS:
+            # Kept alive in case the connectivity firmware reads it later
+            self._whitelist = (c_addrs, pointers)
+        return err_code
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
     def ble_gap_scan_stop(self):
-        return driver.sd_ble_gap_scan_stop(self.rpc_adapter)
+        return self.transport_call(driver.sd_ble_gap_scan_stop)
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
     def ble_gap_connect(self, address, scan_params=None, conn_params=None, tag=0):
         assert isinstance(address, BLEGapAddr), "Invalid argument type"
 
@@ -2246,12 +2389,12 @@ class BLEDriver(object):
         assert isinstance(conn_params, BLEGapConnParams), "Invalid argument type"
 
         if nrf_sd_ble_api_ver == 2:
-            return driver.sd_ble_gap_connect(
-                self.rpc_adapter, address.to_c(), scan_params.to_c(), conn_params.to_c()
+            return self.transport_call(
+                driver.sd_ble_gap_connect, address.to_c(), scan_params.to_c(), conn_params.to_c()
             )
         elif nrf_sd_ble_api_ver == 5:
-            return driver.sd_ble_gap_connect(
-                self.rpc_adapter,
+            return self.transport_call(
+                driver.sd_ble_gap_connect,
                 address.to_c(),
                 scan_params.to_c(),
                 conn_params.to_c(),
@@ -2259,39 +2402,42 @@ class BLEDriver(object):
             )
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    def ble_gap_connect_cancel(self):
+        return self.transport_call(driver.sd_ble_gap_connect_cancel)
+
+    @NordicSemiErrorCheck
+    @connection_ordered
     def ble_gap_disconnect(
         self, conn_handle, hci_status_code=BLEHci.remote_user_terminated_connection
     ):
         assert isinstance(hci_status_code, BLEHci), "Invalid argument type"
-        return driver.sd_ble_gap_disconnect(
-            self.rpc_adapter, conn_handle, hci_status_code.value
+        return self.transport_call(
+            driver.sd_ble_gap_disconnect, conn_handle, hci_status_code.value
         )
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
     def ble_gap_adv_data_set(self, adv_data=BLEAdvData(), scan_data=BLEAdvData()):
         assert isinstance(adv_data, BLEAdvData), "Invalid argument type"
         assert isinstance(scan_data, BLEAdvData), "Invalid argument type"
         (adv_data_len, p_adv_data) = adv_data.to_c()
         (scan_data_len, p_scan_data) = scan_data.to_c()
 
-        return driver.sd_ble_gap_adv_data_set(
-            self.rpc_adapter, p_adv_data, adv_data_len, p_scan_data, scan_data_len
+        return self.transport_call(
+            driver.sd_ble_gap_adv_data_set, p_adv_data, adv_data_len, p_scan_data, scan_data_len
         )
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @connection_ordered
     def ble_gap_authenticate(self, conn_handle, sec_params):
         assert isinstance(
             sec_params, (BLEGapSecParams, type(None))
         ), "Invalid argument type"
-        return driver.sd_ble_gap_authenticate(
-            self.rpc_adapter, conn_handle, sec_params.to_c() if sec_params else None
+        return self.transport_call(
+            driver.sd_ble_gap_authenticate, conn_handle, sec_params.to_c() if sec_params else None
         )
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @connection_ordered
     def ble_gap_sec_params_reply(self, conn_handle, sec_status, sec_params, keyset=None):
         assert isinstance(sec_status, BLEGapSecStatus), "Invalid argument type"
         assert isinstance(sec_params, (BLEGapSecParams, NoneType)), "Invalid argument type"
@@ -2299,8 +2445,8 @@ class BLEDriver(object):
         if keyset is not None:
             self._keyset = keyset
 
-        return driver.sd_ble_gap_sec_params_reply(
-            self.rpc_adapter,
+        return self.transport_call(
+            driver.sd_ble_gap_sec_params_reply,
             conn_handle,
             sec_status.value,
             sec_params.to_c() if sec_params else None,
@@ -2308,27 +2454,27 @@ class BLEDriver(object):
         )
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @connection_ordered
     def ble_gap_lesc_dhkey_reply(self, conn_handle, p_dhkey):
-        return driver.sd_ble_gap_lesc_dhkey_reply(
-            self.rpc_adapter,
+        return self.transport_call(
+            driver.sd_ble_gap_lesc_dhkey_reply,
             conn_handle,
             p_dhkey
         )
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @connection_ordered
     def ble_gap_sec_info_reply(self, conn_handle, enc_info, id_info, sign_info):
-        return driver.sd_ble_gap_sec_info_reply(
-            self.rpc_adapter, conn_handle, enc_info, id_info, sign_info
+        return self.transport_call(
+            driver.sd_ble_gap_sec_info_reply, conn_handle, enc_info, id_info, sign_info
         )
 
-    @wrapt.synchronized(api_lock)
+    @connection_ordered
     def ble_gap_conn_sec_get(self, conn_handle):
         conn_sec = driver.ble_gap_conn_sec_t()
         conn_sec.sec_mode = driver.ble_gap_conn_sec_mode_t()
-        err_code = driver.sd_ble_gap_conn_sec_get(
-            self.rpc_adapter, conn_handle, conn_sec
+        err_code = self.transport_call(
+            driver.sd_ble_gap_conn_sec_get, conn_handle, conn_sec
         )
         if err_code != driver.NRF_SUCCESS:
             raise NordicSemiException(
@@ -2337,7 +2483,7 @@ class BLEDriver(object):
         return conn_sec
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @connection_ordered
     def ble_gap_encrypt(self, conn_handle, master_id, enc_info, lesc):
         if not master_id or not enc_info:
             keyset = BLEGapSecKeyset.from_c(self._keyset)
@@ -2350,12 +2496,12 @@ class BLEDriver(object):
         assert isinstance(master_id, BLEGapMasterId), 'Invalid argument type'
         assert isinstance(enc_info, BLEGapEncInfo), 'Invalid argument type'
         logger.info("ble_gap_encrypt. \n   master_id: {}\n   enc_info: {}".format(master_id, enc_info))
-        return driver.sd_ble_gap_encrypt(
-            self.rpc_adapter, conn_handle, master_id.to_c(), enc_info.to_c()
+        return self.transport_call(
+            driver.sd_ble_gap_encrypt, conn_handle, master_id.to_c(), enc_info.to_c()
         )
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @connection_ordered
     def ble_gap_data_length_update(
         self, conn_handle, data_length_params, data_length_limitation
     ):
@@ -2365,8 +2511,8 @@ class BLEDriver(object):
             data_length_limitation, (BLEGapDataLengthLimitation, type(None))
         )
         dll = driver.new_ble_gap_data_length_limitation()
-        err_code = driver.sd_ble_gap_data_length_update(
-            self.rpc_adapter,
+        err_code = self.transport_call(
+            driver.sd_ble_gap_data_length_update,
             conn_handle,
             data_length_params.to_c() if data_length_params else None,
             dll,
@@ -2378,29 +2524,28 @@ class BLEDriver(object):
         return err_code
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @connection_ordered
     def ble_gap_rssi_start(self, conn_handle, threshold_dbm, skip_count):
-        return driver.sd_ble_gap_rssi_start(
-            self.rpc_adapter, conn_handle, threshold_dbm, skip_count
+        return self.transport_call(
+            driver.sd_ble_gap_rssi_start, conn_handle, threshold_dbm, skip_count
         )
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @connection_ordered
     def ble_gap_rssi_stop(self, conn_handle):
-        return driver.sd_ble_gap_rssi_stop(self.rpc_adapter, conn_handle)
+        return self.transport_call(driver.sd_ble_gap_rssi_stop, conn_handle)
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
     def ble_gap_tx_power_set(self, tx_power):
-        return driver.sd_ble_gap_tx_power_set(self.rpc_adapter, tx_power)
+        return self.transport_call(driver.sd_ble_gap_tx_power_set, tx_power)
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @connection_ordered
     def ble_gap_phy_update(self, conn_handle, gap_phys):
         assert nrf_sd_ble_api_ver >= 5, 'PHY Update requires SD API v5 or higher'
         assert isinstance(gap_phys, BLEGapPhys)
         gap_phys_c = gap_phys.to_c()
-        err_code = driver.sd_ble_gap_phy_update(self.rpc_adapter, conn_handle, gap_phys_c)
+        err_code = self.transport_call(driver.sd_ble_gap_phy_update, conn_handle, gap_phys_c)
         if err_code != driver.NRF_SUCCESS:
             raise NordicSemiException(
                 "Failed to update phy. Error code: {}".format(err_code)
@@ -2408,26 +2553,42 @@ class BLEDriver(object):
         return err_code
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
     def ble_vs_uuid_add(self, uuid_base):
         assert isinstance(uuid_base, BLEUUIDBase), "Invalid argument type"
-        uuid_type = driver.new_uint8()
+        uuid_type = self.uuid_bases.lookup_base(uuid_base.base)
+        if uuid_type is not None:
+            uuid_base.type = uuid_type
+            return driver.NRF_SUCCESS
 
-        err_code = driver.sd_ble_uuid_vs_add(
-            self.rpc_adapter, uuid_base.to_c(), uuid_type
+        uuid_type = driver.new_uint8()
+        err_code = self.transport_call(
+            driver.sd_ble_uuid_vs_add, uuid_base.to_c(), uuid_type
         )
         if err_code == driver.NRF_SUCCESS:
             uuid_base.type = driver.uint8_value(uuid_type)
+            self.uuid_bases.add_base(uuid_base.base, uuid_base.type)
         return err_code
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
     def ble_uuid_decode(self, uuid_list, uuid):
         uuid_len = len(uuid_list)
         assert isinstance(uuid_list, list), "Invalid argument type"
         assert ((uuid_len == 2) or (uuid_len == 16)), "Invalid uuid length"
         assert isinstance(uuid, BLEUUID)
 
+        # A 16-bit UUID always decodes to the Bluetooth SIG base
+        if uuid_len == 2:
+            uuid.base.type = driver.BLE_UUID_TYPE_BLE
+            return driver.NRF_SUCCESS
+        uuid_type = self.uuid_bases.lookup_uuid(uuid_list)
+        if uuid_type is not None:
+            uuid.base.type = uuid_type
+            return driver.NRF_SUCCESS
+        unknown = self.uuid_bases.lookup_unknown(uuid_list)
+        if unknown is not None:
+            err_code, uuid.base.type = unknown
+            return err_code
+
         lsb_list = uuid_list[::-1]
         uuid_le_array = util.list_to_uint8_array(lsb_list)
         uuid_le_array_cast = uuid_le_array.cast()
@@ -2435,87 +2596,91 @@ class BLEDriver(object):
 
         uuid_c = uuid.to_c()
 
-        err_code = driver.sd_ble_uuid_decode(self.rpc_adapter, uuid_len, uuid_le_array_cast,
+        err_code = self.transport_call(driver.sd_ble_uuid_decode, uuid_len, uuid_le_array_cast,
                                              uuid_c)
         if err_code == driver.NRF_SUCCESS:
             uuid_from_c = BLEUUID.from_c(uuid_c)
             uuid.base.type = uuid_from_c.base.type
+        # Depending on the SoftDevice an unknown base is NOT_FOUND or
+        # success with type UNKNOWN; either holds until a base is added
+        if err_code == driver.NRF_ERROR_NOT_FOUND or (
+            err_code == driver.NRF_SUCCESS and uuid.base.type == driver.BLE_UUID_TYPE_UNKNOWN
+        ):
+            self.uuid_bases.add_unknown(uuid_list, err_code, uuid.base.type)
         return err_code
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @connection_ordered
     def ble_gattc_write(self, conn_handle, write_params):
         assert isinstance(write_params, BLEGattcWriteParams), "Invalid argument type"
-        return driver.sd_ble_gattc_write(
-            self.rpc_adapter, conn_handle, write_params.to_c()
+        return self.transport_call(
+            driver.sd_ble_gattc_write, conn_handle, write_params.to_c()
         )
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @connection_ordered
     def ble_gattc_read(self, conn_handle, handle, offset):
-        return driver.sd_ble_gattc_read(self.rpc_adapter, conn_handle, handle, offset)
+        return self.transport_call(driver.sd_ble_gattc_read, conn_handle, handle, offset)
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @connection_ordered
     def ble_gattc_prim_srvc_disc(self, conn_handle, srvc_uuid, start_handle):
         assert isinstance(srvc_uuid, (BLEUUID, type(None))), "Invalid argument type"
-        return driver.sd_ble_gattc_primary_services_discover(
-            self.rpc_adapter,
+        return self.transport_call(
+            driver.sd_ble_gattc_primary_services_discover,
             conn_handle,
             start_handle,
             srvc_uuid.to_c() if srvc_uuid else None,
         )
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @connection_ordered
     def ble_gattc_char_disc(self, conn_handle, start_handle, end_handle):
         handle_range = driver.ble_gattc_handle_range_t()
         handle_range.start_handle = start_handle
         handle_range.end_handle = end_handle
-        return driver.sd_ble_gattc_characteristics_discover(
-            self.rpc_adapter, conn_handle, handle_range
+        return self.transport_call(
+            driver.sd_ble_gattc_characteristics_discover, conn_handle, handle_range
         )
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @connection_ordered
     def ble_gattc_desc_disc(self, conn_handle, start_handle, end_handle):
         handle_range = driver.ble_gattc_handle_range_t()
         handle_range.start_handle = start_handle
         handle_range.end_handle = end_handle
-        return driver.sd_ble_gattc_descriptors_discover(
-            self.rpc_adapter, conn_handle, handle_range
+        return self.transport_call(
+            driver.sd_ble_gattc_descriptors_discover, conn_handle, handle_range
         )
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @connection_ordered
     def ble_gattc_exchange_mtu_req(self, conn_handle, mtu):
-        return driver.sd_ble_gattc_exchange_mtu_request(
-            self.rpc_adapter, conn_handle, mtu
+        return self.transport_call(
+            driver.sd_ble_gattc_exchange_mtu_request, conn_handle, mtu
         )
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @connection_ordered
     def ble_gattc_hv_confirm(self, conn_handle, attr_handle):
-        return driver.sd_ble_gattc_hv_confirm(
-            self.rpc_adapter, conn_handle, attr_handle
+        return self.transport_call(
+            driver.sd_ble_gattc_hv_confirm, conn_handle, attr_handle
         )
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
     def ble_gatts_service_add(self, service_type, uuid, service_handle):
         assert isinstance(service_handle, BLEGattHandle)
         assert isinstance(uuid, BLEUUID)
         handle = driver.new_uint16()
         uuid_c = uuid.to_c()
-        err_code = driver.sd_ble_gatts_service_add(
-            self.rpc_adapter, service_type, uuid_c, handle
+        err_code = self.transport_call(
+            driver.sd_ble_gatts_service_add, service_type, uuid_c, handle
         )
         if err_code == driver.NRF_SUCCESS:
             service_handle.handle = driver.uint16_value(handle)
         return err_code
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
     def ble_gatts_characteristic_add(
         self, service_handle, char_md, attr_char_value, char_handle
     ):
@@ -2523,8 +2688,8 @@ class BLEDriver(object):
         handles = driver.ble_gatts_char_handles_t()
         char_md = char_md.to_c()
         attr_char_value = attr_char_value.to_c()
-        err_code = driver.sd_ble_gatts_characteristic_add(
-            self.rpc_adapter, service_handle, char_md, attr_char_value, handles
+        err_code = self.transport_call(
+            driver.sd_ble_gatts_characteristic_add, service_handle, char_md, attr_char_value, handles
         )
         if err_code == driver.NRF_SUCCESS:
             char_handle.value_handle = handles.value_handle
@@ -2534,21 +2699,22 @@ class BLEDriver(object):
         return err_code
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @connection_ordered
     def ble_gatts_exchange_mtu_reply(self, conn_handle, mtu):
-        return driver.sd_ble_gatts_exchange_mtu_reply(
-            self.rpc_adapter, conn_handle, mtu
+        return self.transport_call(
+            driver.sd_ble_gatts_exchange_mtu_reply, conn_handle, mtu
         )
 
     @NordicSemiErrorCheck
-    @wrapt.synchronized(api_lock)
+    @connection_ordered
     def ble_gatts_hvx(self, conn_handle, hvx_params):
         assert isinstance(hvx_params, BLEGattsHVXParams), "Invalid argument type"
         hvx_params = hvx_params.to_c()
-        return driver.sd_ble_gatts_hvx(self.rpc_adapter, conn_handle, hvx_params)
+        return self.transport_call(driver.sd_ble_gatts_hvx, conn_handle, hvx_params)
 
+    @connection_ordered
     def ble_gatts_sys_attr_set(self, conn_handle, sys_attr_data, length, flags):
-        return driver.sd_ble_gatts_sys_attr_set(self.rpc_adapter, conn_handle,
+        return self.transport_call(driver.sd_ble_gatts_sys_attr_set, conn_handle,
                                                 sys_attr_data, length, flags)
 
     # IMPORTANT: Python annotations on callbacks make the reference count
@@ -2562,9 +2728,11 @@ class BLEDriver(object):
         else:
             logger.error("status_handler")
 
-    @wrapt.synchronized(observer_lock)
+    @synchronized_on("observer_lock")
     def status_handler_sync(self, adapter, status_code, status_message):
         statusEnum = RpcAppStatus(status_code)
+        if statusEnum == RpcAppStatus.resetPerformed:
+            self.uuid_bases.reset()
 
         for obs in self.observers:
             obs.on_rpc_status(adapter, statusEnum, status_message)
@@ -2589,7 +2757,7 @@ class BLEDriver(object):
         else:
             logger.error("log_message_handler")
 
-    @wrapt.synchronized(observer_lock)
+    @synchronized_on("observer_lock")
     def log_message_handler_sync(self, adapter, severity, log_message):
         severityEnum = RpcLogSeverity(severity)
         logLevel = None  # type: int
@@ -2622,7 +2790,10 @@ class BLEDriver(object):
         while self.run_workers:
             try:
                 item = self.ble_event_queue.get(True, WORKER_QUEUE_WAIT_TIME)
-                self.ble_event_handler_sync(*item)
+                if isinstance(item, RawEvent):
+                    self.ble_event_handler_raw(item)
+                else:
+                    self.ble_event_handler_sync(*item)
             except queue.Empty:
                 pass
             except Exception as ex:
@@ -2630,7 +2801,11 @@ class BLEDriver(object):
 
     def ble_event_handler(self, adapter, ble_event):
         if self.rpc_adapter.internal == adapter.internal:
-            self.ble_event_queue.put([adapter, ble_event])
+            raw_event = self.raw_events.capture(ble_event) if self.raw_events else None
+            if raw_event is not None:
+                self.ble_event_queue.put(raw_event)
+            else:
+                self.ble_event_queue.put([adapter, ble_event])
         else:
             logger.error(
                 "ble_event_handler, event for adapter %d, current adapter is %d",
@@ -2638,7 +2813,81 @@ class BLEDriver(object):
                 self.rpc_adapter.internal,
             )
 
-    @wrapt.synchronized(observer_lock)
+    @synchronized_on("observer_lock")
+    def ble_event_handler_raw(self, raw_event):
+        try:
+            evt = self.raw_events.decode(raw_event)
+            evt_id = BLEEvtID(raw_event.evt_id)
+
+            if evt_id == BLEEvtID.gap_evt_adv_report:
+                adv_type = None
+                if not evt.scan_rsp:
+                    adv_type = BLEGapAdvType(evt.adv_type)
+
+                # Each observer gets its own objects, as on the SWIG path
+                for obs in self.observers:
+                    obs.on_gap_evt_adv_report(
+                        ble_driver=self,
+                        conn_handle=evt.conn_handle,
+                        peer_addr=BLEGapAddr.from_bytes(evt.addr_type, evt.addr),
+                        rssi=evt.rssi,
+                        adv_type=adv_type,
+                        adv_data=BLEAdvData.from_bytes(evt.data),
+                    )
+
+            elif evt_id == BLEEvtID.gattc_evt_hvx:
+                for obs in self.observers:
+                    obs.on_gattc_evt_hvx(
+                        ble_driver=self,
+                        conn_handle=evt.conn_handle,
+                        status=BLEGattStatusCode(evt.gatt_status),
+                        error_handle=evt.error_handle,
+                        attr_handle=evt.handle,
+                        hvx_type=BLEGattHVXType(evt.hvx_type),
+                        data=list(evt.data),
+                    )
+
+            elif evt_id == BLEEvtID.gap_evt_disconnected:
+                try:
+                    reason = BLEHci(evt.reason)
+                except ValueError:
+                    reason = evt.reason
+                for obs in self.observers:
+                    obs.on_gap_evt_disconnected(
+                        ble_driver=self,
+                        conn_handle=evt.conn_handle,
+                        reason=reason,
+                    )
+
+            elif evt_id == BLEEvtID.gap_evt_timeout:
+                try:
+                    src = BLEGapTimeoutSrc(evt.src)
+                except ValueError:
+                    src = evt.src
+                for obs in self.observers:
+                    obs.on_gap_evt_timeout(
+                        ble_driver=self,
+                        conn_handle=evt.conn_handle,
+                        src=src,
+                    )
+
+            elif evt_id == BLEEvtID.gap_evt_rssi_changed:
+                for obs in self.observers:
+                    obs.on_gap_evt_rssi_changed(
+                        ble_driver=self,
+                        conn_handle=evt.conn_handle,
+                        rssi=evt.rssi,
+                    )
+
+        except Exception as e:
+            logger.error("Exception: {}".format(str(e)))
+            for line in traceback.extract_tb(sys.exc_info()[2]):
+                logger.error(line)
+            logger.error("")
+        finally:
+            self.raw_events.release(raw_event)
+
+    @synchronized_on("observer_lock")
     def ble_event_handler_sync(self, _adapter, ble_event):
 
         try:
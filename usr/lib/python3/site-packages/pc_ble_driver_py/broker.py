@@ -0,0 +1,590 @@
+"""
+Share one dongle's event stream between processes.
+
+Only one process can own the serial port through BLEDriver. BrokerServer
+runs in that process as an observer and publishes events over a unix
+socket; any number of BrokerClient processes subscribe to them and issue
+API calls, which the broker runs one at a time on the single adapter.
+
+Every message is a frame: u32 payload length, u8 message type, payload.
+Events are encoded once per event with fixed struct layouts (below) and
+the same bytes go to every client whose filter matches. Filters (event
+names and peer addresses) are evaluated in the broker, so a client only
+wakes up for what it asked for. Events that carry a conn_handle but no
+address match on the address the connection was made to.
+
+A client that does not keep up is not allowed to stall the dispatcher:
+once max_client_buffer bytes are waiting for it, further events for that
+client are dropped and it is told how many with a "dropped" message.
+
+    # owner process
+    server = BrokerServer(ble_driver, "/tmp/ble_broker.sock")
+    ble_driver.observer_register(server)
+    server.start()
+
+    # any other process
+    client = BrokerClient("/tmp/ble_broker.sock", events=["adv_report"],
+                          addrs=["C0:11:22:33:44:55"])
+    client.call("scan_start", interval_ms=100, window_ms=50)
+    while True:
+        print(client.recv())
+"""
+import collections
+import json
+import logging
+import os
+import queue
+import selectors
+import socket
+import struct
+import time
+from threading import Lock, Thread
+
+from pc_ble_driver_py.observers import BLEDriverObserver
+
+logger = logging.getLogger(__name__)
+
+FRAME = struct.Struct("<IB")  # payload length, message type
+CALL_ID = struct.Struct("<I")
+RESULT_HEAD = struct.Struct("<IB")  # call id, ok
+DROPPED = struct.Struct("<I")
+
+MSG_SUBSCRIBE = 1  # client -> broker, JSON {"events": [...], "addrs": [...]}
+MSG_CALL = 2  # client -> broker, call id + JSON {"method": ..., "args": {...}}
+MSG_EVENT = 3  # broker -> client, event code + struct + variable data
+MSG_RESULT = 4  # broker -> client, call id, ok + JSON result or error text
+MSG_DROPPED = 5  # broker -> client, events dropped since the last notice
+
+NO_ADV_TYPE = -1  # scan responses have no adv type
+
+AdvReport = collections.namedtuple("AdvReport", "conn_handle addr_type addr rssi adv_type data")
+Connected = collections.namedtuple("Connected", "conn_handle addr_type addr role")
+Disconnected = collections.namedtuple("Disconnected", "conn_handle reason")
+Timeout = collections.namedtuple("Timeout", "conn_handle src")
+RssiChanged = collections.namedtuple("RssiChanged", "conn_handle rssi")
+Hvx = collections.namedtuple("Hvx", "conn_handle status error_handle attr_handle hvx_type data")
+ReadRsp = collections.namedtuple("ReadRsp", "conn_handle status error_handle attr_handle offset data")
+WriteRsp = collections.namedtuple(
+    "WriteRsp", "conn_handle status error_handle attr_handle write_op offset data"
+)
+Dropped = collections.namedtuple("Dropped", "count")
+
+# name -> (event code, fixed layout, tuple type); addresses are MSB first.
+# Tuples whose type has a data field carry the rest of the payload in it.
+EVENTS = {
+    "adv_report": (1, struct.Struct("<HB6sbb"), AdvReport),
+    "connected": (2, struct.Struct("<HB6sB"), Connected),
+    "disconnected": (3, struct.Struct("<HB"), Disconnected),
+    "timeout": (4, struct.Struct("<HB"), Timeout),
+    "rssi_changed": (5, struct.Struct("<Hb"), RssiChanged),
+    "hvx": (6, struct.Struct("<HHHHB"), Hvx),
+    "read_rsp": (7, struct.Struct("<HHHHH"), ReadRsp),
+    "write_rsp": (8, struct.Struct("<HHHHBH"), WriteRsp),
+}
+EVENT_CODES = {code: (name, layout, factory) for name, (code, layout, factory) in EVENTS.items()}
+
+
+class BrokerError(Exception):
+    pass
+
+
+def _value(v):
+    return getattr(v, "value", v)
+
+
+def addr_bytes(addr):
+    """"AA:BB:CC:DD:EE:FF", or MSB-first list/bytes, to six bytes."""
+    if isinstance(addr, str):
+        return bytes.fromhex(addr.replace(":", ""))
+    return bytes(addr)
+
+
+def addr_str(addr):
+    return ":".join("{:02X}".format(b) for b in addr)
+
+
+def frame(msg_type, payload):
+    return FRAME.pack(len(payload), msg_type) + payload
+
+
+def encode_event(name, fields, data=b""):
+    code, layout, _ = EVENTS[name]
+    return frame(MSG_EVENT, bytes((code,)) + layout.pack(*fields) + bytes(data))
+
+
+def decode_event(payload):
+    name, layout, factory = EVENT_CODES[payload[0]]
+    fields = list(layout.unpack_from(payload, 1))
+    if "addr" in factory._fields:
+        i = factory._fields.index("addr")
+        fields[i] = addr_str(fields[i])
+    if "data" in factory._fields:
+        fields.append(bytes(payload[1 + layout.size:]))
+    return name, factory(*fields)
+
+
+def _api_calls():
+    """name -> function(ble_driver, **args) for the calls clients may make.
+
+    Imported here rather than at the top of the module so that client
+    processes do not load the driver library."""
+    from pc_ble_driver_py.ble_driver import (
+        BLEConfigBase,
+        BLEGapAddr,
+        BLEGapScanParams,
+        BLEGattcWriteParams,
+        BLEGattExecWriteFlag,
+        BLEGattWriteOperation,
+    )
+
+    def scan_start(d, interval_ms=100, window_ms=50, timeout_s=0, active=True):
+        d.ble_gap_scan_start(BLEGapScanParams(interval_ms, window_ms, timeout_s, active))
+
+    def connect(d, addr, addr_type="random_static", tag=BLEConfigBase.conn_cfg_tag):
+        # The link config default_setup() sets up, as AdapterPool.connect uses
+        d.ble_gap_connect(BLEGapAddr(BLEGapAddr.Types[addr_type], list(addr_bytes(addr))), tag=tag)
+
+    def gattc_write(d, conn_handle, handle, data, write_op="write_req", offset=0):
+        # data: list of byte values or a hex string
+        if not isinstance(data, list):
+            data = list(bytes.fromhex(str(data)))
+        d.ble_gattc_write(
+            conn_handle,
+            BLEGattcWriteParams(
+                BLEGattWriteOperation[write_op],
+                BLEGattExecWriteFlag.unused,
+                handle,
+                data,
+                offset,
+            ),
+        )
+
+    return {
+        "scan_start": scan_start,
+        "scan_stop": lambda d: d.ble_gap_scan_stop(),
+        "connect": connect,
+        "disconnect": lambda d, conn_handle: d.ble_gap_disconnect(conn_handle),
+        "gattc_read": lambda d, conn_handle, handle, offset=0: d.ble_gattc_read(conn_handle, handle, offset),
+        "gattc_write": gattc_write,
+        "rssi_start": lambda d, conn_handle, threshold_dbm=0, skip_count=0: d.ble_gap_rssi_start(
+            conn_handle, threshold_dbm, skip_count
+        ),
+        "rssi_stop": lambda d, conn_handle: d.ble_gap_rssi_stop(conn_handle),
+    }
+
+
+class FrameReader(object):
+    def __init__(self):
+        self.buf = bytearray()
+
+    def feed(self, data):
+        self.buf += data
+
+    def frames(self):
+        while len(self.buf) >= FRAME.size:
+            length, msg_type = FRAME.unpack_from(self.buf)
+            end = FRAME.size + length
+            if len(self.buf) < end:
+                return
+            payload = bytes(self.buf[FRAME.size:end])
+            del self.buf[:end]
+            yield msg_type, payload
+
+
+class BrokerConnection(object):
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = FrameReader()
+        self.out = bytearray()
+        self.events = None  # None: everything
+        self.addrs = None
+        self.dropped = 0
+        self.dropped_total = 0
+        self.sent_events = 0
+
+    def wants(self, name, addr):
+        if self.events is not None and name not in self.events:
+            return False
+        return self.addrs is None or addr in self.addrs
+
+
+class BrokerServer(BLEDriverObserver):
+    def __init__(self, ble_driver, socket_path, max_client_buffer=1 << 20):
+        super(BrokerServer, self).__init__()
+        self.driver = ble_driver
+        self.socket_path = socket_path
+        self.max_client_buffer = max_client_buffer
+        self.api = _api_calls()
+
+        self.clients = dict()  # fd -> BrokerConnection
+        self.conn_addr = dict()  # conn_handle -> peer address bytes
+        self.published = 0
+        self.calls = 0
+
+        self._lock = Lock()
+        self._calls = queue.Queue()
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._stop = False
+        self._threads = []
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(socket_path)
+        self.server.listen(16)
+        self.server.setblocking(False)
+        self._selector.register(self.server, selectors.EVENT_READ)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+
+    def start(self):
+        self._stop = False
+        for target, name in ((self._io_loop, "BrokerIO"), (self._call_loop, "BrokerCalls")):
+            t = Thread(target=target, name=name)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def stop(self):
+        self._stop = True
+        self._calls.put(None)
+        self._wake()
+        for t in self._threads:
+            t.join(2.0)
+        self._threads = []
+        for client in list(self.clients.values()):
+            client.sock.close()
+        self.clients.clear()
+        self.server.close()
+        os.unlink(self.socket_path)
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b"\0")
+        except BlockingIOError:
+            pass
+
+    # Sending. The dispatcher thread writes directly while a client's
+    # buffer is empty; anything left over is flushed by the IO thread.
+
+    def _send(self, client, data):
+        """Queue data for client; call with self._lock held."""
+        if not client.out:
+            try:
+                n = client.sock.send(data)
+            except (BlockingIOError, InterruptedError):
+                n = 0
+            except OSError:
+                return
+            if n == len(data):
+                return
+            data = data[n:]
+            self._wake()
+        client.out += data
+
+    def _publish(self, name, addr, fields, data=b""):
+        encoded = None
+        with self._lock:
+            self.published += 1
+            for client in self.clients.values():
+                if not client.wants(name, addr):
+                    continue
+                if len(client.out) + FRAME.size + 32 + len(data) > self.max_client_buffer:
+                    client.dropped += 1
+                    client.dropped_total += 1
+                    continue
+                if encoded is None:
+                    encoded = encode_event(name, fields, data)
+                client.sent_events += 1
+                self._send(client, encoded)
+
+    def _flush(self, client):
+        with self._lock:
+            try:
+                n = client.sock.send(client.out)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                self._drop_client(client)
+                return
+            del client.out[:n]
+            if not client.out and client.dropped:
+                client.out += frame(MSG_DROPPED, DROPPED.pack(client.dropped))
+                client.dropped = 0
+
+    def _drop_client(self, client):
+        fd = client.sock.fileno()
+        if self.clients.pop(fd, None) is None:
+            return
+        self._selector.unregister(client.sock)
+        client.sock.close()
+        logger.info("Broker: client %d disconnected", fd)
+
+    # IO thread
+
+    def _io_loop(self):
+        while not self._stop:
+            with self._lock:
+                for client in self.clients.values():
+                    mask = selectors.EVENT_READ | (selectors.EVENT_WRITE if client.out else 0)
+                    self._selector.modify(client.sock, mask, client)
+            for key, mask in self._selector.select(1.0):
+                if key.fileobj is self.server:
+                    self._accept()
+                elif key.fileobj is self._wake_r:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    client = key.data
+                    if mask & selectors.EVENT_WRITE:
+                        self._flush(client)
+                    if mask & selectors.EVENT_READ:
+                        self._receive(client)
+
+    def _accept(self):
+        try:
+            sock, _ = self.server.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        client = BrokerConnection(sock)
+        with self._lock:
+            self.clients[sock.fileno()] = client
+            self._selector.register(sock, selectors.EVENT_READ, client)
+        logger.info("Broker: client %d connected", sock.fileno())
+
+    def _receive(self, client):
+        try:
+            data = client.sock.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""
+        if not data:
+            with self._lock:
+                self._drop_client(client)
+            return
+        client.reader.feed(data)
+        for msg_type, payload in client.reader.frames():
+            try:
+                self._handle(client, msg_type, payload)
+            except (ValueError, TypeError, AttributeError, struct.error, UnicodeDecodeError) as e:
+                # One bad client must not take the IO thread down with it
+                logger.warning("Broker: client %d sent a malformed frame: %s", client.sock.fileno(), e)
+                with self._lock:
+                    self._drop_client(client)
+                return
+
+    def _handle(self, client, msg_type, payload):
+        if msg_type == MSG_SUBSCRIBE:
+            self._subscribe(client, json.loads(payload.decode()))
+        elif msg_type == MSG_CALL:
+            (call_id,) = CALL_ID.unpack_from(payload)
+            request = json.loads(payload[CALL_ID.size:].decode())
+            self._calls.put((client, call_id, request.get("method"), request.get("args") or {}))
+        else:
+            logger.warning("Broker: unknown message type %d", msg_type)
+
+    def _subscribe(self, client, request):
+        events = request.get("events")
+        addrs = request.get("addrs")
+        # Parse before taking the lock, so a bad request leaves nothing half set
+        events = None if events is None else frozenset(events)
+        addrs = None if addrs is None else frozenset(addr_bytes(a) for a in addrs)
+        with self._lock:
+            client.events = events
+            client.addrs = addrs
+
+    # Call thread: one API call at a time, in arrival order
+
+    def _call_loop(self):
+        while True:
+            item = self._calls.get()
+            if item is None:
+                return
+            client, call_id, method, args = item
+            self.calls += 1
+            try:
+                fn = self.api[method]
+            except KeyError:
+                ok, result = False, "unknown method {!r}".format(method)
+            else:
+                try:
+                    ok, result = True, fn(self.driver, **args)
+                except Exception as e:
+                    ok, result = False, "{}: {}".format(type(e).__name__, e)
+            try:
+                body = json.dumps(result)
+            except TypeError:
+                body = json.dumps(repr(result))
+            with self._lock:
+                if client.sock.fileno() in self.clients:
+                    self._send(client, frame(MSG_RESULT, RESULT_HEAD.pack(call_id, ok) + body.encode()))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "published": self.published,
+                "calls": self.calls,
+                "pending_calls": self._calls.qsize(),
+                "clients": [
+                    {
+                        "fd": fd,
+                        "events": sorted(c.events) if c.events is not None else None,
+                        "sent": c.sent_events,
+                        "dropped": c.dropped_total,
+                        "buffered": len(c.out),
+                    }
+                    for fd, c in self.clients.items()
+                ],
+            }
+
+    # Observer callbacks, on the dispatcher thread
+
+    def on_gap_evt_adv_report(self, ble_driver, conn_handle, peer_addr, rssi, adv_type, adv_data):
+        addr = bytes(peer_addr.addr)
+        payload = bytearray()
+        for ad_type, value in adv_data.records.items():
+            payload.append(len(value) + 1)
+            payload.append(_value(ad_type))
+            payload += bytes(value)
+        self._publish(
+            "adv_report",
+            addr,
+            (conn_handle, _value(peer_addr.addr_type), addr, rssi,
+             NO_ADV_TYPE if adv_type is None else _value(adv_type)),
+            payload,
+        )
+
+    def on_gap_evt_connected(self, ble_driver, conn_handle, peer_addr, role, conn_params):
+        addr = bytes(peer_addr.addr)
+        self.conn_addr[conn_handle] = addr
+        self._publish(
+            "connected", addr, (conn_handle, _value(peer_addr.addr_type), addr, _value(role))
+        )
+
+    def on_gap_evt_disconnected(self, ble_driver, conn_handle, reason):
+        addr = self.conn_addr.pop(conn_handle, None)
+        self._publish("disconnected", addr, (conn_handle, _value(reason)))
+
+    def on_gap_evt_timeout(self, ble_driver, conn_handle, src):
+        self._publish("timeout", self.conn_addr.get(conn_handle), (conn_handle, _value(src)))
+
+    def on_gap_evt_rssi_changed(self, ble_driver, conn_handle, rssi):
+        self._publish("rssi_changed", self.conn_addr.get(conn_handle), (conn_handle, rssi))
+
+    def on_gattc_evt_hvx(self, ble_driver, conn_handle, status, error_handle, attr_handle, hvx_type, data):
+        self._publish(
+            "hvx",
+            self.conn_addr.get(conn_handle),
+            (conn_handle, _value(status), error_handle, attr_handle, _value(hvx_type)),
+            bytes(data),
+        )
+
+    def on_gattc_evt_read_rsp(self, ble_driver, conn_handle, status, error_handle, attr_handle, offset, data):
+        self._publish(
+            "read_rsp",
+            self.conn_addr.get(conn_handle),
+            (conn_handle, _value(status), error_handle, attr_handle, offset),
+            bytes(data or b""),
+        )
+
+    def on_gattc_evt_write_rsp(
+        self, ble_driver, conn_handle, status, error_handle, attr_handle, write_op, offset, data
+    ):
+        self._publish(
+            "write_rsp",
+            self.conn_addr.get(conn_handle),
+            (conn_handle, _value(status), error_handle, attr_handle, _value(write_op), offset),
+            bytes(data or b""),
+        )
+
+
+class BrokerClient(object):
+    def __init__(self, socket_path, events=None, addrs=None):
+        """events: names from EVENTS, addrs: "AA:BB:CC:DD:EE:FF" strings;
+        None subscribes to everything."""
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socket_path)
+        self.reader = FrameReader()
+        self.pending = collections.deque()  # events received while waiting for a result
+        self._next_call = 0
+        self.subscribe(events, addrs)
+
+    def subscribe(self, events=None, addrs=None):
+        request = {"events": None if events is None else list(events),
+                   "addrs": None if addrs is None else list(addrs)}
+        self.sock.sendall(frame(MSG_SUBSCRIBE, json.dumps(request).encode()))
+
+    def _read(self, deadline):
+        """Next (msg_type, payload), or None at deadline (None: no deadline)."""
+        while True:
+            for item in self.reader.frames():
+                # frames() is a generator; take one and leave the rest buffered
+                return item
+            if deadline is None:
+                self.sock.settimeout(None)
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self.sock.settimeout(remaining)
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                return None
+            if not data:
+                raise BrokerError("broker closed the connection")
+            self.reader.feed(data)
+
+    def _message(self, msg_type, payload):
+        if msg_type == MSG_EVENT:
+            return decode_event(payload)
+        if msg_type == MSG_DROPPED:
+            return "dropped", Dropped(*DROPPED.unpack(payload))
+        return None
+
+    def recv(self, timeout=None):
+        """Next (event name, event tuple), or None on timeout."""
+        if self.pending:
+            return self.pending.popleft()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            item = self._read(deadline)
+            if item is None:
+                return None
+            message = self._message(*item)
+            if message is not None:
+                return message
+
+    def call(self, method, timeout=10.0, **args):
+        """Run an API call in the broker; return its result or raise BrokerError."""
+        self._next_call += 1
+        call_id = self._next_call
+        body = json.dumps({"method": method, "args": args}).encode()
+        self.sock.sendall(frame(MSG_CALL, CALL_ID.pack(call_id) + body))
+        deadline = time.monotonic() + timeout
+        while True:
+            item = self._read(deadline)
+            if item is None:
+                raise BrokerError("{}: no result in {} s".format(method, timeout))
+            msg_type, payload = item
+            if msg_type == MSG_RESULT:
+                result_id, ok = RESULT_HEAD.unpack_from(payload)
+                if result_id != call_id:
+                    continue
+                result = json.loads(payload[RESULT_HEAD.size:].decode())
+                if not ok:
+                    raise BrokerError("{}: {}".format(method, result))
+                return result
+            message = self._message(msg_type, payload)
+            if message is not None:
+                self.pending.append(message)
+
+    def close(self):
+        self.sock.close()
@@ -0,0 +1,415 @@
+"""
+Queue of connection requests for one adapter, run one at a time.
+
+The SoftDevice accepts a single pending ble_gap_connect and cannot scan and
+initiate at the same time, so callers that connect on their own collide on
+busy errors. ConnectionScheduler owns both for its BLEDriver: requests are
+queued by priority (higher first, oldest first within a priority), each
+attempt gets at most attempt_s of radio time, and, if scan_params is given,
+the scheduler scans for scan_gap_s between attempts and continuously while
+the queue is empty, so discovery keeps going while a long queue drains.
+
+An attempt that ends without a connection, by a connection timeout or by
+no event at all (a stale attempt, which is cancelled), puts its request
+back behind the others of the same priority until the request's own
+timeout_s has passed. A busy SoftDevice, e.g. a connect issued outside the
+scheduler or no free link, is retried after busy_backoff_s.
+
+    scheduler = ConnectionScheduler(ble_driver, scan_params=BLEGapScanParams(100, 50, 0))
+    scheduler.start()
+    request = scheduler.connect(peer_addr, priority=1, timeout_s=30)
+    if request.wait(35):
+        print(request.conn_handle, request.latency_s)
+    scheduler.stop()
+    print(scheduler.stats)
+"""
+import collections
+import heapq
+import itertools
+import logging
+import math
+import time
+from threading import Event, Lock, Thread
+
+from pc_ble_driver_py.ble_driver import (
+    BLEConfigBase,
+    BLEGapRoles,
+    BLEGapScanParams,
+    BLEGapTimeoutSrc,
+    driver,
+)
+from pc_ble_driver_py.exceptions import NordicSemiException
+from pc_ble_driver_py.observers import BLEDriverObserver
+
+logger = logging.getLogger(__name__)
+
+# Errors that mean "not now" rather than "not this request"
+BUSY_ERRORS = (driver.NRF_ERROR_BUSY, driver.NRF_ERROR_INVALID_STATE, driver.NRF_ERROR_CONN_COUNT)
+
+# Time allowed for the connected/timeout event after the attempt's scan
+# timeout has run out
+EVENT_MARGIN_S = 1.0
+
+
+def _key(peer_addr):
+    return (getattr(peer_addr.addr_type, "value", peer_addr.addr_type), tuple(peer_addr.addr))
+
+
+class ConnectRequest(object):
+    def __init__(self, peer_addr, priority, timeout_s, conn_params=None, callback=None):
+        self.peer_addr = peer_addr
+        self.priority = priority
+        self.conn_params = conn_params
+        self.callback = callback  # callback(request), once the request is done
+        self.created = time.monotonic()
+        self.deadline = self.created + timeout_s
+        self.attempts = 0
+        self.conn_handle = None
+        self.error = None  # "timeout", "cancelled" or the NordicSemiException
+        self.completed = None
+        self.cancelled = False
+        self._seq = None  # heap entry that is current, None while not queued
+        self._done = Event()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    @property
+    def latency_s(self):
+        """Queueing plus connection time, once connected."""
+        if self.conn_handle is None:
+            return None
+        return self.completed - self.created
+
+    def wait(self, timeout=None):
+        """True once connected; False if the request failed or is still running."""
+        self._done.wait(timeout)
+        return self.conn_handle is not None
+
+    def __str__(self):
+        return "{} priority({}) attempts({}) conn({}) error({})".format(
+            ":".join("{:02X}".format(b) for b in self.peer_addr.addr),
+            self.priority,
+            self.attempts,
+            self.conn_handle,
+            self.error,
+        )
+
+
+class ConnectStats(object):
+    def __init__(self, samples=1000):
+        self.requested = 0
+        self.connected = 0
+        self.timed_out = 0
+        self.cancelled = 0
+        self.failed = 0
+        self.attempts = 0
+        self.attempt_timeouts = 0
+        self.stale_cancels = 0
+        self.busy = 0
+        self.latencies = collections.deque(maxlen=samples)  # seconds, last connections
+
+    def latency(self, fraction):
+        """Latency below which `fraction` of the recent connections fall."""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def __str__(self):
+        p50, p90 = self.latency(0.5), self.latency(0.9)
+        return (
+            "requested({0.requested}) connected({0.connected}) timed_out({0.timed_out}) "
+            "cancelled({0.cancelled}) failed({0.failed}) attempts({0.attempts}) "
+            "attempt_timeouts({0.attempt_timeouts}) stale({0.stale_cancels}) busy({0.busy}) "
+            "latency p50({1}) p90({2})".format(
+                self,
+                "-" if p50 is None else "{:.2f}s".format(p50),
+                "-" if p90 is None else "{:.2f}s".format(p90),
+            )
+        )
+
+
+class ConnectionScheduler(BLEDriverObserver):
+    def __init__(
+        self,
+        ble_driver,
+        scan_params=None,
+        connect_scan_params=None,
+        conn_params=None,
+        tag=BLEConfigBase.conn_cfg_tag,
+        attempt_s=3.0,
+        scan_gap_s=0.5,
+        busy_backoff_s=0.2,
+    ):
+        """scan_params=None leaves scanning alone; connect_scan_params sets
+        the interval and window used while initiating (timeout_s is set per
+        attempt)."""
+        super(ConnectionScheduler, self).__init__()
+        self.ble_driver = ble_driver
+        self.scan_params = scan_params
+        self.connect_scan_params = connect_scan_params or BLEGapScanParams(
+            interval_ms=60, window_ms=60, timeout_s=0
+        )
+        self.conn_params = conn_params
+        self.tag = tag
+        self.attempt_s = attempt_s
+        self.scan_gap_s = scan_gap_s
+        self.busy_backoff_s = busy_backoff_s
+
+        self.stats = ConnectStats()
+        self.scanning = False
+        self._queue = []  # heap of (-priority, seq, request)
+        self._requests = dict()  # key -> request, queued or being connected
+        self._seq = itertools.count()
+        self._attempt = None  # request being connected
+        self._attempt_result = None  # conn_handle, or False for a timeout
+        self._attempt_done = Event()
+        self._lock = Lock()
+        self._wakeup = Event()
+        self._stop = Event()
+        self._worker = None
+
+    def connect(self, peer_addr, priority=0, timeout_s=30.0, conn_params=None, callback=None):
+        """Queue a connection; returns its ConnectRequest. A request for a
+        device that is already queued returns that request, raised to the
+        higher priority and the later timeout of the two."""
+        key = _key(peer_addr)
+        with self._lock:
+            request = self._requests.get(key)
+            if request is None:
+                request = ConnectRequest(peer_addr, priority, timeout_s, conn_params, callback)
+                self._requests[key] = request
+                self.stats.requested += 1
+                self._push(request)
+            else:
+                request.deadline = max(request.deadline, time.monotonic() + timeout_s)
+                if priority > request.priority:
+                    request.priority = priority
+                    if request._seq is not None:
+                        self._push(request)
+        self._wakeup.set()
+        return request
+
+    def cancel(self, request):
+        with self._lock:
+            if request.done:
+                return
+            request.cancelled = True
+            in_flight = request is self._attempt
+            if not in_flight:
+                request._seq = None
+        if in_flight:
+            # The worker cancels the attempt and finishes the request
+            self._attempt_done.set()
+        else:
+            self._finish(request, error="cancelled")
+
+    def queued(self):
+        """Requests waiting for an attempt, in the order they will run."""
+        with self._lock:
+            return [r for _, seq, r in sorted(self._queue) if r._seq == seq]
+
+    def start(self):
+        self.ble_driver.observer_register(self)
+        self._stop.clear()
+        self._worker = Thread(target=self._run, name="ConnectionScheduler")
+        self._worker.daemon = True
+        self._worker.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        self._attempt_done.set()
+        if self._worker:
+            self._worker.join()
+            self._worker = None
+        self._scan_stop()
+        self.ble_driver.observer_unregister(self)
+        with self._lock:
+            pending = list(self._requests.values())
+        for request in pending:
+            self.cancel(request)
+
+    def on_gap_evt_connected(self, ble_driver, conn_handle, peer_addr, role, conn_params):
+        # Only one locally initiated connect can be pending, so a central
+        # link that comes up during an attempt is that attempt's, whatever
+        # address (e.g. a resolved private one) it reports
+        if role != BLEGapRoles.central:
+            return
+        with self._lock:
+            if self._attempt is None:
+                return
+            self._attempt_result = conn_handle
+        self._attempt_done.set()
+
+    def on_gap_evt_timeout(self, ble_driver, conn_handle, src):
+        if src == BLEGapTimeoutSrc.conn:
+            with self._lock:
+                if self._attempt is None:
+                    return
+                self._attempt_result = False
+            self._attempt_done.set()
+        elif src == BLEGapTimeoutSrc.scan and self.scanning and not self._stop.is_set():
+            self.scanning = False
+            self._scan_start()
+
+    def _push(self, request):
+        request._seq = next(self._seq)
+        heapq.heappush(self._queue, (-request.priority, request._seq, request))
+
+    def _next(self):
+        """Highest priority live request, now the current attempt; expired
+        requests met on the way are finished."""
+        expired = []
+        request = None
+        now = time.monotonic()
+        with self._lock:
+            while self._queue:
+                _, seq, candidate = heapq.heappop(self._queue)
+                if candidate._seq != seq:
+                    continue  # superseded or cancelled
+                candidate._seq = None
+                if candidate.deadline <= now:
+                    expired.append(candidate)
+                    continue
+                request = candidate
+                self._attempt = request
+                self._attempt_result = None
+                self._attempt_done.clear()
+                break
+        for candidate in expired:
+            self._finish(candidate, error="timeout")
+        return request
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.clear()
+            request = self._next()
+            if request is None:
+                self._scan_start()
+                self._wakeup.wait(1.0)
+                continue
+
+            self._scan_stop()
+            busy = self._attempt_one(request)
+            if self._stop.is_set():
+                break
+            if busy:
+                self._stop.wait(self.busy_backoff_s)
+            elif self.scan_params and self.scan_gap_s and self.queued():
+                self._scan_start()
+                self._stop.wait(self.scan_gap_s)
+
+    def _attempt_one(self, request):
+        """Run one attempt for request; True if the SoftDevice was busy."""
+        window = min(self.attempt_s, request.deadline - time.monotonic())
+        params = self.connect_scan_params
+        scan_params = BLEGapScanParams(
+            interval_ms=params.interval_ms,
+            window_ms=params.window_ms,
+            timeout_s=max(1, int(math.ceil(window))),
+            active=params.active,
+        )
+        request.attempts += 1
+        self.stats.attempts += 1
+        try:
+            self.ble_driver.ble_gap_connect(
+                request.peer_addr, scan_params, request.conn_params or self.conn_params, self.tag
+            )
+        except NordicSemiException as e:
+            with self._lock:
+                self._attempt = None
+            if getattr(e, "error_code", None) in BUSY_ERRORS:
+                self.stats.busy += 1
+                self._requeue(request)
+                return True
+            logger.error("Connect to %s failed: %s", request, e)
+            self.stats.failed += 1
+            self._finish(request, error=e)
+            return False
+
+        self._attempt_done.wait(scan_params.timeout_s + EVENT_MARGIN_S)
+        with self._lock:
+            result = self._attempt_result
+        if result is None:
+            # Cancelled, stopping, or no event at all
+            try:
+                self.ble_driver.ble_gap_connect_cancel()
+            except NordicSemiException:
+                pass  # the attempt ended on its own meanwhile
+            if not (request.cancelled or self._stop.is_set()):
+                self.stats.stale_cancels += 1
+            # A connection may have come up just before the cancel
+            self._attempt_done.clear()
+            self._attempt_done.wait(0.2)
+        with self._lock:
+            result = self._attempt_result
+            self._attempt = None
+
+        if result is not None and result is not False:
+            self._finish(request, conn_handle=result)
+        elif request.cancelled:
+            self._finish(request, error="cancelled")
+        else:
+            if result is False:
+                self.stats.attempt_timeouts += 1
+            self._requeue(request)
+        return False
+
+    def _requeue(self, request):
+        if request.deadline <= time.monotonic():
+            self._finish(request, error="timeout")
+            return
+        with self._lock:
+            if request.cancelled:
+                requeued = False
+            else:
+                self._push(request)
+                requeued = True
+        if not requeued:
+            self._finish(request, error="cancelled")
+
+    def _finish(self, request, conn_handle=None, error=None):
+        with self._lock:
+            if request.done:
+                return
+            request.conn_handle = conn_handle
+            request.error = error
+            request.completed = time.monotonic()
+            request._seq = None
+            if self._requests.get(_key(request.peer_addr)) is request:
+                del self._requests[_key(request.peer_addr)]
+            if conn_handle is not None:
+                self.stats.connected += 1
+                self.stats.latencies.append(request.latency_s)
+            elif error == "timeout":
+                self.stats.timed_out += 1
+            elif error == "cancelled":
+                self.stats.cancelled += 1
+            request._done.set()
+        logger.debug("Connect request done: %s", request)
+        if request.callback:
+            try:
+                request.callback(request)
+            except Exception as ex:
+                logger.exception("Exception in connect callback: {}".format(ex))
+
+    def _scan_start(self):
+        if not self.scan_params or self.scanning:
+            return
+        try:
+            self.ble_driver.ble_gap_scan_start(self.scan_params)
+            self.scanning = True
+        except NordicSemiException as e:
+            logger.error("Scan start failed: %s", e)
+
+    def _scan_stop(self):
+        if not self.scanning:
+            return
+        self.scanning = False
+        try:
+            self.ble_driver.ble_gap_scan_stop()
+        except NordicSemiException:
+            pass  # scan already timed out
@@ -0,0 +1,177 @@
+"""
+Raw-buffer decoding of the hot BLE events.
+
+Reading an adv report through the SWIG proxies costs a wrapper object per
+attribute hop (ble_event.evt.gap_evt.params.adv_report.peer_addr...), and
+the proxy handed to the event callback points into a buffer owned by the
+transport thread, which the dispatcher thread then reads later. Instead,
+RawEventDecoder.capture() copies the ble_evt_t bytes (the header carries
+evt_len) into a slot of a preallocated slab while still inside the
+callback, and the dispatcher decodes that copy with precompiled
+struct.Struct layouts, one per event id for the active SD API.
+
+Layouts of the leaf structs (adv report, hvx, ...) only contain naturally
+aligned 8/16-bit fields and are the same on every ABI. Where those structs
+sit inside ble_evt_t depends on union alignment (pointer size), so the base
+offsets are measured once from a SWIG ble_evt_t: a nested struct member
+proxy points into its parent, and the difference between the two addresses
+is the offset. Event ids without a layout keep using the proxy path.
+
+BLEDriver only takes this path with raw_events=True; compare both paths on
+the target with evt_decode_bench.py before turning it on.
+"""
+import collections
+import ctypes
+import logging
+import struct
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct("<HH")  # evt_id, evt_len (including the header)
+
+# Leaf struct layouts. ble_gap_addr_t is one byte of addr_type (SD v3+:
+# addr_id_peer:1, addr_type:7) plus six address bytes, LSB first.
+ADV_REPORT_V2 = struct.Struct("<B6sbB31s")  # peer_addr, rssi, scan_rsp:1 type:2 dlen:5, data
+ADV_REPORT_V5 = struct.Struct("<B6s7xbB31s")  # peer_addr, direct_addr, rssi, bits, data
+CONN_HANDLE = struct.Struct("<H")
+GATTC_HEADER = struct.Struct("<HHH")  # conn_handle, gatt_status, error_handle
+HVX = struct.Struct("<HBxH")  # handle, type, len; data follows
+REASON = struct.Struct("<B")
+RSSI = struct.Struct("<b")
+
+AdvReport = collections.namedtuple(
+    "AdvReport", "conn_handle addr_type addr rssi scan_rsp adv_type data"
+)
+Hvx = collections.namedtuple(
+    "Hvx", "conn_handle gatt_status error_handle handle hvx_type data"
+)
+Disconnected = collections.namedtuple("Disconnected", "conn_handle reason")
+Timeout = collections.namedtuple("Timeout", "conn_handle src")
+RssiChanged = collections.namedtuple("RssiChanged", "conn_handle rssi")
+
+RawEvent = collections.namedtuple("RawEvent", "evt_id data slot")
+
+
+def _address(swig_object):
+    return int(swig_object.this)
+
+
+class RawEventDecoder(object):
+    def __init__(self, driver, api_version, slots=256, slot_size=512):
+        self.api_version = api_version
+        self.slot_size = slot_size
+        self.slab = bytearray(slots * slot_size)
+        self._slab_view = memoryview(self.slab)
+        self._slab_address = ctypes.addressof(
+            (ctypes.c_char * len(self.slab)).from_buffer(self.slab)
+        )
+        self._free = collections.deque(range(slots))
+
+        self.captured = 0
+        self.overflow = 0  # captured into a fresh bytes object, slab full
+        self.decoders = dict()
+        self._calibrate(driver)
+
+    def _calibrate(self, driver):
+        evt = driver.ble_evt_t()
+        base = _address(evt)
+        gap = _address(evt.evt.gap_evt) - base
+        gap_params = {
+            name: _address(getattr(evt.evt.gap_evt.params, name)) - base
+            for name in ("adv_report", "disconnected", "timeout", "rssi_changed")
+        }
+        gattc = _address(evt.evt.gattc_evt) - base
+        hvx = _address(evt.evt.gattc_evt.params.hvx) - base
+
+        adv_layout = ADV_REPORT_V2 if self.api_version == 2 else ADV_REPORT_V5
+
+        def adv_report(view):
+            (conn_handle,) = CONN_HANDLE.unpack_from(view, gap)
+            addr_type, addr, rssi, bits, data = adv_layout.unpack_from(
+                view, gap_params["adv_report"]
+            )
+            if self.api_version != 2:
+                addr_type >>= 1
+            return AdvReport(
+                conn_handle, addr_type, addr, rssi, bits & 1, (bits >> 1) & 3, data[: bits >> 3]
+            )
+
+        def hvx_event(view):
+            conn_handle, gatt_status, error_handle = GATTC_HEADER.unpack_from(view, gattc)
+            handle, hvx_type, length = HVX.unpack_from(view, hvx)
+            start = hvx + HVX.size
+            return Hvx(
+                conn_handle, gatt_status, error_handle, handle, hvx_type,
+                bytes(view[start:start + length]),
+            )
+
+        def simple(layout, offset, factory):
+            def decode(view):
+                (conn_handle,) = CONN_HANDLE.unpack_from(view, gap)
+                (value,) = layout.unpack_from(view, offset)
+                return factory(conn_handle, value)
+
+            return decode
+
+        # evt_id -> (bytes the layout reads, decode function)
+        self.decoders = {
+            driver.BLE_GAP_EVT_ADV_REPORT: (gap_params["adv_report"] + adv_layout.size, adv_report),
+            driver.BLE_GATTC_EVT_HVX: (hvx + HVX.size, hvx_event),
+            driver.BLE_GAP_EVT_DISCONNECTED: (
+                gap_params["disconnected"] + 1,
+                simple(REASON, gap_params["disconnected"], Disconnected),
+            ),
+            driver.BLE_GAP_EVT_TIMEOUT: (
+                gap_params["timeout"] + 1,
+                simple(REASON, gap_params["timeout"], Timeout),
+            ),
+            driver.BLE_GAP_EVT_RSSI_CHANGED: (
+                gap_params["rssi_changed"] + 1,
+                simple(RSSI, gap_params["rssi_changed"], RssiChanged),
+            ),
+        }
+        logger.debug(
+            "Raw event offsets: gap %d, adv_report %d, gattc %d, hvx %d",
+            gap, gap_params["adv_report"], gattc, hvx,
+        )
+
+    def capture(self, ble_event):
+        """Copy a SWIG ble_evt_t that has a raw layout; None if it has none.
+
+        Called from the transport callback, so the bytes are taken while the
+        event buffer is still valid.
+        """
+        address = _address(ble_event)
+        evt_id, evt_len = HEADER.unpack(ctypes.string_at(address, HEADER.size))
+        entry = self.decoders.get(evt_id)
+        if entry is None or evt_len < entry[0]:
+            return None
+
+        self.captured += 1
+        try:
+            slot = self._free.popleft()
+        except IndexError:
+            slot = None
+        if slot is None or evt_len > self.slot_size:
+            if slot is not None:
+                self._free.append(slot)
+            self.overflow += 1
+            return RawEvent(evt_id, ctypes.string_at(address, evt_len), None)
+
+        offset = slot * self.slot_size
+        ctypes.memmove(self._slab_address + offset, address, evt_len)
+        return RawEvent(evt_id, self._slab_view[offset:offset + evt_len], slot)
+
+    def decode(self, raw_event):
+        return self.decoders[raw_event.evt_id][1](raw_event.data)
+
+    def release(self, raw_event):
+        if raw_event.slot is not None:
+            self._free.append(raw_event.slot)
+
+    def stats(self):
+        return {
+            "captured": self.captured,
+            "overflow": self.overflow,
+            "free_slots": len(self._free),
+        }
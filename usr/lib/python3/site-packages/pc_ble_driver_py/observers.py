@@ -370,3 +370,16 @@ class BLEAdapterObserver(object):
                 conn_handle, gen_conn_params_str(conn_params)
             )
         )
+
+
+class AdapterPoolObserver(object):
+    """
+    Observer used by AdapterPool. Receives the merged event stream of all
+    adapters in the pool; event.adapter_tag identifies the source adapter.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(AdapterPoolObserver, self).__init__()
+
+    def on_pool_event(self, pool, event):
+        pass
@@ -0,0 +1,508 @@
+"""
+Reconnect dropped peers and restore their sessions from cached state.
+
+ReconnectManager watches the links of the peers it manages and remembers
+what was set up on them: connection parameters, the server's ATT MTU, the
+PHY, every service, characteristic and descriptor discovered, and the CCCD
+subscriptions made through subscribe(). When a managed peer disconnects it
+is queued on a ConnectionScheduler again after a jittered exponential
+backoff (backoff_s doubling up to max_backoff_s, each delay drawn from
+[1 - jitter, 1] of that), and once connected the session is restored with
+as few RPCs as the link allows:
+
+  * the connection is requested with the cached parameters, so no
+    parameter update follows;
+  * one MTU exchange, only if the MTU was raised before;
+  * one PHY update, only if the link ran on another PHY than 1M;
+  * no discovery: the cached handles are reused once checked (below);
+  * one CCCD write per subscription.
+
+The peer's database may have changed while it was away, and a stale handle
+could point at an ordinary writable characteristic, so the handles are
+checked before anything is written. A peer with a Database Hash
+characteristic (0x2B2A) costs one read, compared against the hash seen
+before; otherwise, or if the hash was never seen or cannot be read, each
+subscribed handle is looked up with a one-handle descriptor discovery and
+must still be a CCCD (0x2902). On a mismatch, or a rejected CCCD write, the
+GATT cache of the session is dropped (session.gatt_valid is False) and the
+application has to discover again. Time from disconnect to restored session
+is kept per peer, see report().
+
+    scheduler = ConnectionScheduler(ble_driver)
+    manager = ReconnectManager(ble_driver, scheduler, on_restored=resume)
+    scheduler.start()
+    manager.start()
+    manager.manage(peer_addr)  # connects now if not connected
+    ...  # MTU exchange and discovery as usual, observed by the manager
+    manager.subscribe(peer_addr, cccd_handle)
+"""
+import collections
+import heapq
+import itertools
+import logging
+import random
+import time
+from threading import Event, Lock, Thread
+
+from pc_ble_driver_py.ble_driver import (
+    BLEUUID,
+    BLEGapPhys,
+    BLEGapRoles,
+    BLEGattcWriteParams,
+    BLEGattExecWriteFlag,
+    BLEGattStatusCode,
+    BLEGattWriteOperation,
+    driver,
+    nrf_sd_ble_api_ver,
+)
+from pc_ble_driver_py.exceptions import NordicSemiException
+from pc_ble_driver_py.observers import BLEDriverObserver
+
+logger = logging.getLogger(__name__)
+
+CCCD_NOTIFY = 0x0001
+CCCD_INDICATE = 0x0002
+DATABASE_HASH = 0x2B2A
+
+
+def _key(peer_addr):
+    return (getattr(peer_addr.addr_type, "value", peer_addr.addr_type), tuple(peer_addr.addr))
+
+
+class PeerSession(object):
+    def __init__(self, peer_addr, priority=0):
+        self.peer_addr = peer_addr
+        self.priority = priority
+        self.conn_handle = None
+        self.conn_params = None
+        self.att_mtu = None  # server MTU from the last exchange
+        self.phys = None  # (tx_phy, rx_phy)
+        self.services = collections.OrderedDict()  # start_handle -> BLEService
+        self.characteristics = collections.OrderedDict()  # handle_decl -> BLECharacteristic
+        self.descriptors = collections.OrderedDict()  # handle -> BLEDescriptor
+        self.subscriptions = collections.OrderedDict()  # cccd handle -> value
+        self.db_hash = None  # Database Hash value last read, bytes
+        self.gatt_valid = True
+        self.failures = 0  # connect attempts since the last restore
+        self.disconnected_at = None
+        self.reconnects = 0
+        self.restore_failures = 0
+        self.restore_times = collections.deque(maxlen=100)  # seconds, disconnect to restored
+        self.restore_rpcs = 0  # RPCs issued by the last restore, connect included
+        self.restoring = False
+        self._response = Event()
+        self._response_status = None
+        self._response_value = None
+
+    @property
+    def connected(self):
+        return self.conn_handle is not None
+
+    @property
+    def last_restore_s(self):
+        return self.restore_times[-1] if self.restore_times else None
+
+    @property
+    def hash_handle(self):
+        """Value handle of the peer's Database Hash characteristic, if discovered."""
+        for characteristic in self.characteristics.values():
+            uuid = characteristic.uuid
+            if uuid.value == DATABASE_HASH and uuid.base.type == driver.BLE_UUID_TYPE_BLE:
+                return characteristic.handle_value
+        return None
+
+    def forget_gatt(self):
+        self.services.clear()
+        self.characteristics.clear()
+        self.descriptors.clear()
+        self.db_hash = None
+        self.gatt_valid = False
+
+    def __str__(self):
+        last = self.last_restore_s
+        return "{} conn({}) mtu({}) phys({}) handles({}) subscriptions({}) reconnects({}) last_restore({})".format(
+            ":".join("{:02X}".format(b) for b in self.peer_addr.addr),
+            self.conn_handle,
+            self.att_mtu,
+            self.phys,
+            len(self.services) + len(self.characteristics) + len(self.descriptors),
+            len(self.subscriptions),
+            self.reconnects,
+            "-" if last is None else "{:.2f}s".format(last),
+        )
+
+
+class ReconnectManager(BLEDriverObserver):
+    def __init__(
+        self,
+        ble_driver,
+        scheduler,
+        att_mtu=None,
+        backoff_s=0.5,
+        max_backoff_s=30.0,
+        jitter=0.5,
+        attempt_timeout_s=10.0,
+        response_timeout_s=5.0,
+        on_restored=None,
+    ):
+        """att_mtu is the MTU this side is configured for; the restore asks
+        for min(att_mtu, cached server MTU). on_restored(session, ok) is
+        called from the restoring thread once a session is back, or has
+        failed to come back."""
+        super(ReconnectManager, self).__init__()
+        self.ble_driver = ble_driver
+        self.scheduler = scheduler
+        self.att_mtu = att_mtu
+        self.backoff_s = backoff_s
+        self.max_backoff_s = max_backoff_s
+        self.jitter = jitter
+        self.attempt_timeout_s = attempt_timeout_s
+        self.response_timeout_s = response_timeout_s
+        self.on_restored = on_restored
+
+        self.sessions = dict()  # key -> PeerSession
+        self._by_handle = dict()  # conn_handle -> PeerSession
+        self._due = []  # heap of (monotonic time, seq, key)
+        self._seq = itertools.count()
+        self._lock = Lock()
+        self._wakeup = Event()
+        self._stop = Event()
+        self._worker = None
+
+    def manage(self, peer_addr, priority=0, connect=True):
+        """Keep peer_addr connected from now on; returns its PeerSession."""
+        key = _key(peer_addr)
+        with self._lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = self.sessions[key] = PeerSession(peer_addr, priority)
+            session.priority = priority
+            if connect and not session.connected:
+                self._schedule(key, 0.0)
+        return session
+
+    def unmanage(self, peer_addr):
+        """Stop reconnecting peer_addr; the current link is left alone."""
+        with self._lock:
+            return self.sessions.pop(_key(peer_addr), None)
+
+    def session(self, peer_addr):
+        return self.sessions.get(_key(peer_addr))
+
+    def subscribe(self, peer_addr, cccd_handle, value=CCCD_NOTIFY):
+        """Enable notifications/indications and remember to do it again
+        after every reconnect; value 0 unsubscribes."""
+        session = self.sessions[_key(peer_addr)]
+        if value:
+            session.subscriptions[cccd_handle] = value
+        else:
+            session.subscriptions.pop(cccd_handle, None)
+        if session.connected:
+            self._write_cccd(session, cccd_handle, value)
+
+    def report(self):
+        """Per-peer restore statistics."""
+        with self._lock:
+            sessions = list(self.sessions.values())
+        return [
+            {
+                "peer": ":".join("{:02X}".format(b) for b in s.peer_addr.addr),
+                "connected": s.connected,
+                "reconnects": s.reconnects,
+                "restore_failures": s.restore_failures,
+                "last_restore_s": s.last_restore_s,
+                "mean_restore_s": sum(s.restore_times) / len(s.restore_times) if s.restore_times else None,
+                "restore_rpcs": s.restore_rpcs,
+                "gatt_valid": s.gatt_valid,
+            }
+            for s in sessions
+        ]
+
+    def start(self):
+        self.ble_driver.observer_register(self)
+        self._stop.clear()
+        self._worker = Thread(target=self._run, name="ReconnectManager")
+        self._worker.daemon = True
+        self._worker.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._worker:
+            self._worker.join()
+            self._worker = None
+        self.ble_driver.observer_unregister(self)
+
+    # Events: learn the session state, and answer a running restore
+
+    def _session_for(self, conn_handle):
+        return self._by_handle.get(conn_handle)
+
+    def on_gap_evt_connected(self, ble_driver, conn_handle, peer_addr, role, conn_params):
+        if role != BLEGapRoles.central:
+            return
+        with self._lock:
+            session = self.sessions.get(_key(peer_addr))
+            if session is None:
+                return
+            session.conn_handle = conn_handle
+            session.conn_params = conn_params
+            self._by_handle[conn_handle] = session
+            restore = session.disconnected_at is not None and not session.restoring
+            session.restoring = restore
+        if restore:
+            thread = Thread(target=self._restore, args=(session,), name="SessionRestore")
+            thread.daemon = True
+            thread.start()
+
+    def on_gap_evt_disconnected(self, ble_driver, conn_handle, reason):
+        with self._lock:
+            session = self._by_handle.pop(conn_handle, None)
+            if session is None:
+                return
+            session.conn_handle = None
+            session.disconnected_at = time.monotonic()
+            session._response_status = None
+            session._response.set()  # wakes a restore waiting on this link
+            if self.sessions.get(_key(session.peer_addr)) is session:
+                self._schedule(_key(session.peer_addr), self._backoff(session))
+        logger.info("Peer disconnected (%s), reconnecting: %s", reason, session)
+
+    def on_gap_evt_conn_param_update(self, ble_driver, conn_handle, conn_params):
+        session = self._session_for(conn_handle)
+        if session:
+            session.conn_params = conn_params
+
+    def on_gap_evt_phy_update(self, ble_driver, conn_handle, status, tx_phy, rx_phy):
+        session = self._session_for(conn_handle)
+        if session and getattr(status, "name", status) == "success":
+            session.phys = (tx_phy, rx_phy)
+
+    def on_gattc_evt_exchange_mtu_rsp(self, ble_driver, conn_handle, status, att_mtu):
+        session = self._session_for(conn_handle)
+        if session is None:
+            return
+        if status == BLEGattStatusCode.success:
+            session.att_mtu = att_mtu
+        self._respond(session, status)
+
+    def on_gattc_evt_write_rsp(
+        self, ble_driver, conn_handle, status, error_handle, attr_handle, write_op, offset, data
+    ):
+        session = self._session_for(conn_handle)
+        if session:
+            self._respond(session, status)
+
+    def on_gattc_evt_prim_srvc_disc_rsp(self, ble_driver, conn_handle, status, services):
+        session = self._session_for(conn_handle)
+        if session and status == BLEGattStatusCode.success:
+            for service in services:
+                session.services[service.start_handle] = service
+            session.gatt_valid = True
+
+    def on_gattc_evt_char_disc_rsp(self, ble_driver, conn_handle, status, characteristics):
+        session = self._session_for(conn_handle)
+        if session and status == BLEGattStatusCode.success:
+            for characteristic in characteristics:
+                session.characteristics[characteristic.handle_decl] = characteristic
+
+    def on_gattc_evt_desc_disc_rsp(self, ble_driver, conn_handle, status, descriptors):
+        session = self._session_for(conn_handle)
+        if session is None:
+            return
+        if status == BLEGattStatusCode.success:
+            for descriptor in descriptors:
+                session.descriptors[descriptor.handle] = descriptor
+        self._respond(session, status, descriptors)
+
+    def on_gattc_evt_read_rsp(
+        self, ble_driver, conn_handle, status, error_handle, attr_handle, offset, data
+    ):
+        session = self._session_for(conn_handle)
+        if session is None:
+            return
+        if status == BLEGattStatusCode.success and offset == 0 and attr_handle == session.hash_handle:
+            value = bytes(data)
+            if session.restoring:
+                self._respond(session, status, value)
+                return
+            session.db_hash = value
+        self._respond(session, status)
+
+    def _respond(self, session, status, value=None):
+        if session.restoring:
+            session._response_status = status
+            session._response_value = value
+            session._response.set()
+
+    # Reconnecting
+
+    def _backoff(self, session):
+        delay = min(self.max_backoff_s, self.backoff_s * (2 ** session.failures))
+        return random.uniform(delay * (1.0 - self.jitter), delay)
+
+    def _schedule(self, key, delay):
+        heapq.heappush(self._due, (time.monotonic() + delay, next(self._seq), key))
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wakeup.clear()
+            due = []
+            with self._lock:
+                now = time.monotonic()
+                while self._due and self._due[0][0] <= now:
+                    due.append(heapq.heappop(self._due)[2])
+                wait = self._due[0][0] - now if self._due else 1.0
+            for key in due:
+                self._reconnect(key)
+            self._wakeup.wait(min(wait, 1.0))
+
+    def _reconnect(self, key):
+        with self._lock:
+            session = self.sessions.get(key)
+            if session is None or session.connected:
+                return
+        self.scheduler.connect(
+            session.peer_addr,
+            priority=session.priority,
+            timeout_s=self.attempt_timeout_s,
+            conn_params=session.conn_params,
+            callback=self._connect_done,
+        )
+
+    def _connect_done(self, request):
+        if request.conn_handle is not None or request.error == "cancelled":
+            return
+        key = _key(request.peer_addr)
+        with self._lock:
+            session = self.sessions.get(key)
+            if session is None or session.connected:
+                return
+            session.failures += 1
+            delay = self._backoff(session)
+            self._schedule(key, delay)
+        logger.debug("Reconnect failed (%s), next attempt in %.1fs: %s", request.error, delay, session)
+
+    # Restoring
+
+    def _request(self, session, call, *args):
+        """Run one ATT request and wait for its response; the GATT status,
+        or None if the link went down or nothing came back."""
+        conn_handle = session.conn_handle
+        if conn_handle is None:
+            return None
+        session._response.clear()
+        session._response_status = None
+        session._response_value = None
+        call(conn_handle, *args)
+        session.restore_rpcs += 1
+        if not session._response.wait(self.response_timeout_s):
+            return None
+        return session._response_status
+
+    def _write_cccd(self, session, cccd_handle, value):
+        params = BLEGattcWriteParams(
+            BLEGattWriteOperation.write_req,
+            BLEGattExecWriteFlag.unused,
+            cccd_handle,
+            [value & 0xFF, value >> 8],
+            0,
+        )
+        if session.restoring:
+            return self._request(session, self.ble_driver.ble_gattc_write, params)
+        self.ble_driver.ble_gattc_write(session.conn_handle, params)
+        return BLEGattStatusCode.success
+
+    def _restore(self, session):
+        session.restore_rpcs = 1  # the connect
+        ok = False
+        try:
+            ok = self._restore_session(session)
+        except NordicSemiException as e:
+            logger.error("Session restore failed: %s: %s", session, e)
+        finally:
+            with self._lock:
+                session.restoring = False
+                if ok:
+                    session.restore_times.append(time.monotonic() - session.disconnected_at)
+                    session.reconnects += 1
+                    session.failures = 0
+                    session.disconnected_at = None
+                else:
+                    session.restore_failures += 1
+        logger.info("Session %s: %s", "restored" if ok else "not restored", session)
+        if self.on_restored:
+            try:
+                self.on_restored(session, ok)
+            except Exception as ex:
+                logger.exception("Exception in on_restored: {}".format(ex))
+
+    def _restore_session(self, session):
+        if session.att_mtu and session.att_mtu > driver.BLE_GATT_ATT_MTU_DEFAULT:
+            mtu = session.att_mtu if self.att_mtu is None else min(self.att_mtu, session.att_mtu)
+            if mtu > driver.BLE_GATT_ATT_MTU_DEFAULT:
+                if self._request(session, self.ble_driver.ble_gattc_exchange_mtu_req, mtu) is None:
+                    return False
+
+        if nrf_sd_ble_api_ver >= 5 and session.phys and session.phys != (driver.BLE_GAP_PHY_1MBPS,) * 2:
+            # A GAP procedure, not an ATT request: no need to wait for it
+            self.ble_driver.ble_gap_phy_update(session.conn_handle, BLEGapPhys(*session.phys))
+            session.restore_rpcs += 1
+
+        valid = self._check_handles(session)
+        if valid is None:
+            return False
+        if not valid:
+            logger.warning("Peer database changed, cached handles dropped: %s", session)
+            session.forget_gatt()
+            session.subscriptions.clear()
+            return False
+
+        for cccd_handle, value in list(session.subscriptions.items()):
+            status = self._write_cccd(session, cccd_handle, value)
+            if status is None:
+                return False
+            if status != BLEGattStatusCode.success:
+                logger.warning("CCCD %d rejected (%s), cached handles dropped: %s", cccd_handle, status, session)
+                session.forget_gatt()
+                session.subscriptions.clear()
+                return False
+        return session.connected
+
+    def _read_hash(self, session):
+        """Database Hash value, or None if it could not be read."""
+        status = self._request(session, self.ble_driver.ble_gattc_read, session.hash_handle, 0)
+        if status != BLEGattStatusCode.success:
+            return None
+        return session._response_value
+
+    def _check_handles(self, session):
+        """True if the cached handles still match the peer, False if not,
+        None if the link went down or the peer did not answer."""
+        if not session.subscriptions:
+            return True
+        hash_handle = session.hash_handle
+        if hash_handle is not None and session.db_hash is not None:
+            value = self._read_hash(session)
+            if not session.connected:
+                return None
+            if value is not None:
+                return value == session.db_hash
+
+        for cccd_handle in session.subscriptions:
+            status = self._request(session, self.ble_driver.ble_gattc_desc_disc, cccd_handle, cccd_handle)
+            if status is None:
+                return None
+            found = session._response_value or []
+            if status != BLEGattStatusCode.success or not any(
+                d.handle == cccd_handle and d.uuid.value == BLEUUID.Standard.cccd
+                and d.uuid.base.type == driver.BLE_UUID_TYPE_BLE
+                for d in found
+            ):
+                return False
+
+        if hash_handle is not None:
+            # Learn the hash now, so the next restore needs a single read
+            session.db_hash = self._read_hash(session)
+        return True
@@ -0,0 +1,338 @@
+"""
+Columnar scan history.
+
+ScanHistory is an observer that appends every advertising report to column
+arrays (timestamp, packed address, RSSI, adv type, payload offset and a
+payload blob) and writes them out as chunk files, one directory per day
+and never more than one time partition (an hour by default) per chunk:
+
+    <root>/20261019/1760871600-1760872512345-1.col   (partition-first ms-seq)
+
+A chunk is the column arrays back to back followed by a footer index: row
+count, time range, and offset/length of every column, plus a sorted column
+of the distinct addresses in the chunk. ScanHistoryReader picks chunks by
+file name (partition) and footer (time range, addresses) and then reads
+only the columns a query asks for:
+
+    history = ScanHistory("/data/scan_history")
+    ble_driver.observer_register(history)
+    ...
+    history.close()
+
+    reader = ScanHistoryReader("/data/scan_history")
+    rows = reader.query(time.time() - 7 * 86400, addr="C0:11:22:33:44:55",
+                        columns=("ts", "rssi"))
+
+Columns are stored little endian, which is the native order of both the
+dongle host and the machines the files are read on.
+"""
+import array
+import bisect
+import logging
+import os
+import queue
+import struct
+import sys
+import time
+from threading import Lock, Thread
+
+from pc_ble_driver_py.observers import BLEDriverObserver
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"SCH1"
+FOOTER_HEAD = struct.Struct("<IIdd")  # rows, columns, t_min, t_max
+COLUMN_ENTRY = struct.Struct("<16s1s7xQQ")  # name, typecode, offset, nbytes
+TRAILER = struct.Struct("<I4s")  # footer length, magic
+
+# name -> array typecode. payload_off has rows + 1 entries, payload_off[i]
+# to payload_off[i + 1] is row i in the payload blob.
+COLUMNS = (
+    ("ts", "d"),
+    ("addr", "Q"),
+    ("rssi", "b"),
+    ("adv_type", "b"),
+    ("payload_off", "I"),
+    ("payload", "B"),
+)
+INDEX_COLUMN = ("addrs", "Q")  # distinct 48-bit addresses, sorted
+
+ADDR_MASK = (1 << 48) - 1
+NO_ADV_TYPE = -1  # scan responses have no adv type
+
+
+def pack_addr(addr, addr_type=0):
+    """addr as MSB-first bytes/list (BLEGapAddr.addr), "AA:BB:..." or int."""
+    if isinstance(addr, str):
+        addr = bytes.fromhex(addr.replace(":", ""))
+    if not isinstance(addr, int):
+        addr = int.from_bytes(bytes(addr), "big")
+    return (addr & ADDR_MASK) | (int(addr_type) << 48)
+
+
+def unpack_addr(packed):
+    """(addr_type, "AA:BB:CC:DD:EE:FF") from a packed address."""
+    return packed >> 48, ":".join(
+        "{:02X}".format(b) for b in (packed & ADDR_MASK).to_bytes(6, "big")
+    )
+
+
+def encode_adv_data(adv_data):
+    """Serialize BLEAdvData records back to AD structures."""
+    payload = bytearray()
+    for ad_type, value in adv_data.records.items():
+        value = bytes(value)
+        payload.append(len(value) + 1)
+        payload.append(getattr(ad_type, "value", ad_type))
+        payload += value
+    return payload
+
+
+class ColumnSet(object):
+    def __init__(self, partition):
+        self.partition = partition
+        self.columns = {name: array.array(code) for name, code in COLUMNS}
+        self.columns["payload_off"].append(0)
+        self.rows = 0
+
+    def append(self, ts, addr, rssi, adv_type, payload):
+        c = self.columns
+        c["ts"].append(ts)
+        c["addr"].append(addr)
+        c["rssi"].append(rssi)
+        c["adv_type"].append(adv_type)
+        c["payload"].frombytes(payload)
+        c["payload_off"].append(len(c["payload"]))
+        self.rows += 1
+
+
+def write_chunk(path, column_set):
+    """Write column_set to path atomically."""
+    columns = dict(column_set.columns)
+    columns[INDEX_COLUMN[0]] = array.array(
+        INDEX_COLUMN[1], sorted({a & ADDR_MASK for a in columns["addr"]})
+    )
+    ts = columns["ts"]
+
+    entries = []
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        for name, code in COLUMNS + (INDEX_COLUMN,):
+            data = columns[name]
+            if sys.byteorder == "big":
+                data = array.array(code, data)
+                data.byteswap()
+            raw = data.tobytes()
+            entries.append(COLUMN_ENTRY.pack(name.encode(), code.encode(), f.tell(), len(raw)))
+            f.write(raw)
+        footer = FOOTER_HEAD.pack(column_set.rows, len(entries), min(ts), max(ts)) + b"".join(entries)
+        f.write(footer)
+        f.write(TRAILER.pack(len(footer), MAGIC))
+    os.replace(tmp, path)
+
+
+class Chunk(object):
+    """A chunk file opened for reading; columns are read on demand."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._file.seek(-TRAILER.size, os.SEEK_END)
+        footer_len, magic = TRAILER.unpack(self._file.read(TRAILER.size))
+        if magic != MAGIC:
+            raise ValueError("{}: not a scan history chunk".format(path))
+        self._file.seek(-TRAILER.size - footer_len, os.SEEK_END)
+        footer = self._file.read(footer_len)
+        self.rows, count, self.t_min, self.t_max = FOOTER_HEAD.unpack_from(footer)
+        self.entries = dict()
+        for i in range(count):
+            name, code, offset, nbytes = COLUMN_ENTRY.unpack_from(
+                footer, FOOTER_HEAD.size + i * COLUMN_ENTRY.size
+            )
+            self.entries[name.rstrip(b"\0").decode()] = (code.decode(), offset, nbytes)
+        self._addrs = None
+
+    def column(self, name):
+        code, offset, nbytes = self.entries[name]
+        self._file.seek(offset)
+        data = array.array(code)
+        data.frombytes(self._file.read(nbytes))
+        if sys.byteorder == "big":
+            data.byteswap()
+        return data
+
+    def has_addr(self, addr):
+        if self._addrs is None:
+            self._addrs = self.column(INDEX_COLUMN[0])
+        addr &= ADDR_MASK
+        i = bisect.bisect_left(self._addrs, addr)
+        return i < len(self._addrs) and self._addrs[i] == addr
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ScanHistory(BLEDriverObserver):
+    def __init__(self, root, partition_s=3600, chunk_rows=65536, flush_s=60.0, clock=time.time):
+        """Chunks close after chunk_rows reports, flush_s seconds, or at the
+        end of a partition, whichever comes first. Files are written by a
+        background thread so the event dispatcher never waits for storage."""
+        super(ScanHistory, self).__init__()
+        self.root = root
+        self.partition_s = partition_s
+        self.chunk_rows = chunk_rows
+        self.flush_s = flush_s
+        self.clock = clock
+
+        self.rows = 0
+        self.chunks = 0
+        self.write_errors = 0
+
+        self._lock = Lock()
+        self._current = None
+        self._opened = None
+        self._seq = 0
+        self._pending = queue.Queue()
+        self._writer = Thread(target=self._write_loop, name="ScanHistoryWriter")
+        self._writer.daemon = True
+        self._writer.start()
+
+    def on_gap_evt_adv_report(self, ble_driver, conn_handle, peer_addr, rssi, adv_type, adv_data):
+        addr_type = getattr(peer_addr.addr_type, "value", peer_addr.addr_type)
+        self.append(
+            self.clock(),
+            pack_addr(peer_addr.addr, addr_type),
+            rssi,
+            NO_ADV_TYPE if adv_type is None else adv_type.value,
+            encode_adv_data(adv_data),
+        )
+
+    def append(self, ts, addr, rssi, adv_type, payload):
+        partition = int(ts // self.partition_s) * self.partition_s
+        with self._lock:
+            current = self._current
+            if current is not None and (
+                current.partition != partition
+                or current.rows >= self.chunk_rows
+                or ts - self._opened >= self.flush_s
+            ):
+                self._hand_off()
+                current = None
+            if current is None:
+                current = self._current = ColumnSet(partition)
+                self._opened = ts
+            current.append(ts, addr, rssi, adv_type, payload)
+            self.rows += 1
+
+    def _hand_off(self):
+        self._pending.put(self._current)
+        self._current = None
+
+    def flush(self, wait=True):
+        """Close the open chunk; with wait, return once it is on disk."""
+        with self._lock:
+            if self._current is not None:
+                self._hand_off()
+        if wait:
+            self._pending.join()
+
+    def close(self):
+        self.flush()
+        self._pending.put(None)
+        self._writer.join()
+
+    def _write_loop(self):
+        while True:
+            column_set = self._pending.get()
+            try:
+                if column_set is None:
+                    return
+                self._write(column_set)
+            finally:
+                self._pending.task_done()
+
+    def _write(self, column_set):
+        first = column_set.columns["ts"][0]
+        directory = os.path.join(self.root, time.strftime("%Y%m%d", time.gmtime(column_set.partition)))
+        self._seq += 1
+        path = os.path.join(
+            directory, "{}-{}-{}.col".format(column_set.partition, int(first * 1000), self._seq)
+        )
+        try:
+            os.makedirs(directory, exist_ok=True)
+            write_chunk(path, column_set)
+        except OSError as e:
+            self.write_errors += 1
+            logger.error("Scan history: dropping %d rows, %s", column_set.rows, e)
+            return
+        self.chunks += 1
+        logger.debug("Scan history: %d rows to %s", column_set.rows, path)
+
+
+class ScanHistoryReader(object):
+    def __init__(self, root, partition_s=3600):
+        self.root = root
+        self.partition_s = partition_s
+
+    def chunk_paths(self, start=None, end=None):
+        """Chunk files whose partition overlaps [start, end], oldest first."""
+        if not os.path.isdir(self.root):
+            return []
+        paths = []
+        for day in sorted(os.listdir(self.root)):
+            directory = os.path.join(self.root, day)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if not name.endswith(".col"):
+                    continue
+                partition = int(name.split("-", 1)[0])
+                if start is not None and partition + self.partition_s <= start:
+                    continue
+                if end is not None and partition > end:
+                    continue
+                paths.append((partition, name, os.path.join(directory, name)))
+        return [path for _, _, path in sorted(paths)]
+
+    def query(self, start=None, end=None, addr=None, columns=("ts", "addr", "rssi")):
+        """Rows with start <= ts <= end (and the given address) as a dict of
+        lists keyed by column; the "payload" column yields bytes per row."""
+        wanted = [c for c in columns if c != "payload"]
+        result = {name: [] for name in columns}
+        if addr is not None and not isinstance(addr, int):
+            addr = pack_addr(addr)
+        for path in self.chunk_paths(start, end):
+            with Chunk(path) as chunk:
+                if start is not None and chunk.t_max < start:
+                    continue
+                if end is not None and chunk.t_min > end:
+                    continue
+                if addr is not None and not chunk.has_addr(addr):
+                    continue
+
+                # Only read ts / addr when they are needed to select rows
+                rows = range(chunk.rows)
+                loaded = dict()
+                if (start is not None and chunk.t_min < start) or (end is not None and chunk.t_max > end):
+                    ts = loaded["ts"] = chunk.column("ts")
+                    rows = [i for i in rows if (start is None or ts[i] >= start) and (end is None or ts[i] <= end)]
+                if addr is not None:
+                    packed = loaded["addr"] = chunk.column("addr")
+                    masked = addr & ADDR_MASK
+                    rows = [i for i in rows if packed[i] & ADDR_MASK == masked]
+
+                for name in wanted:
+                    data = loaded.get(name) or chunk.column(name)
+                    result[name].extend(data[i] for i in rows)
+                if "payload" in result:
+                    offsets = chunk.column("payload_off")
+                    blob = chunk.column("payload").tobytes()
+                    result["payload"].extend(blob[offsets[i]:offsets[i + 1]] for i in rows)
+        return result
@@ -0,0 +1,258 @@
+"""
+Passive scanning with short active bursts for incomplete devices.
+
+Active scanning sends a scan request to every advertiser, roughly doubling
+the reports crossing the serial link. PromotingScanner scans passively and
+keeps a record per device; devices whose primary advertisement lacks one of
+the required AD types (a name, by default) are queued, and only while that
+queue is non-empty does the scanner switch to active scanning for a short
+burst. A burst puts up to BLE_GAP_WHITELIST_ADDR_MAX_COUNT queued devices in
+the SoftDevice whitelist and scans with it, so only they are sent scan
+requests and only their reports cross the serial link; should the
+whitelist update fail, the burst scans everybody. Scan responses from
+devices that are not queued are not merged into the device records, and a
+device that never answers within max_attempts bursts is given up on.
+
+    scanner = PromotingScanner(ble_driver, BLEGapScanParams(100, 50, 0))
+    scanner.start()
+    ...
+    scanner.stop()
+    print(scanner.stats)
+"""
+import collections
+import logging
+import time
+from threading import Event, Lock, Thread
+
+from pc_ble_driver_py.ble_driver import BLEAdvData, BLEGapScanParams, BLEGapTimeoutSrc, driver
+from pc_ble_driver_py.exceptions import NordicSemiException
+from pc_ble_driver_py.observers import BLEDriverObserver
+
+logger = logging.getLogger(__name__)
+
+NAME_TYPES = (BLEAdvData.Types.complete_local_name, BLEAdvData.Types.short_local_name)
+
+
+class DeviceRecord(object):
+    def __init__(self, peer_addr):
+        self.peer_addr = peer_addr
+        self.rssi = None
+        self.records = dict()
+        self.adv_count = 0
+        self.scan_rsp_count = 0
+        self.attempts = 0
+        self.first_seen = time.monotonic()
+        self.completed = None
+
+    @property
+    def name(self):
+        for ad_type in NAME_TYPES:
+            if ad_type in self.records:
+                return bytes(self.records[ad_type]).decode("utf-8", "replace")
+        return None
+
+    def __str__(self):
+        return "{} rssi({}) name({}) records({})".format(
+            ":".join("{:02X}".format(b) for b in self.peer_addr.addr),
+            self.rssi,
+            self.name,
+            len(self.records),
+        )
+
+
+class PromotionStats(object):
+    def __init__(self):
+        self.passive_reports = 0
+        self.active_reports = 0
+        self.scan_rsp_used = 0
+        self.scan_rsp_dropped = 0
+        self.bursts = 0
+        self.active_time_s = 0.0
+        self.completed = 0
+        self.abandoned = 0
+
+    def __str__(self):
+        return (
+            "passive_reports({0.passive_reports}) active_reports({0.active_reports}) "
+            "scan_rsp used({0.scan_rsp_used}) dropped({0.scan_rsp_dropped}) "
+            "bursts({0.bursts}) active_time({0.active_time_s:.1f}s) "
+            "completed({0.completed}) abandoned({0.abandoned})".format(self)
+        )
+
+
+class PromotingScanner(BLEDriverObserver):
+    def __init__(
+        self,
+        ble_driver,
+        scan_params=None,
+        required=NAME_TYPES,
+        burst_s=1.0,
+        cooldown_s=4.0,
+        max_attempts=3,
+    ):
+        """required lists AD types of which at least one must be present for
+        a device record to be complete; pass a callable taking a
+        DeviceRecord instead for anything more involved."""
+        super(PromotingScanner, self).__init__()
+        self.ble_driver = ble_driver
+        self.scan_params = scan_params or BLEGapScanParams(interval_ms=100, window_ms=50, timeout_s=0)
+        self.required = required
+        self.burst_s = burst_s
+        self.cooldown_s = cooldown_s
+        self.max_attempts = max_attempts
+
+        self.devices = collections.OrderedDict()
+        self.pending = set()
+        self.stats = PromotionStats()
+        self.active = False
+        self.filtered = False  # the running scan uses the whitelist
+        self.scanning = False
+        self._lock = Lock()
+        self._restart = Event()  # scan timed out, the worker starts it again
+        self._stop = Event()
+        self._worker = None
+
+    def is_complete(self, device):
+        if callable(self.required):
+            return self.required(device)
+        return any(ad_type in device.records for ad_type in self.required)
+
+    def start(self):
+        self.ble_driver.observer_register(self)
+        self._stop.clear()
+        self._restart.clear()
+        self._scan(active=False)  # the worker retries if this fails
+        self._worker = Thread(target=self._run, name="ScanPromotion")
+        self._worker.daemon = True
+        self._worker.start()
+
+    def stop(self):
+        self._stop.set()
+        self._restart.set()
+        if self._worker:
+            self._worker.join()
+            self._worker = None
+        self._scan_stop()
+        self.ble_driver.observer_unregister(self)
+
+    def on_gap_evt_adv_report(self, ble_driver, conn_handle, peer_addr, rssi, adv_type, adv_data):
+        key = (peer_addr.addr_type, tuple(peer_addr.addr))
+        scan_rsp = adv_type is None
+        with self._lock:
+            if self.active:
+                self.stats.active_reports += 1
+            else:
+                self.stats.passive_reports += 1
+
+            if scan_rsp and key not in self.pending:
+                self.stats.scan_rsp_dropped += 1
+                return
+
+            device = self.devices.get(key)
+            if device is None:
+                device = self.devices[key] = DeviceRecord(peer_addr)
+            device.rssi = rssi
+            device.records.update(adv_data.records)
+            if scan_rsp:
+                device.scan_rsp_count += 1
+                self.stats.scan_rsp_used += 1
+            else:
+                device.adv_count += 1
+
+            if device.completed is None:
+                if self.is_complete(device):
+                    device.completed = time.monotonic()
+                    if key in self.pending:
+                        self.pending.discard(key)
+                        self.stats.completed += 1
+                elif device.attempts < self.max_attempts:
+                    self.pending.add(key)
+
+    def on_gap_evt_timeout(self, ble_driver, conn_handle, src):
+        # Restarting here could land between the worker's scan stop and
+        # whitelist update; leave it to the worker
+        if src == BLEGapTimeoutSrc.scan and not self._stop.is_set():
+            self._restart.set()
+
+    def _run(self):
+        next_burst = time.monotonic() + self.cooldown_s
+        while not self._stop.is_set():
+            self._restart.wait(max(0.0, next_burst - time.monotonic()))
+            if self._stop.is_set():
+                break
+            if self._restart.is_set() or not self.scanning:
+                # Timed out, or the last start failed
+                self._restart.clear()
+                self._scan(active=False)
+            if time.monotonic() < next_burst:
+                continue
+            next_burst = time.monotonic() + self.cooldown_s
+            with self._lock:
+                if not self.pending:
+                    continue
+                burst = list(self.pending)[:driver.BLE_GAP_WHITELIST_ADDR_MAX_COUNT]
+                addresses = [self.devices[key].peer_addr for key in burst]
+
+            start = time.monotonic()
+            self._scan_stop()
+            try:
+                # The whitelist cannot change under a running scan
+                self.ble_driver.ble_gap_whitelist_set(addresses)
+                use_whitelist = True
+            except NordicSemiException as e:
+                logger.warning("Whitelist for scan burst failed, scanning unfiltered: %s", e)
+                use_whitelist = False
+            if not self._scan(active=True, use_whitelist=use_whitelist):
+                # Skip this burst; the devices stay queued for the next one
+                self._scan(active=False)
+                continue
+            self._stop.wait(self.burst_s)
+            self._scan_stop()
+            self._restart.clear()  # a timeout during the burst is covered by this
+            if not self._stop.is_set():
+                self._scan(active=False)
+            next_burst = time.monotonic() + self.cooldown_s
+            self.stats.active_time_s += time.monotonic() - start
+            self.stats.bursts += 1
+
+            with self._lock:
+                for key in burst:
+                    device = self.devices[key]
+                    if device.completed is not None or key not in self.pending:
+                        continue
+                    device.attempts += 1
+                    if device.attempts >= self.max_attempts:
+                        self.pending.discard(key)
+                        self.stats.abandoned += 1
+            logger.debug("Scan burst for %d devices: %s", len(burst), self.stats)
+
+    def _scan(self, active, use_whitelist=False):
+        """Start scanning; False (logged) if the SoftDevice refused, e.g.
+        while a connection is being initiated."""
+        params = self.scan_params
+        with self._lock:
+            self.active = active
+            self.filtered = use_whitelist
+        try:
+            self.ble_driver.ble_gap_scan_start(
+                BLEGapScanParams(
+                    interval_ms=params.interval_ms,
+                    window_ms=params.window_ms,
+                    timeout_s=params.timeout_s,
+                    active=active,
+                    use_whitelist=use_whitelist,
+                )
+            )
+        except NordicSemiException as e:
+            logger.error("Scan start failed: %s", e)
+            self.scanning = False
+            return False
+        self.scanning = True
+        return True
+
+    def _scan_stop(self):
+        self.scanning = False
+        try:
+            self.ble_driver.ble_gap_scan_stop()
+        except NordicSemiException:
+            pass  # not scanning
@@ -0,0 +1,196 @@
+"""
+Adaptive scan duty cycle on top of ble_gap_scan_start/ble_gap_scan_stop.
+
+Instead of a fixed BLEGapScanParams for the whole scan, the scheduler walks a
+ladder of scan settings, from a light passive duty cycle up to continuous
+active scanning. Every period it looks at
+
+  * how many new devices were found (is more radio time paying off?),
+  * how many advertising reports arrived (serial link load), and
+  * how far behind the event dispatcher is (ble_event_queue backlog),
+
+steps down immediately when the link or dispatcher is saturated, steps up
+while discovery is still yielding new devices and there is headroom, and
+relaxes when discovery has gone idle.
+
+    scheduler = AdaptiveScanScheduler(ble_driver)
+    scheduler.start()
+    ...
+    scheduler.stop()
+"""
+import collections
+import logging
+from threading import Event, Lock, Thread
+
+from pc_ble_driver_py.ble_driver import BLEGapScanParams, BLEGapTimeoutSrc
+from pc_ble_driver_py.exceptions import NordicSemiException
+from pc_ble_driver_py.observers import BLEDriverObserver
+
+logger = logging.getLogger(__name__)
+
+# (interval_ms, window_ms, active), lightest first. Scan responses roughly
+# double the report rate, so active scanning only starts once passive
+# scanning runs at a high duty cycle.
+DEFAULT_LEVELS = [
+    (200, 20, False),
+    (160, 40, False),
+    (100, 50, False),
+    (100, 90, False),
+    (100, 50, True),
+    (100, 90, True),
+    (100, 100, True),
+]
+
+
+class ScanLevelStats(object):
+    def __init__(self, level, reports, new_devices, backlog, period_s):
+        self.level = level
+        self.reports = reports
+        self.new_devices = new_devices
+        self.backlog = backlog
+        self.period_s = period_s
+
+    @property
+    def report_rate(self):
+        return self.reports / self.period_s
+
+    @property
+    def discovery_rate(self):
+        return self.new_devices / self.period_s
+
+    def __str__(self):
+        return "level({0.level}) reports/s({1:.1f}) new/s({2:.2f}) backlog({0.backlog})".format(
+            self, self.report_rate, self.discovery_rate
+        )
+
+
+class AdaptiveScanScheduler(BLEDriverObserver):
+    def __init__(
+        self,
+        ble_driver,
+        levels=None,
+        start_level=2,
+        period_s=2.0,
+        max_report_rate=400.0,
+        backlog_high=200,
+        backlog_low=20,
+        step_up_discovery_rate=0.5,
+        idle_periods=5,
+    ):
+        super(AdaptiveScanScheduler, self).__init__()
+        self.ble_driver = ble_driver
+        self.levels = levels or DEFAULT_LEVELS
+        self.level = min(start_level, len(self.levels) - 1)
+        self.period_s = period_s
+        self.max_report_rate = max_report_rate
+        self.backlog_high = backlog_high
+        self.backlog_low = backlog_low
+        self.step_up_discovery_rate = step_up_discovery_rate
+        self.idle_periods = idle_periods
+
+        self.seen = set()
+        self.history = collections.deque(maxlen=100)
+        self._reports = 0
+        self._new_devices = 0
+        self._idle = 0
+        self.scanning = False
+        self._lock = Lock()
+        # The worker and the event thread (scan timeout) both restart the scan
+        self._apply_lock = Lock()
+        self._stop = Event()
+        self._worker = None
+
+    def scan_params(self, level=None):
+        interval_ms, window_ms, active = self.levels[self.level if level is None else level]
+        return BLEGapScanParams(interval_ms=interval_ms, window_ms=window_ms, timeout_s=0, active=active)
+
+    def start(self):
+        self.ble_driver.observer_register(self)
+        self._stop.clear()
+        self._apply(self.level)
+        self._worker = Thread(target=self._run, name="ScanScheduler")
+        self._worker.daemon = True
+        self._worker.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._worker:
+            self._worker.join()
+            self._worker = None
+        try:
+            self.ble_driver.ble_gap_scan_stop()
+        except NordicSemiException:
+            pass
+        self.ble_driver.observer_unregister(self)
+
+    def on_gap_evt_adv_report(self, ble_driver, conn_handle, peer_addr, rssi, adv_type, adv_data):
+        key = (peer_addr.addr_type, tuple(peer_addr.addr))
+        with self._lock:
+            self._reports += 1
+            if key not in self.seen:
+                self.seen.add(key)
+                self._new_devices += 1
+
+    def on_gap_evt_timeout(self, ble_driver, conn_handle, src):
+        # The scheduler scans without a timeout, but restart if the
+        # SoftDevice stopped the scan anyway.
+        if src == BLEGapTimeoutSrc.scan and not self._stop.is_set():
+            self._apply(self.level, restart=False)
+
+    def _run(self):
+        while not self._stop.wait(self.period_s):
+            with self._lock:
+                stats = ScanLevelStats(
+                    self.level,
+                    self._reports,
+                    self._new_devices,
+                    self.ble_driver.ble_event_queue.qsize(),
+                    self.period_s,
+                )
+                self._reports = 0
+                self._new_devices = 0
+            self.history.append(stats)
+            level = self._next_level(stats)
+            if level != self.level:
+                logger.info("Scan level %d -> %d (%s)", self.level, level, stats)
+                self._apply(level)
+            elif not self.scanning:
+                # The last start failed; try again every period
+                self._apply(level)
+
+    def _next_level(self, stats):
+        saturated = (
+            stats.backlog > self.backlog_high
+            or stats.report_rate > self.max_report_rate
+        )
+        if saturated:
+            self._idle = 0
+            return max(self.level - 1, 0)
+
+        if stats.discovery_rate >= self.step_up_discovery_rate:
+            self._idle = 0
+            if stats.backlog <= self.backlog_low:
+                return min(self.level + 1, len(self.levels) - 1)
+            return self.level
+
+        if stats.new_devices == 0:
+            self._idle += 1
+            if self._idle >= self.idle_periods:
+                self._idle = 0
+                return max(self.level - 1, 0)
+        return self.level
+
+    def _apply(self, level, restart=True):
+        with self._apply_lock:
+            if restart:
+                try:
+                    self.ble_driver.ble_gap_scan_stop()
+                except NordicSemiException:
+                    pass  # not scanning
+            self.level = level
+            try:
+                self.ble_driver.ble_gap_scan_start(self.scan_params(level))
+                self.scanning = True
+            except NordicSemiException as e:
+                self.scanning = False
+                logger.error("Scan start at level %d failed: %s", level, e)
@@ -0,0 +1,244 @@
+"""
+Shared-memory event ring for consumers on the same host.
+
+ShmEventRing is an observer that copies advertising reports and
+notifications into a single-producer, multi-consumer byte ring in
+multiprocessing.shared_memory. Readers in other processes attach by name
+and read records in place: no socket, no syscall per event, and no
+coordination with the writer, which never waits for anybody.
+
+Layout: a 64 byte header (magic, capacity, write position, record count)
+followed by capacity bytes of records. A record is RECORD (size, payload
+length, sequence number, timestamp) plus the event encoded as in
+pc_ble_driver_py.broker, so broker.decode_event() reads both. Records are
+16-byte aligned; one that does not fit before the end of the ring starts
+again at offset 0, after a pad record if there is room for one.
+
+The write position only grows. The writer fills a record first and then
+publishes the new write position, so everything below it is complete. A
+reader copies a record and then checks that the writer cannot have reached
+it in the meantime (write position + WRITER_REACH <= read position +
+capacity); if it can have, the copy is discarded, the reader skips ahead
+to the current position, and the gap in sequence numbers is reported as
+lost. A reader that keeps up never loses anything and never blocks the
+writer.
+
+    ring = ShmEventRing("ble_events", capacity=1 << 20)
+    ble_driver.observer_register(ring)
+
+    reader = ShmRingReader("ble_events")
+    while True:
+        for record in reader.read(timeout=1.0):
+            name, event = decode_event(record.payload)
+"""
+import collections
+import logging
+import os
+import struct
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+from pc_ble_driver_py.broker import NO_ADV_TYPE, EVENTS, decode_event  # noqa: F401, for readers
+from pc_ble_driver_py.observers import BLEDriverObserver
+from pc_ble_driver_py.scan_history import encode_adv_data
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"BLER"
+HEADER = struct.Struct("<4sIQQQI")  # magic, version, capacity, write_pos, seq, writer pid
+HEADER_SIZE = 64
+WRITE_POS = struct.Struct("<Q")
+WRITE_POS_OFFSET = 16
+RECORD = struct.Struct("<IIQd")  # size, payload length, seq, timestamp
+ALIGN = 16
+PAD = 0xFFFFFFFF  # payload length of a pad record
+MAX_RECORD = 512  # largest record the writer produces, rounded up
+# How far past the published write position the writer may be writing: a
+# record that wraps pads out the end of the ring (up to a record's worth)
+# and then fills a whole record at offset 0
+WRITER_REACH = 2 * MAX_RECORD
+
+ShmRecord = collections.namedtuple("ShmRecord", "seq ts payload")
+
+
+def _aligned(size):
+    return (size + ALIGN - 1) & ~(ALIGN - 1)
+
+
+class ShmEventRing(BLEDriverObserver):
+    def __init__(self, name, capacity=1 << 20, clock=time.time):
+        super(ShmEventRing, self).__init__()
+        if capacity % ALIGN or capacity < 16 * MAX_RECORD:
+            raise ValueError("capacity must be a multiple of {} and at least {}".format(ALIGN, 16 * MAX_RECORD))
+        self.name = name
+        self.capacity = capacity
+        self.clock = clock
+        try:
+            # Left behind by a writer that did not close
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        self.shm = shared_memory.SharedMemory(name, create=True, size=HEADER_SIZE + capacity)
+        self.buf = self.shm.buf
+        self.write_pos = 0
+        self.seq = 0
+        self.too_large = 0
+        HEADER.pack_into(self.buf, 0, MAGIC, 1, capacity, 0, 0, os.getpid())
+
+    def publish(self, name, fields, data=b""):
+        """Append one event; returns its sequence number."""
+        code, layout, _ = EVENTS[name]
+        payload_len = 1 + layout.size + len(data)
+        size = _aligned(RECORD.size + payload_len)
+        if size > MAX_RECORD:
+            self.too_large += 1
+            return None
+
+        pos = self.write_pos
+        offset = pos % self.capacity
+        if offset + size > self.capacity:
+            # Too little room left for even a pad record means the same
+            if self.capacity - offset >= RECORD.size:
+                RECORD.pack_into(self.buf, HEADER_SIZE + offset, self.capacity - offset, PAD, 0, 0.0)
+            pos += self.capacity - offset
+            offset = 0
+
+        start = HEADER_SIZE + offset
+        self.seq += 1
+        RECORD.pack_into(self.buf, start, size, payload_len, self.seq, self.clock())
+        start += RECORD.size
+        self.buf[start] = code
+        layout.pack_into(self.buf, start + 1, *fields)
+        start += 1 + layout.size
+        self.buf[start:start + len(data)] = data
+
+        # Publish: the record is complete before the position moves past it
+        self.write_pos = pos + size
+        WRITE_POS.pack_into(self.buf, WRITE_POS_OFFSET, self.write_pos)
+        WRITE_POS.pack_into(self.buf, WRITE_POS_OFFSET + 8, self.seq)
+        return self.seq
+
+    def on_gap_evt_adv_report(self, ble_driver, conn_handle, peer_addr, rssi, adv_type, adv_data):
+        addr = bytes(peer_addr.addr)
+        self.publish(
+            "adv_report",
+            (conn_handle, getattr(peer_addr.addr_type, "value", peer_addr.addr_type), addr, rssi,
+             NO_ADV_TYPE if adv_type is None else adv_type.value),
+            encode_adv_data(adv_data),
+        )
+
+    def on_gattc_evt_hvx(self, ble_driver, conn_handle, status, error_handle, attr_handle, hvx_type, data):
+        self.publish(
+            "hvx",
+            (conn_handle, getattr(status, "value", status), error_handle, attr_handle,
+             getattr(hvx_type, "value", hvx_type)),
+            bytes(data),
+        )
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+class ShmRingReader(object):
+    def __init__(self, name, from_start=False):
+        """from_start: begin at the oldest record still in the ring instead
+        of the next one written."""
+        self.shm = shared_memory.SharedMemory(name)
+        # Attaching registers the segment with this process' resource
+        # tracker, which would unlink it at exit; it belongs to the writer
+        resource_tracker.unregister(self.shm._name, "shared_memory")
+        self.buf = self.shm.buf
+        magic, _, self.capacity, _, _, self.writer_pid = HEADER.unpack_from(self.buf)
+        if magic != MAGIC:
+            raise ValueError("{}: not an event ring".format(name))
+
+        self.lost = 0
+        self.overruns = 0
+        self.records = 0
+        self.next_seq = None
+        self.read_pos = self._write_pos()
+        if from_start and self.read_pos <= self.capacity - WRITER_REACH:
+            # Record boundaries are only known from 0, so this works until
+            # the writer wraps; later readers start at the current position
+            self.read_pos = 0
+
+    def _write_pos(self):
+        # A 64-bit value may be written in two halves on 32-bit ARM: read
+        # until two reads agree
+        while True:
+            first = WRITE_POS.unpack_from(self.buf, WRITE_POS_OFFSET)[0]
+            second = WRITE_POS.unpack_from(self.buf, WRITE_POS_OFFSET)[0]
+            if first == second:
+                return first
+
+    @property
+    def backlog(self):
+        """Bytes written that this reader has not consumed."""
+        return self._write_pos() - self.read_pos
+
+    def _overrun(self, write_pos):
+        # Skipped records show up as a sequence gap on the next read
+        self.overruns += 1
+        self.read_pos = write_pos
+
+    def read(self, max_records=1024, timeout=0.0, poll_s=0.001):
+        """Records written since the last call, oldest first. Waits up to
+        timeout seconds for the first one, checking every poll_s."""
+        deadline = time.monotonic() + timeout
+        write_pos = self._write_pos()
+        while write_pos == self.read_pos:
+            if time.monotonic() >= deadline:
+                return []
+            time.sleep(poll_s)
+            write_pos = self._write_pos()
+
+        records = []
+        buf = self.buf
+        while self.read_pos < write_pos and len(records) < max_records:
+            if write_pos - self.read_pos > self.capacity - WRITER_REACH:
+                self._overrun(write_pos)
+                break
+            offset = self.read_pos % self.capacity
+            if self.capacity - offset < RECORD.size:
+                self.read_pos += self.capacity - offset
+                continue
+            start = HEADER_SIZE + offset
+            size, payload_len, seq, ts = RECORD.unpack_from(buf, start)
+            payload = None
+            if payload_len != PAD:
+                payload = bytes(buf[start + RECORD.size:start + RECORD.size + payload_len])
+
+            # Valid only if the writer cannot have reached this record
+            # while it was being copied
+            write_pos = self._write_pos()
+            if write_pos + WRITER_REACH > self.read_pos + self.capacity or not size:
+                self._overrun(write_pos)
+                break
+
+            self.read_pos += size
+            if payload is None:
+                continue
+            if self.next_seq is not None and seq != self.next_seq:
+                self.lost += seq - self.next_seq
+            self.next_seq = seq + 1
+            self.records += 1
+            records.append(ShmRecord(seq, ts, payload))
+        return records
+
+    def stats(self):
+        seq = WRITE_POS.unpack_from(self.buf, WRITE_POS_OFFSET + 8)[0]
+        return {
+            "records": self.records,
+            "lost": self.lost,
+            "overruns": self.overruns,
+            "backlog": self.backlog,
+            "writer_seq": seq,
+        }
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
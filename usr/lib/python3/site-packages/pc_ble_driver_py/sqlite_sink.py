@@ -0,0 +1,257 @@
+"""
+Batched SQLite sink for scan and connection events.
+
+Committing from inside an observer stalls the event dispatcher for the
+length of a flash write. SqliteSink only appends a tuple per event from
+the dispatcher thread; a writer thread owning the connection (WAL mode,
+synchronous=NORMAL) takes everything buffered whenever batch_size events
+are waiting or flush_s has passed, and writes it in one transaction with
+executemany. The same transaction upserts a per-device summary row, from
+one aggregated row per address in the batch.
+
+    sink = SqliteSink("/data/ble_events.db")
+    ble_driver.observer_register(sink)
+    ...
+    print(sink.stats())
+    sink.close()
+
+If the writer falls behind by more than max_backlog events, the oldest
+advertising reports are dropped and counted; connection events are never
+dropped.
+"""
+import collections
+import logging
+import sqlite3
+import time
+from threading import Condition, Thread
+
+from pc_ble_driver_py.observers import BLEDriverObserver
+from pc_ble_driver_py.scan_history import encode_adv_data
+
+logger = logging.getLogger(__name__)
+
+# AD types of the complete and shortened local name
+NAME_AD_TYPES = (0x09, 0x08)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS adv_reports (
+    ts REAL NOT NULL,
+    addr TEXT NOT NULL,
+    addr_type INTEGER,
+    rssi INTEGER,
+    adv_type INTEGER,
+    data BLOB
+);
+CREATE INDEX IF NOT EXISTS adv_reports_addr_ts ON adv_reports (addr, ts);
+CREATE TABLE IF NOT EXISTS conn_events (
+    ts REAL NOT NULL,
+    event TEXT NOT NULL,
+    conn_handle INTEGER,
+    addr TEXT,
+    reason INTEGER
+);
+CREATE TABLE IF NOT EXISTS devices (
+    addr TEXT PRIMARY KEY,
+    addr_type INTEGER,
+    name TEXT,
+    first_seen REAL,
+    last_seen REAL,
+    reports INTEGER,
+    last_rssi INTEGER,
+    min_rssi INTEGER,
+    max_rssi INTEGER
+);
+"""
+
+INSERT_ADV = "INSERT INTO adv_reports VALUES (?, ?, ?, ?, ?, ?)"
+INSERT_CONN = "INSERT INTO conn_events VALUES (?, ?, ?, ?, ?)"
+UPSERT_DEVICE = """
+INSERT INTO devices VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (addr) DO UPDATE SET
+    addr_type = excluded.addr_type,
+    name = coalesce(excluded.name, name),
+    last_seen = excluded.last_seen,
+    reports = reports + excluded.reports,
+    last_rssi = excluded.last_rssi,
+    min_rssi = min(min_rssi, excluded.min_rssi),
+    max_rssi = max(max_rssi, excluded.max_rssi)
+"""
+
+
+def addr_str(peer_addr):
+    return ":".join("{:02X}".format(b) for b in peer_addr.addr)
+
+
+def adv_name(adv_data):
+    for ad_type, value in adv_data.records.items():
+        if getattr(ad_type, "value", ad_type) in NAME_AD_TYPES:
+            return bytes(value).decode("utf-8", "replace")
+    return None
+
+
+class SqliteSink(BLEDriverObserver):
+    def __init__(self, path, batch_size=500, flush_s=1.0, max_backlog=100000, clock=time.time):
+        super(SqliteSink, self).__init__()
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_s = flush_s
+        self.max_backlog = max_backlog
+        self.clock = clock
+
+        self._cond = Condition()
+        self._adv = collections.deque()
+        self._conn = []
+        self._conn_addr = dict()  # conn_handle -> address, for disconnects
+        self._stop = False
+        self._flush_requested = 0
+        self._flushed = 0
+
+        self.flushes = 0
+        self.rows_written = 0
+        self.dropped = 0
+        self.write_errors = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+        self.max_backlog_seen = 0
+
+        # Created here so schema errors surface in the caller
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+
+        self._writer = Thread(target=self._write_loop, name="SqliteSinkWriter")
+        self._writer.daemon = True
+        self._writer.start()
+
+    @property
+    def backlog(self):
+        return len(self._adv) + len(self._conn)
+
+    def _queued(self):
+        backlog = self.backlog
+        if backlog > self.max_backlog_seen:
+            self.max_backlog_seen = backlog
+        if backlog >= self.batch_size:
+            self._cond.notify_all()
+
+    def on_gap_evt_adv_report(self, ble_driver, conn_handle, peer_addr, rssi, adv_type, adv_data):
+        addr_type = getattr(peer_addr.addr_type, "value", peer_addr.addr_type)
+        row = (
+            self.clock(),
+            addr_str(peer_addr),
+            addr_type,
+            rssi,
+            None if adv_type is None else adv_type.value,
+            bytes(encode_adv_data(adv_data)),
+            adv_name(adv_data),
+        )
+        with self._cond:
+            if len(self._adv) >= self.max_backlog:
+                self._adv.popleft()
+                self.dropped += 1
+            self._adv.append(row)
+            self._queued()
+
+    def on_gap_evt_connected(self, ble_driver, conn_handle, peer_addr, role, conn_params):
+        addr = addr_str(peer_addr)
+        with self._cond:
+            self._conn_addr[conn_handle] = addr
+            self._conn.append((self.clock(), "connected", conn_handle, addr, None))
+            self._queued()
+
+    def on_gap_evt_disconnected(self, ble_driver, conn_handle, reason):
+        with self._cond:
+            addr = self._conn_addr.pop(conn_handle, None)
+            self._conn.append(
+                (self.clock(), "disconnected", conn_handle, addr, getattr(reason, "value", reason))
+            )
+            self._queued()
+
+    def flush(self, timeout=None):
+        """Write everything buffered now; wait until it is committed."""
+        with self._cond:
+            self._flush_requested += 1
+            target = self._flush_requested
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: self._flushed >= target or self._stop, timeout)
+
+    def close(self):
+        self.flush()
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        self._writer.join()
+        self._db.close()
+
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._stop
+                    or self.backlog >= self.batch_size
+                    or self._flush_requested > self._flushed,
+                    self.flush_s,
+                )
+                if self._stop:
+                    return
+                if not self.backlog and self._flush_requested == self._flushed:
+                    continue
+                adv, self._adv = self._adv, collections.deque()
+                conn, self._conn = self._conn, []
+                requested = self._flush_requested
+
+            self._write(adv, conn)
+
+            with self._cond:
+                self._flushed = requested
+                self._cond.notify_all()
+
+    def _write(self, adv, conn):
+        devices = dict()
+        for ts, addr, addr_type, rssi, _, _, name in adv:
+            device = devices.get(addr)
+            if device is None:
+                devices[addr] = [addr, addr_type, name, ts, ts, 1, rssi, rssi, rssi]
+            else:
+                device[1] = addr_type
+                device[2] = name or device[2]
+                device[4] = ts
+                device[5] += 1
+                device[6] = rssi
+                device[7] = min(device[7], rssi)
+                device[8] = max(device[8], rssi)
+
+        start = time.monotonic()
+        try:
+            with self._db:
+                self._db.executemany(INSERT_ADV, (row[:6] for row in adv))
+                self._db.executemany(INSERT_CONN, conn)
+                self._db.executemany(UPSERT_DEVICE, devices.values())
+        except sqlite3.Error as e:
+            self.write_errors += 1
+            logger.error("SQLite sink: dropping %d events, %s", len(adv) + len(conn), e)
+            return
+        elapsed = (time.monotonic() - start) * 1000.0
+
+        self.flushes += 1
+        self.rows_written += len(adv) + len(conn)
+        self.last_flush_ms = elapsed
+        self.total_flush_ms += elapsed
+        if elapsed > self.max_flush_ms:
+            self.max_flush_ms = elapsed
+
+    def stats(self):
+        return {
+            "flushes": self.flushes,
+            "rows": self.rows_written,
+            "backlog": self.backlog,
+            "max_backlog": self.max_backlog_seen,
+            "dropped": self.dropped,
+            "write_errors": self.write_errors,
+            "last_flush_ms": self.last_flush_ms,
+            "max_flush_ms": self.max_flush_ms,
+            "avg_flush_ms": self.total_flush_ms / self.flushes if self.flushes else 0.0,
+        }
@@ -0,0 +1,108 @@
+"""
+Adapter-scoped record of vendor specific UUID bases.
+
+Every sd_ble_uuid_vs_add and sd_ble_uuid_decode is a serial round-trip,
+and applications repeat both on each connection and service discovery
+because a BLEUUIDBase does not know whether its base is already in the
+SoftDevice's table. BLEDriver keeps one UUIDBaseRegistry per adapter:
+
+- a base that is already registered gets its uuid_type from here, without
+  an RPC;
+- a 128-bit UUID on a registered base decodes here too, and one whose base
+  the adapter does not know (NOT_FOUND, or type UNKNOWN) is remembered as
+  such until a base is added, so discovery does not ask again for every
+  attribute of a vendor service nobody registered;
+- the SoftDevice forgets its table on reset, so reset() marks every base
+  unregistered and BLEDriver registers them again, in the original order,
+  after the next successful ble_enable.
+
+The SoftDevice ignores bytes 12-13 of a base (the 16-bit UUID), so they are
+masked out of the keys, as the SoftDevice itself compares them.
+"""
+import collections
+from threading import Lock
+
+# Indices of bytes 12-13 (little endian) in the MSB-first lists BLEUUIDBase uses
+UUID16_INDICES = (2, 3)
+
+
+def base_key(base):
+    """Hashable key for a 16 byte MSB-first base or UUID, 16-bit part masked."""
+    key = bytearray(base)
+    for i in UUID16_INDICES:
+        key[i] = 0
+    return bytes(key)
+
+
+class UUIDBaseRegistry(object):
+    def __init__(self):
+        self.lock = Lock()
+        self.bases = collections.OrderedDict()  # key -> uuid_type, registration order
+        self.registered = set()  # keys in the adapter's table right now
+        self.unknown = dict()  # 16 byte UUID -> (err_code, uuid_type) of a decode that found no base
+        self.rpcs = 0
+        self.saved = 0
+
+    def lookup_base(self, base):
+        """uuid_type of a base registered on the adapter, or None."""
+        key = base_key(base)
+        with self.lock:
+            if key in self.registered:
+                self.saved += 1
+                return self.bases[key]
+        return None
+
+    def add_base(self, base, uuid_type):
+        key = base_key(base)
+        with self.lock:
+            self.rpcs += 1
+            self.bases[key] = uuid_type
+            self.registered.add(key)
+            # Decodes that found no base may find this one now
+            self.unknown.clear()
+
+    def lookup_uuid(self, uuid_list):
+        """uuid_type of a 16 byte UUID on a registered base, or None."""
+        key = base_key(uuid_list)
+        with self.lock:
+            if key in self.registered:
+                self.saved += 1
+                return self.bases[key]
+        return None
+
+    def lookup_unknown(self, uuid_list):
+        """(err_code, uuid_type) of an earlier decode of this UUID that
+        found no base, or None."""
+        with self.lock:
+            result = self.unknown.get(bytes(uuid_list))
+            if result is not None:
+                self.saved += 1
+            return result
+
+    def add_unknown(self, uuid_list, err_code, uuid_type):
+        with self.lock:
+            self.rpcs += 1
+            self.unknown[bytes(uuid_list)] = (err_code, uuid_type)
+
+    def reset(self):
+        """The adapter's table is gone (adapter reset, reopen)."""
+        with self.lock:
+            self.registered.clear()
+            self.unknown.clear()
+
+    def pending(self):
+        """(base, uuid_type) of known bases not registered on the adapter,
+        in the order they were first registered."""
+        with self.lock:
+            return [(list(key), uuid_type) for key, uuid_type in self.bases.items()
+                    if key not in self.registered]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "bases": len(self.bases),
+                "registered": len(self.registered),
+                "unknown": len(self.unknown),
+                "rpcs": self.rpcs,
+                "saved": self.saved,
+            }
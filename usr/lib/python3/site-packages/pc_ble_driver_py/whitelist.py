@@ -0,0 +1,270 @@
+"""
+Scan only for a managed set of devices, filtered by the SoftDevice.
+
+With a whitelist in place the controller drops every other advertiser, so
+their reports never cross the serial link or reach the dispatcher.
+WhitelistScanner keeps the SoftDevice whitelist in sync with a device set
+that can change at any time (add/remove/set_devices) and scans with
+use_whitelist.
+
+The SoftDevice whitelist holds at most BLE_GAP_WHITELIST_ADDR_MAX_COUNT (8)
+addresses. Larger sets are split into groups that take turns, slice_s
+seconds each, so every device is listened for in one slice out of
+len(groups); keep slice_s well above the devices' advertising interval.
+
+Reports that were filtered out cannot be counted directly. Every
+sample_every_s the scanner runs sample_s without the whitelist and measures
+the report rate of all advertisers and of the managed ones; the difference,
+times the time spent whitelisted, is reported as stats.saved_estimate.
+Observers do see the unfiltered reports of those sample windows.
+
+    scanner = WhitelistScanner(ble_driver, devices=known_tags)
+    scanner.start()
+    scanner.add(BLEGapAddr(BLEGapAddr.Types.random_static, [...]))
+    ...
+    scanner.stop()
+    print(scanner.stats)
+"""
+import logging
+import time
+from threading import Event, Lock, Thread
+
+from pc_ble_driver_py.ble_driver import BLEGapScanParams, BLEGapTimeoutSrc, driver
+from pc_ble_driver_py.exceptions import NordicSemiException
+from pc_ble_driver_py.observers import BLEDriverObserver
+
+logger = logging.getLogger(__name__)
+
+
+def _key(peer_addr):
+    return (getattr(peer_addr.addr_type, "value", peer_addr.addr_type), tuple(peer_addr.addr))
+
+
+class WhitelistStats(object):
+    def __init__(self):
+        self.whitelist_sets = 0
+        self.whitelist_errors = 0
+        self.whitelisted_reports = 0
+        self.whitelisted_time_s = 0.0
+        self.samples = 0
+        self.sample_reports = 0
+        self.sample_managed_reports = 0
+        self.sample_time_s = 0.0
+        self.total_rate = None  # reports/s from all advertisers, last sample
+        self.managed_rate = None  # reports/s from managed devices, last sample
+        self.saved_estimate = 0.0
+
+    def __str__(self):
+        return (
+            "whitelisted_reports({0.whitelisted_reports}) time({0.whitelisted_time_s:.1f}s) "
+            "sets({0.whitelist_sets}) errors({0.whitelist_errors}) samples({0.samples}) "
+            "rate all({1}) managed({2}) saved_estimate({0.saved_estimate:.0f})".format(
+                self,
+                "-" if self.total_rate is None else "{:.1f}/s".format(self.total_rate),
+                "-" if self.managed_rate is None else "{:.1f}/s".format(self.managed_rate),
+            )
+        )
+
+
+class WhitelistScanner(BLEDriverObserver):
+    def __init__(
+        self,
+        ble_driver,
+        scan_params=None,
+        devices=(),
+        slice_s=2.0,
+        sample_every_s=60.0,
+        sample_s=2.0,
+    ):
+        """sample_every_s=0 disables the unfiltered sample windows."""
+        super(WhitelistScanner, self).__init__()
+        self.ble_driver = ble_driver
+        self.scan_params = scan_params or BLEGapScanParams(interval_ms=100, window_ms=50, timeout_s=0)
+        self.slice_s = slice_s
+        self.sample_every_s = sample_every_s
+        self.sample_s = sample_s
+        self.max_count = driver.BLE_GAP_WHITELIST_ADDR_MAX_COUNT
+
+        self.devices = dict()  # key -> BLEGapAddr
+        self.last_seen = dict()  # key -> time.monotonic()
+        self.stats = WhitelistStats()
+        self.sampling = False
+        self._applied = None  # keys currently in the SoftDevice whitelist
+        self._group = 0
+        self._lock = Lock()
+        self._changed = Event()
+        self._restart = Event()  # scan timed out, the worker starts it again
+        self._stop = Event()
+        self._worker = None
+        self.set_devices(devices)
+
+    def add(self, peer_addr):
+        with self._lock:
+            self.devices[_key(peer_addr)] = peer_addr
+        self._changed.set()
+
+    def remove(self, peer_addr):
+        with self._lock:
+            self.devices.pop(_key(peer_addr), None)
+        self._changed.set()
+
+    def set_devices(self, addresses):
+        with self._lock:
+            self.devices = {_key(a): a for a in addresses}
+        self._changed.set()
+
+    def groups(self):
+        with self._lock:
+            keys = sorted(self.devices)
+            return [
+                [self.devices[k] for k in keys[i:i + self.max_count]]
+                for i in range(0, len(keys), self.max_count)
+            ]
+
+    def start(self):
+        self.ble_driver.observer_register(self)
+        self._stop.clear()
+        self._worker = Thread(target=self._run, name="WhitelistScanner")
+        self._worker.daemon = True
+        self._worker.start()
+
+    def stop(self):
+        self._stop.set()
+        self._changed.set()
+        if self._worker:
+            self._worker.join()
+            self._worker = None
+        self._scan_stop()
+        self.ble_driver.observer_unregister(self)
+
+    def on_gap_evt_adv_report(self, ble_driver, conn_handle, peer_addr, rssi, adv_type, adv_data):
+        key = _key(peer_addr)
+        with self._lock:
+            managed = key in self.devices
+            if managed:
+                self.last_seen[key] = time.monotonic()
+            if self.sampling:
+                self.stats.sample_reports += 1
+                if managed:
+                    self.stats.sample_managed_reports += 1
+            else:
+                self.stats.whitelisted_reports += 1
+
+    def on_gap_evt_timeout(self, ble_driver, conn_handle, src):
+        # Restarting here could land between the worker's scan stop and
+        # whitelist update; leave it to the worker
+        if src == BLEGapTimeoutSrc.scan and not self._stop.is_set():
+            self._restart.set()
+            self._changed.set()
+
+    def _run(self):
+        next_sample = time.monotonic() if self.sample_every_s else None
+        while not self._stop.is_set():
+            if next_sample is not None and time.monotonic() >= next_sample:
+                self._sample()
+                next_sample = time.monotonic() + self.sample_every_s
+                continue
+
+            self._changed.clear()
+            if self._restart.is_set():
+                self._restart.clear()
+                self._applied = None
+            groups = self.groups()
+            if not groups:
+                self._scan_stop()
+                self._applied = None
+                self._changed.wait(1.0)
+                continue
+
+            self._group %= len(groups)
+            group = groups[self._group]
+            self._group += 1
+            if not self._apply(group):
+                self._stop.wait(self.slice_s)
+                continue
+
+            # A single group stays until the set changes or a sample is due
+            wait = self.slice_s if len(groups) > 1 else 1.0
+            start = time.monotonic()
+            while not self._stop.is_set():
+                self._changed.wait(wait)
+                if self._changed.is_set() or len(groups) > 1:
+                    break
+                if next_sample is not None and time.monotonic() >= next_sample:
+                    break
+            self._account(time.monotonic() - start)
+
+    def _apply(self, group):
+        keys = sorted(_key(a) for a in group)
+        if keys == self._applied:
+            return True
+        # The whitelist cannot change under a running whitelisted scan
+        self._scan_stop()
+        try:
+            self.ble_driver.ble_gap_whitelist_set(group)
+        except NordicSemiException as e:
+            self.stats.whitelist_errors += 1
+            self._applied = None
+            logger.error("Whitelist update failed: %s", e)
+            return False
+        self.stats.whitelist_sets += 1
+        if not self._scan(use_whitelist=True):
+            self._applied = None  # set it and try the scan again next slice
+            return False
+        self._applied = keys
+        return True
+
+    def _account(self, elapsed):
+        self.stats.whitelisted_time_s += elapsed
+        if self.stats.total_rate is not None:
+            self.stats.saved_estimate += elapsed * max(0.0, self.stats.total_rate - self.stats.managed_rate)
+
+    def _sample(self):
+        with self._lock:
+            reports = self.stats.sample_reports
+            managed = self.stats.sample_managed_reports
+        self._scan_stop()
+        self._applied = None
+        start = time.monotonic()
+        if not self._scan(use_whitelist=False):
+            with self._lock:
+                self.sampling = False
+            return
+        self._stop.wait(self.sample_s)
+        self._scan_stop()
+        elapsed = time.monotonic() - start
+        with self._lock:
+            self.sampling = False
+            stats = self.stats
+            stats.samples += 1
+            stats.sample_time_s += elapsed
+            stats.total_rate = (stats.sample_reports - reports) / elapsed
+            stats.managed_rate = (stats.sample_managed_reports - managed) / elapsed
+        logger.debug("Whitelist sample: %s", self.stats)
+
+    def _scan(self, use_whitelist):
+        """Start scanning; False (logged) if the SoftDevice refused, e.g.
+        while a connection is being initiated."""
+        params = self.scan_params
+        with self._lock:
+            self.sampling = not use_whitelist
+        try:
+            self.ble_driver.ble_gap_scan_start(
+                BLEGapScanParams(
+                    interval_ms=params.interval_ms,
+                    window_ms=params.window_ms,
+                    timeout_s=params.timeout_s,
+                    active=params.active,
+                    use_whitelist=use_whitelist,
+                )
+            )
+        except NordicSemiException as e:
+            logger.error("Scan start failed: %s", e)
+            return False
+        return True
+
+    def _scan_stop(self):
+        try:
+            self.ble_driver.ble_gap_scan_stop()
+        except NordicSemiException:
+            pass  # not scanning